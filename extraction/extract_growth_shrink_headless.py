@@ -0,0 +1,267 @@
+"""
+Growth/shrinkage extraction without Fiji (plain python with numpy, scipy and tifffile).
+Same parameters and outputs as extract_growth_shrink_batch.py:
+
+    python extract_growth_shrink_headless.py movie.tif --sigma_t 1.5 --sigma_xy 0.5
+    python extract_growth_shrink_headless.py input_dir --extensions "*.tif; *.tf8"
+    python extract_growth_shrink_headless.py large_movie.tif --block_frames 32 --workers 8
+
+writes <name>_shrinkage.tiff and <name>_growth.tiff next to each input (ImageJ tiff
+with the pixel width and frame interval of the input, or the ones given).
+With --block_frames the movie is memory mapped and processed block_frames frames at a
+time, the outputs are written block by block (for movies larger than memory).
+--workers smooths tiles of the movie on several threads (identical outputs).
+--gaussian_t iir (or --gaussian_xy iir) uses a recursive Gaussian, for large sigmas
+"""
+from __future__ import print_function, division
+
+__author__ = "christoph.sommer@ist.ac.at"
+
+import os
+import sys
+import glob
+import argparse
+import contextlib
+import numpy as np
+
+def get_script_patch():
+    import inspect
+    return os.path.dirname(os.path.abspath(inspect.getsourcefile(lambda:0)))
+
+sys.path.append(get_script_patch())
+from src.temporal_gradient_numpy import smooth_temporal_gradient, iter_temporal_gradient, frame_range, GAUSSIAN_METHODS
+
+
+def require_tifffile():
+    try:
+        import tifffile
+    except ImportError:
+        sys.exit("reading and writing tiff files needs tifffile (pip install tifffile)")
+    return tifffile
+
+
+def input_files(paths, img_extensions):
+    """
+    Files given directly or matching the extensions inside the given folders
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for filt in img_extensions.split(";"):
+            if len(filt.strip()) > 0:
+                files += sorted(glob.glob(os.path.join(path, filt.strip())))
+    return files
+
+
+def calibration(tif):
+    """
+    Pixel width and frame interval of an open tifffile.TiffFile (None if unknown)
+    """
+    metadata = tif.imagej_metadata or {}
+    page = tif.pages[0]
+    pixel_width = None
+    if 'XResolution' in page.tags:
+        numerator, denominator = page.tags['XResolution'].value
+        if numerator > 0:
+            pixel_width = denominator / numerator
+    return pixel_width, metadata.get('finterval')
+
+
+def read_movie(fn):
+    """
+    Returns the movie as (t, y, x) array, the pixel width and the frame interval (None if unknown)
+    """
+    tifffile = require_tifffile()
+    with tifffile.TiffFile(fn) as tif:
+        img = tif.asarray()
+        pixel_width, frame_interval = calibration(tif)
+
+    img = img.squeeze()
+    if img.ndim != 3:
+        raise ValueError("Input data needs to be 3-dimensional, 2D + time (got shape {})".format(img.shape))
+    return img, pixel_width, frame_interval
+
+
+class TiffFrames(object):
+    """
+    Frames of a tiff that cannot be memory mapped (e.g. compressed), read page by page
+    when sliced: frames[start:end] (or frames[start:end, y_slice, x_slice]) is a (t, y, x) array
+    """
+    def __init__(self, tif, shape):
+        self.tif = tif
+        self.shape = shape
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        start, end, step = key[0].indices(self.shape[0])
+        if start >= end:
+            frames = np.zeros((0,) + self.shape[1:], dtype=self.tif.series[0].dtype)
+        else:
+            frames = self.tif.asarray(key=range(start, end, step)).reshape((-1,) + self.shape[1:])
+        return frames[(slice(None),) + key[1:]]
+
+
+@contextlib.contextmanager
+def open_movie(fn):
+    """
+    Like read_movie, but without reading the frames: the movie is a (t, y, x) memory map,
+    or TiffFrames if the tiff cannot be memory mapped
+    """
+    tifffile = require_tifffile()
+    with tifffile.TiffFile(fn) as tif:
+        pixel_width, frame_interval = calibration(tif)
+        shape = tuple(n for n in tif.series[0].shape if n > 1)
+        if len(shape) != 3:
+            raise ValueError("Input data needs to be 3-dimensional, 2D + time (got shape {})".format(tif.series[0].shape))
+
+        try:
+            frames = tifffile.memmap(fn, mode='r').reshape(shape)
+        except ValueError:
+            if len(tif.pages) != shape[0]:
+                raise ValueError("Movies that cannot be memory mapped need one page per frame")
+            frames = TiffFrames(tif, shape)
+        yield frames, pixel_width, frame_interval
+
+
+def imagej_calibration(pixel_width, frame_interval):
+    """
+    resolution and metadata arguments of tifffile.imwrite for a (t, y, x) ImageJ tiff
+    """
+    metadata = {'axes': 'TYX'}
+    resolution = None
+    if pixel_width:
+        metadata['unit'] = 'micron'
+        resolution = (1. / pixel_width, 1. / pixel_width)
+    if frame_interval:
+        metadata['finterval'] = frame_interval
+    return resolution, metadata
+
+
+def save_movie(fn, img, pixel_width, frame_interval):
+    """
+    Saves a (t, y, x) movie as ImageJ tiff with calibration
+    """
+    tifffile = require_tifffile()
+    resolution, metadata = imagej_calibration(pixel_width, frame_interval)
+    tifffile.imwrite(fn, img, imagej=True, resolution=resolution, metadata=metadata)
+
+
+def create_movie(fn, shape, dtype, pixel_width, frame_interval):
+    """
+    Creates an empty (t, y, x) ImageJ tiff with calibration and returns the file offset
+    of its (contiguous) pixel data, to be filled block by block with write_frames
+    """
+    tifffile = require_tifffile()
+    resolution, metadata = imagej_calibration(pixel_width, frame_interval)
+    tifffile.imwrite(fn, shape=shape, dtype=dtype, imagej=True, resolution=resolution, metadata=metadata)
+    with tifffile.TiffFile(fn) as tif:
+        return tif.series[0].dataoffset
+
+
+def write_frames(f, offset, block, first_frame):
+    """
+    Writes the (t, y, x) block to the file f created by create_movie from frame first_frame on
+    """
+    f.seek(offset + first_frame * block[0].nbytes)
+    f.write(np.ascontiguousarray(block, dtype=block.dtype.newbyteorder('<')).tobytes())
+
+
+def process_file(fn, sigma_xy, sigma_t, frame_start=0, frame_end=-1, normalize_output=True,
+                 pixel_width=-1, frame_interval=-1, block_frames=None, n_workers=1, gaussian_t='fir', gaussian_xy='fir'):
+    if block_frames:
+        return process_file_blockwise(fn, sigma_xy, sigma_t, frame_start, frame_end, normalize_output,
+                                      pixel_width, frame_interval, block_frames, n_workers, gaussian_t, gaussian_xy)
+
+    img, file_pixel_width, file_frame_interval = read_movie(fn)
+    pixel_width = pixel_width if pixel_width > 0 else file_pixel_width
+    frame_interval = frame_interval if frame_interval > 0 else file_frame_interval
+
+    out = smooth_temporal_gradient(img, sigma_xy, sigma_t, frame_start, frame_end, normalize_output, n_workers,
+                                   gaussian_t, gaussian_xy)
+
+    fn_basename = os.path.splitext(fn)[0]
+    save_movie("{}_shrinkage.tiff".format(fn_basename), out[:, 0], pixel_width, frame_interval)
+    save_movie("{}_growth.tiff".format(fn_basename), out[:, 1], pixel_width, frame_interval)
+    print("{} processed".format(fn_basename))
+
+
+def process_file_blockwise(fn, sigma_xy, sigma_t, frame_start=0, frame_end=-1, normalize_output=True,
+                           pixel_width=-1, frame_interval=-1, block_frames=32, n_workers=1, gaussian_t='fir',
+                           gaussian_xy='fir'):
+    """
+    Same outputs as process_file, block_frames frames at a time (see iter_temporal_gradient)
+    """
+    with open_movie(fn) as (frames, file_pixel_width, file_frame_interval):
+        pixel_width = pixel_width if pixel_width > 0 else file_pixel_width
+        frame_interval = frame_interval if frame_interval > 0 else file_frame_interval
+
+        start, end = frame_range(frames, frame_start, frame_end)
+        shape = (max(end - start - 2, 0),) + tuple(frames.shape[1:])
+        dtype = np.uint8 if normalize_output else np.float32
+
+        fn_basename = os.path.splitext(fn)[0]
+        outputs = ["{}_shrinkage.tiff".format(fn_basename), "{}_growth.tiff".format(fn_basename)]
+        offsets = [create_movie(out_fn, shape, dtype, pixel_width, frame_interval) for out_fn in outputs]
+
+        with open(outputs[0], 'r+b') as f_shrink, open(outputs[1], 'r+b') as f_grow:
+            frame = 0
+            for shrink, grow in iter_temporal_gradient(frames, sigma_xy, sigma_t, frame_start, frame_end,
+                                                       normalize_output, block_frames, n_workers, gaussian_t,
+                                                       gaussian_xy):
+                write_frames(f_shrink, offsets[0], shrink, frame)
+                write_frames(f_grow, offsets[1], grow, frame)
+                frame += len(shrink)
+
+    print("{} processed".format(fn_basename))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="growth / shrinkage speckles by smoothed temporal gradient (no Fiji needed)")
+    parser.add_argument('inputs', nargs='+', help="time-lapse movies (2D + time tiff) or folders containing several")
+    parser.add_argument('--extensions', default='*.tif; *.tf8', help="file patterns used in folders (default: '*.tif; *.tf8')")
+    parser.add_argument('--sigma_t', type=float, default=1.5, help="sigma in time (frames), default 1.5")
+    parser.add_argument('--sigma_xy', type=float, default=0.5, help="sigma in space (pixel), default 0.5")
+    parser.add_argument('--frame_start', type=int, default=0, help="start frame (default 0)")
+    parser.add_argument('--frame_end', type=int, default=-1, help="end frame (default -1 for last frame)")
+    parser.add_argument('--no_normalize', action='store_true', help="keep float32 outputs instead of rescaling to uint8")
+    parser.add_argument('--pixel_width', type=float, default=-1, help="pixel width in microns (default: from the file)")
+    parser.add_argument('--frame_interval', type=float, default=-1, help="frame interval in seconds (default: from the file)")
+    parser.add_argument('--block_frames', type=int, default=None,
+                        help="memory map the movie and process this many frames at a time (for movies larger than memory)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="threads smoothing tiles of the movie in parallel (0 for all cores, default 1); same results")
+    parser.add_argument('--gaussian_t', choices=GAUSSIAN_METHODS, default='fir',
+                        help="temporal Gaussian: 'fir' (Gauss3 as in Fiji, default) or 'iir' (recursive, same speed for any sigma)")
+    parser.add_argument('--gaussian_xy', choices=GAUSSIAN_METHODS, default='fir', help="spatial Gaussian, as --gaussian_t")
+    args = parser.parse_args(argv)
+    if args.block_frames is not None and args.block_frames < 1:
+        parser.error("--block_frames must be at least 1")
+    if args.workers < 0:
+        parser.error("--workers must be 0 (all cores) or more")
+
+    files = input_files(args.inputs, args.extensions)
+    if len(files) == 0:
+        print("No files found in '{}' for extensions '{}'".format(' '.join(args.inputs), args.extensions))
+        return 1
+
+    failed = 0
+    for fn in files:
+        try:
+            process_file(fn, args.sigma_xy, args.sigma_t, args.frame_start, args.frame_end, not args.no_normalize,
+                         args.pixel_width, args.frame_interval, args.block_frames, args.workers or None,
+                         args.gaussian_t, args.gaussian_xy)
+        except Exception as error:
+            print("Could not process file '{}' (skipping): {}".format(fn, error))
+            failed += 1
+
+    print("Growth/shrinkage extraction of {} inputs finished.".format(len(files) - failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
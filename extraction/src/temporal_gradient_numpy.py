@@ -0,0 +1,442 @@
+"""
+CPython (numpy/scipy) version of temporal_gradient.smooth_temporal_gradient, for
+running the extraction without Fiji. Images are numpy arrays with axes (t, y, x).
+Every step follows the ImgLib2 implementation used in Fiji:
+
+ * Gauss3: separable Gaussian with half kernels of size max(2, int(3 * sigma + 0.5) + 1),
+   normalized to sum 1, border extension (nearest pixel) and a float32 image after
+   every axis (x, then y, then t)
+ * PartialDerivative.gradientBackwardDifference along t with border extension
+   (the first frame is 0)
+ * threshold.apply + math.multiply: grow keeps the positive gradient, shrink the
+   negative one (shrink stays negative, as in Fiji)
+ * the 1 frame offset between shrink / smooth and grow and the removal of the
+   first (empty) frame
+ * NormalizeScaleRealTypes to uint8: (value - min) * 255 / (max - min), rounded half up
+
+The results agree with Fiji up to float32 round-off of the Gaussian (Fiji sums in
+float32), which can move a rescaled uint8 value by 1.
+
+iter_temporal_gradient computes the same shrink and grow a block of frames at a time
+(for movies larger than memory, e.g. memory mapped tiffs). With n_workers the movie
+is split in tiles (with the halos of the Gaussian) computed on a thread pool.
+
+gaussian_t / gaussian_xy = 'iir' replace Gauss3 on these axes by a recursive Gaussian
+(recursive_gaussian) whose cost does not grow with sigma, for large sigmas. It is an
+approximation; the impulse response differs from the exact Gaussian by (max / rms,
+relative to its peak, nearest border):
+
+    sigma        0.5    1      1.5    2      3      5      10     30
+    iir max     8.9%   3.6%   2.9%   2.1%   1.4%   1.1%   1.0%   1.0%
+    iir rms     1.7%   0.8%   0.5%   0.4%   0.3%   0.3%   0.3%   0.3%
+    Gauss3 max  0.0%   0.0%   0.0%   0.2%   0.4%   0.6%   0.8%   1.0%
+
+(Gauss3 itself is cut at 3 sigma.) The variance is exact for every sigma.
+"""
+from __future__ import print_function, division
+
+__author__ = "christoph.sommer@ist.ac.at"
+
+import itertools
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import ndimage, optimize
+
+# (t, y, x) size of the tiles of tiles()
+TILE_SHAPE = (32, 256, 256)
+
+# Gaussian per axis: Gauss3 ('fir') or recursive_gaussian ('iir')
+GAUSSIAN_METHODS = ('fir', 'iir')
+
+# poles of the 3rd order recursive Gaussian for sigma = 2 (L2 optimal, van Vliet, Young and
+# Verbeek, "Recursive Gaussian derivative filters", ICPR 1998); other sigmas scale them
+RECURSIVE_POLES = np.array([1.41650 + 1.00829j, 1.41650 - 1.00829j, 1.86543])
+
+# the recursive filter never ends, tiles are cut where the impulse response is below this
+RECURSIVE_TAIL = 1e-7
+
+
+def gauss3_halfkernel(sigma):
+    """
+    Half kernel of ImgLib2 Gauss3 (center first), normalized so the full kernel sums to 1
+    """
+    size = max(2, int(3 * sigma + 0.5) + 1)
+    kernel = np.zeros(size)
+    kernel[0] = 1.
+    if sigma > 0:
+        x = np.arange(1, size)
+        kernel[1:] = np.exp(-(x * x) / (2 * sigma * sigma))
+    return kernel / (2 * (kernel[1:].sum() + 0.5))
+
+
+def gauss3_radius(sigma):
+    """
+    Number of neighbours on each side used by gauss3 for sigma (0 if the axis is not smoothed)
+    """
+    return len(gauss3_halfkernel(sigma)) - 1 if sigma > 0 else 0
+
+
+def gauss3_kernel(sigma):
+    """
+    Full (symmetric) Gauss3 kernel of length 2 * size - 1
+    """
+    half = gauss3_halfkernel(sigma)
+    return np.r_[half[:0:-1], half]
+
+
+@functools.lru_cache(maxsize=None)
+def recursive_gaussian_coefficients(sigma):
+    """
+    Gain b and feedback a (a1, a2, a3) of the recursive Gaussian for sigma
+    (w[n] = b * x[n] + a1 * w[n-1] + a2 * w[n-2] + a3 * w[n-3], then the same backwards),
+    the matrix giving the backward start from the end of the forward pass (Triggs and
+    Sdika, "Boundary conditions for Young-van Vliet recursive filtering", 2006) and the
+    number of samples after which the impulse response falls below RECURSIVE_TAIL
+    """
+    def variance(q):
+        poles = 1 / RECURSIVE_POLES ** (1 / q)
+        return (2 * poles / (1 - poles) ** 2).sum().real
+
+    # scale the poles so the forward + backward filter has variance sigma ** 2
+    q = optimize.brentq(lambda q: variance(q) - sigma ** 2, 1e-3, 10 * sigma + 10)
+    poles = 1 / RECURSIVE_POLES ** (1 / q)
+    a = -np.poly(poles).real[1:]
+    b = 1 - a.sum()
+
+    # the input continues with its last value: the forward pass goes on (minus its steady state,
+    # as a decaying homogeneous recursion) until it vanished, the backward pass returns from 0.
+    # columns: unit differences of the last 3 forward values to the steady state
+    decay = np.abs(poles).max()
+    n = int(np.ceil(np.log(1e-20) / np.log(decay))) + 3
+    forward = np.zeros((n + 3, 3))
+    forward[:3] = np.eye(3)[::-1]
+    for i in range(3, n + 3):
+        forward[i] = a[0] * forward[i - 1] + a[1] * forward[i - 2] + a[2] * forward[i - 3]
+    backward = np.zeros((n + 6, 3))
+    for i in range(n + 2, 2, -1):
+        backward[i] = b * forward[i] + a[0] * backward[i + 1] + a[1] * backward[i + 2] + a[2] * backward[i + 3]
+
+    radius = int(np.ceil(np.log(RECURSIVE_TAIL) / np.log(decay)))
+    return b, tuple(a), backward[3:6], radius
+
+
+def recursive_gaussian(img, sigma, axis=0):
+    """
+    Recursive (IIR) Gaussian along axis with border extension: a 3rd order forward and backward
+    filter (see recursive_gaussian_coefficients), 12 multiplications per pixel whatever sigma.
+    returns a float64 array
+    """
+    b, (a1, a2, a3), boundary, _ = recursive_gaussian_coefficients(sigma)
+    x = np.moveaxis(np.asarray(img, dtype=np.float64), axis, 0)
+    n = x.shape[0]
+
+    # forward pass, 3 leading frames in the steady state of the first value
+    forward = np.empty((n + 3,) + x.shape[1:])
+    forward[:3] = x[0]
+    for i in range(3, n + 3):
+        forward[i] = b * x[i - 3] + a1 * forward[i - 1] + a2 * forward[i - 2] + a3 * forward[i - 3]
+
+    # backward pass, starting from the continuation of the last value
+    backward = np.empty((n + 3,) + x.shape[1:])
+    tail = [forward[n + 2] - x[-1], forward[n + 1] - x[-1], forward[n] - x[-1]]
+    for i in range(3):
+        backward[n + i] = boundary[i, 0] * tail[0] + boundary[i, 1] * tail[1] + boundary[i, 2] * tail[2] + x[-1]
+    for i in range(n - 1, -1, -1):
+        backward[i] = b * forward[i + 3] + a1 * backward[i + 1] + a2 * backward[i + 2] + a3 * backward[i + 3]
+
+    return np.moveaxis(backward[:n], 0, axis)
+
+
+def gaussian_radius(sigma, method='fir'):
+    """
+    Number of neighbours on each side used by the Gaussian of method (GAUSSIAN_METHODS) for
+    sigma; for 'iir', where the response drops below RECURSIVE_TAIL (0 if not smoothed)
+    """
+    if method == 'iir' and sigma > 0:
+        return recursive_gaussian_coefficients(sigma)[3]
+    return gauss3_radius(sigma)
+
+
+def gauss3(img, sigma, methods=None):
+    """
+    Gaussian smoothing as Gauss3.gauss(sigma, Views.extendBorder(img), float_output).
+    sigma is given per axis of img; axes are smoothed from last (x) to first (t)
+    as ImgLib2 does for (x, y, t) images. returns a float32 array.
+    methods per axis (default 'fir'): 'iir' uses recursive_gaussian on that axis
+    """
+    methods = methods or ('fir',) * len(sigma)
+    out = np.asarray(img)
+    for axis in reversed(range(out.ndim)):
+        if sigma[axis] > 0:
+            if methods[axis] == 'iir':
+                out = recursive_gaussian(out, sigma[axis], axis=axis)
+            else:
+                out = ndimage.correlate1d(out, gauss3_kernel(sigma[axis]), axis=axis, output=np.float64, mode='nearest')
+        out = out.astype(np.float32)
+    return out
+
+
+def backward_difference(img, axis=0):
+    """
+    img[t] - img[t-1] with border extension (PartialDerivative.gradientBackwardDifference)
+    """
+    previous = np.concatenate([np.take(img, [0], axis=axis), np.take(img, np.arange(img.shape[axis] - 1), axis=axis)], axis=axis)
+    return img - previous
+
+
+def split_grow_shrink(gradient):
+    """
+    Positive (grow) and negative (shrink, still negative) part of the gradient
+    """
+    grow = gradient * (gradient > 0).astype(np.float32)
+    shrink = gradient * (-gradient > 0).astype(np.float32)
+    return grow, shrink
+
+
+def rescale_uint8(img, low=None, high=None):
+    """
+    Rescale input image to full uint8 range (NormalizeScaleRealTypes). low and high
+    default to the min and max of img (give them to rescale parts of a larger image)
+    """
+    img = np.asarray(img, dtype=np.float64)
+    if low is None:
+        low, high = img.min(), img.max()
+    if high == low:
+        return np.zeros(img.shape, dtype=np.uint8)
+
+    factor = 1.0 / (high - low) * 255
+    return np.clip(np.floor((img - low) * factor + 0.5), 0, 255).astype(np.uint8)
+
+
+def frame_range(img, frame_start=0, frame_end=-1):
+    """
+    frame_start and frame_end of a (t, y, x) movie, with -1 (or too large) frame_end
+    meaning the last frame
+    """
+    assert len(img.shape) == 3, "Input data needs to be 3-dimensional, 2D + time"
+
+    dim_t = img.shape[0]
+    if frame_end == -1:
+        frame_end = dim_t
+
+    if frame_end > dim_t:
+        frame_end = dim_t
+
+    assert frame_start < frame_end, "'Frame start' must be smaller than 'Frame end'"
+    return frame_start, frame_end
+
+
+def tiles(shape, tile_shape=TILE_SHAPE):
+    """
+    (t, y, x) slices of the tiles covering an image of the given shape
+    """
+    starts = [range(0, n, size) for n, size in zip(shape, tile_shape)]
+    return [tuple(slice(i, min(i + size, n)) for i, size, n in zip(start, tile_shape, shape))
+            for start in itertools.product(*starts)]
+
+
+def map_tiles(func, tiles, n_workers=1):
+    """
+    [func(tile) for tile in tiles], on a thread pool of n_workers threads if n_workers is not 1
+    (None: number of cores). scipy.ndimage and numpy release the GIL on large arrays, so
+    threads can work on several tiles at once (the speedup depends on the machine)
+    """
+    if n_workers == 1:
+        return [func(tile) for tile in tiles]
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(func, tiles))
+
+
+def aligned_gradient(img, tile, sigma_xy, sigma_t, frame_start, frame_end, with_smooth=False, methods=None):
+    """
+    Shrink, grow (and smoothed input if with_smooth) of smooth_temporal_gradient for one
+    tile, before the rescaling and the removal of the first frame. tile is a (t, y, x) tuple
+    of slices of these aligned frames 0 to frame_end - frame_start - 2 (frame t holds shrink
+    of gradient frame t and grow of gradient frame t + 1).
+
+    Only the tile plus a halo of gaussian_radius (and 1 frame for the difference) is read from
+    img; the border extension then only acts at the image border (and at the ends of the
+    cropped movie), so every pixel is computed as in smooth_temporal_gradient. methods are
+    the (t, y, x) Gaussians of gauss3; an 'iir' axis is only exact if the tile spans it
+    (otherwise it is cut where the response is below RECURSIVE_TAIL)
+    """
+    t, y, x = tile
+    n_frames = frame_end - frame_start
+    sigma = [sigma_t, sigma_xy, sigma_xy]
+    methods = methods or ('fir',) * 3
+    radius = [gaussian_radius(s, method) for s, method in zip(sigma, methods)]
+
+    # smoothed frames t.start - 1 (for the difference) to t.stop (for grow)
+    smooth = slice(max(t.start - 1, 0), t.stop + 1)
+    read = [slice(max(smooth.start - radius[0], 0), min(smooth.stop + radius[0], n_frames))]
+    for axis, s in [(1, y), (2, x)]:
+        read.append(slice(max(s.start - radius[axis], 0), min(s.stop + radius[axis], img.shape[axis])))
+
+    block = np.asarray(img[frame_start + read[0].start:frame_start + read[0].stop, read[1], read[2]])
+    img_smooth = gauss3(block, sigma, methods)[
+        smooth.start - read[0].start:smooth.stop - read[0].start,
+        y.start - read[1].start:y.stop - read[1].start,
+        x.start - read[2].start:x.stop - read[2].start]
+
+    gradient = backward_difference(img_smooth, axis=0)
+    if t.start > 0:
+        # drop the smoothed frame before the tile (only needed for the difference)
+        gradient, img_smooth = gradient[1:], img_smooth[1:]
+
+    grow, shrink = split_grow_shrink(gradient)
+    channels = [shrink[:-1], grow[1:]]
+    if with_smooth:
+        channels.append(img_smooth[:-1])
+    return channels
+
+
+def aligned_gradient_tiled(img, start, end, sigma_xy, sigma_t, frame_start, frame_end, with_smooth=False, methods=None,
+                           n_workers=1, tile_shape=TILE_SHAPE):
+    """
+    aligned_gradient of the aligned frames start to end, computed in tiles of tile_shape
+    (see map_tiles for n_workers). Axes with an 'iir' method are not split. returns the
+    float32 (t, y, x) channels
+    """
+    shape = (end - start,) + tuple(img.shape[1:])
+    methods = methods or ('fir',) * 3
+    tile_shape = [n if method == 'iir' else size for n, size, method in zip(shape, tile_shape, methods)]
+    out = [np.empty(shape, dtype=np.float32) for _ in range(3 if with_smooth else 2)]
+
+    def compute(tile):
+        t = slice(start + tile[0].start, start + tile[0].stop)
+        channels = aligned_gradient(img, (t,) + tile[1:], sigma_xy, sigma_t, frame_start, frame_end, with_smooth, methods)
+        for channel_out, channel in zip(out, channels):
+            channel_out[tile] = channel
+
+    map_tiles(compute, tiles(shape, tile_shape), n_workers)
+    return out
+
+
+def value_range(img):
+    """
+    min and max of img (as python floats, see rescale_uint8)
+    """
+    return float(img.min()), float(img.max())
+
+
+def rescale_uint8_tiled(img, low, high, n_workers=1, tile_shape=TILE_SHAPE):
+    """
+    rescale_uint8(img, low, high) computed in tiles (see map_tiles)
+    """
+    out = np.empty(img.shape, dtype=np.uint8)
+
+    def rescale(tile):
+        out[tile] = rescale_uint8(img[tile], low, high)
+
+    map_tiles(rescale, tiles(img.shape, tile_shape), n_workers)
+    return out
+
+
+def gaussian_methods(gaussian_t='fir', gaussian_xy='fir'):
+    """
+    (t, y, x) methods of gauss3 for the temporal and spatial Gaussian ('fir' or 'iir')
+    """
+    for method in (gaussian_t, gaussian_xy):
+        if method not in GAUSSIAN_METHODS:
+            raise ValueError("Gaussian method must be one of {} (got '{}')".format(', '.join(GAUSSIAN_METHODS), method))
+    return (gaussian_t, gaussian_xy, gaussian_xy)
+
+
+def smooth_temporal_gradient(img, sigma_xy, sigma_t, frame_start=0, frame_end=-1, normalize_output=True, n_workers=1,
+                             gaussian_t='fir', gaussian_xy='fir'):
+    """
+    Smooth input image (numpy array t, y, x) with Gaussian and build temporal gradient
+    from frame_start to frame_end. returns an array (t, channel, y, x) with the channels
+    shrink, grow and smoothed input (as the composite image of the Fiji version) and
+    frame_end - frame_start - 2 frames; float32, or uint8 if normalize_output.
+    n_workers other than 1 (None for all cores) computes tiles on a thread pool, with the
+    same result. gaussian_t / gaussian_xy = 'iir' use the recursive Gaussian on these axes
+    """
+
+    img = np.asarray(img)
+    frame_start, frame_end = frame_range(img, frame_start, frame_end)
+    methods = gaussian_methods(gaussian_t, gaussian_xy)
+    if n_workers != 1:
+        return smooth_temporal_gradient_tiled(img, sigma_xy, sigma_t, frame_start, frame_end, normalize_output, n_workers,
+                                              methods)
+
+    img_crop = img[frame_start:frame_end]
+    img_smooth = gauss3(img_crop, [sigma_t, sigma_xy, sigma_xy], methods)
+
+    gradient = backward_difference(img_smooth, axis=0)
+    grow, shrink = split_grow_shrink(gradient)
+
+    # allign growth and shrink by offset of 1 in t dimension
+    shrink = shrink[:-1]
+    grow = grow[1:]
+    img_smooth = img_smooth[:-1]
+
+    if normalize_output:
+        shrink = rescale_uint8(shrink)
+        grow = rescale_uint8(grow)
+        img_smooth = rescale_uint8(img_smooth)
+
+    # drop 1st time point (empty since using backward differences)
+    return np.stack([shrink, grow, img_smooth], axis=1)[1:]
+
+
+def smooth_temporal_gradient_tiled(img, sigma_xy, sigma_t, frame_start, frame_end, normalize_output=True, n_workers=None,
+                                   methods=None):
+    """
+    smooth_temporal_gradient computed in tiles on n_workers threads (see aligned_gradient)
+    """
+    n_frames = frame_end - frame_start
+    channels = aligned_gradient_tiled(img, 0, n_frames - 1, sigma_xy, sigma_t, frame_start, frame_end,
+                                      with_smooth=True, methods=methods, n_workers=n_workers)
+    out = np.empty((n_frames - 2, 3) + img.shape[1:], dtype=np.uint8 if normalize_output else np.float32)
+    for i, channel in enumerate(channels):
+        if normalize_output:
+            channel = rescale_uint8_tiled(channel, *value_range(channel), n_workers=n_workers)
+        out[:, i] = channel[1:]
+    return out
+
+
+def iter_temporal_gradient(img, sigma_xy, sigma_t, frame_start=0, frame_end=-1, normalize_output=True, block_frames=32,
+                           n_workers=1, gaussian_t='fir', gaussian_xy='fir'):
+    """
+    Shrink and grow of smooth_temporal_gradient (not the smoothed input), block_frames output
+    frames at a time: yields (shrink, grow) arrays (t, y, x) in frame order.
+
+    img can be any (t, y, x) array that is read by slicing, e.g. a memory mapped tiff; a
+    block only reads its frames plus gaussian_radius(sigma_t) + 1 frames on each side, so
+    memory depends on block_frames, not on the movie length. Every pixel is computed as in
+    smooth_temporal_gradient (see aligned_gradient), so the blocks are identical to its
+    frames. uint8 rescaling needs the min and max of the whole movie: with normalize_output
+    the gradient is computed twice, a first pass collects them. n_workers, gaussian_t and
+    gaussian_xy as in smooth_temporal_gradient (each block is split in tiles). With
+    gaussian_t = 'iir' the halo of a block is where the temporal response falls below
+    RECURSIVE_TAIL (about 13 sigma_t), so the blocks agree with smooth_temporal_gradient
+    to float32 round-off instead of exactly (block_frames should be well above the halo).
+    """
+    frame_start, frame_end = frame_range(img, frame_start, frame_end)
+    methods = gaussian_methods(gaussian_t, gaussian_xy)
+    n_frames = frame_end - frame_start
+
+    def blocks(first):
+        # aligned frames first to n_frames - 2, block_frames at a time
+        for start in range(first, n_frames - 1, block_frames):
+            end = min(start + block_frames, n_frames - 1)
+            yield aligned_gradient_tiled(img, start, end, sigma_xy, sigma_t, frame_start, frame_end, methods=methods,
+                                         n_workers=n_workers)
+
+    ranges = None
+    if normalize_output:
+        # min and max of all the aligned frames, which smooth_temporal_gradient rescales
+        ranges = [(np.inf, -np.inf), (np.inf, -np.inf)]
+        for channels in blocks(0):
+            ranges = [(min(low, channel_low), max(high, channel_high))
+                      for (low, high), (channel_low, channel_high) in zip(ranges, map(value_range, channels))]
+
+    # output frames are the aligned frames without the first one
+    for shrink, grow in blocks(1):
+        if normalize_output:
+            shrink = rescale_uint8_tiled(shrink, *ranges[0], n_workers=n_workers)
+            grow = rescale_uint8_tiled(grow, *ranges[1], n_workers=n_workers)
+        yield shrink, grow
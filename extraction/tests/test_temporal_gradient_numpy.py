@@ -0,0 +1,104 @@
+"""
+Tiled, blockwise and recursive (IIR) versions of the numpy extraction against the
+in-memory Gauss3 reference. Run from the extraction folder: python -m pytest tests
+"""
+from __future__ import print_function, division
+
+__author__ = "christoph.sommer@ist.ac.at"
+
+import os
+import sys
+
+import numpy as np
+import pytest
+from scipy import ndimage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src.temporal_gradient_numpy import (smooth_temporal_gradient, iter_temporal_gradient, aligned_gradient_tiled,
+                                         recursive_gaussian, gaussian_methods)
+
+SIGMA_XY, SIGMA_T = 1.5, 2.
+
+
+@pytest.fixture(scope='module')
+def movie():
+    """
+    Small uint16 movie (t, y, x) of moving blobs on noise
+    """
+    rng = np.random.default_rng(0)
+    img = ndimage.gaussian_filter(rng.random((24, 40, 56)), (1, 2, 2)) * 4000
+    return (img + rng.normal(0, 20, img.shape) + 100).clip(0).astype(np.uint16)
+
+
+@pytest.mark.parametrize('gaussian_t', ['fir', 'iir'])
+@pytest.mark.parametrize('tile_shape', [(4, 16, 16), (7, 13, 29)])
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_tiles(movie, tile_shape, n_workers, gaussian_t):
+    reference = smooth_temporal_gradient(movie, SIGMA_XY, SIGMA_T, 2, 20, normalize_output=False, gaussian_t=gaussian_t)
+    channels = aligned_gradient_tiled(movie, 0, 17, SIGMA_XY, SIGMA_T, 2, 20, with_smooth=True,
+                                      methods=gaussian_methods(gaussian_t, 'fir'), n_workers=n_workers,
+                                      tile_shape=tile_shape)
+    for i, channel in enumerate(channels):
+        np.testing.assert_array_equal(channel[1:], reference[:, i])
+
+
+@pytest.mark.parametrize('normalize_output', [True, False])
+def test_workers(movie, normalize_output):
+    np.testing.assert_array_equal(smooth_temporal_gradient(movie, SIGMA_XY, SIGMA_T, normalize_output=normalize_output,
+                                                           n_workers=3),
+                                  smooth_temporal_gradient(movie, SIGMA_XY, SIGMA_T, normalize_output=normalize_output))
+
+
+@pytest.mark.parametrize('normalize_output', [True, False])
+@pytest.mark.parametrize('block_frames', [1, 5, 32])
+def test_blocks(movie, block_frames, normalize_output):
+    reference = smooth_temporal_gradient(movie, SIGMA_XY, SIGMA_T, 1, -1, normalize_output)
+    blocks = list(iter_temporal_gradient(movie, SIGMA_XY, SIGMA_T, 1, -1, normalize_output, block_frames, n_workers=2))
+    np.testing.assert_array_equal(np.concatenate([shrink for shrink, grow in blocks]), reference[:, 0])
+    np.testing.assert_array_equal(np.concatenate([grow for shrink, grow in blocks]), reference[:, 1])
+
+
+def test_iir_blocks(movie):
+    reference = smooth_temporal_gradient(movie, SIGMA_XY, 1., normalize_output=False, gaussian_t='iir')
+    blocks = list(iter_temporal_gradient(movie, SIGMA_XY, 1., normalize_output=False, block_frames=16, gaussian_t='iir'))
+    scale = np.abs(reference[:, :2]).max()
+    np.testing.assert_allclose(np.concatenate([shrink for shrink, grow in blocks]), reference[:, 0], atol=1e-5 * scale)
+    np.testing.assert_allclose(np.concatenate([grow for shrink, grow in blocks]), reference[:, 1], atol=1e-5 * scale)
+
+
+@pytest.mark.parametrize('sigma, max_error', [(1.5, 0.03), (3., 0.015), (10., 0.011), (30., 0.011)])
+def test_recursive_gaussian(sigma, max_error):
+    """
+    Impulse response against the exact Gaussian (errors of the table in temporal_gradient_numpy)
+    """
+    n = int(40 * sigma) + 1
+    impulse = np.zeros(n)
+    impulse[n // 2] = 1
+    response = recursive_gaussian(impulse, sigma)
+    exact = ndimage.gaussian_filter1d(impulse, sigma, truncate=12)
+
+    assert np.abs(response - exact).max() <= max_error * exact.max()
+    x = np.arange(n) - n // 2
+    assert response.sum() == pytest.approx(1, abs=1e-6)
+    assert (response * x * x).sum() == pytest.approx(sigma ** 2, rel=1e-4)
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_blockwise_files(movie, tmp_path, compression):
+    """
+    extract_growth_shrink_headless with --block_frames (memory mapped or page by page input)
+    writes the same tiffs as the in-memory processing
+    """
+    tifffile = pytest.importorskip('tifffile')
+    from extract_growth_shrink_headless import process_file
+
+    outputs = []
+    for name, block_frames in [('in_memory', None), ('blockwise', 4)]:
+        fn = str(tmp_path / "{}.tif".format(name))
+        tifffile.imwrite(fn, movie, imagej=True, compression=compression)
+        process_file(fn, SIGMA_XY, SIGMA_T, block_frames=block_frames)
+        outputs.append([tifffile.imread(str(tmp_path / "{}_{}.tiff".format(name, kind))) for kind in ('shrinkage', 'growth')])
+
+    for blockwise, in_memory in zip(outputs[1], outputs[0]):
+        assert blockwise.shape == in_memory.shape == (len(movie) - 2,) + movie.shape[1:]
+        np.testing.assert_array_equal(blockwise, in_memory)
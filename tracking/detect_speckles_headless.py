@@ -0,0 +1,135 @@
+"""
+Speckle detection without Fiji (plain python with numpy, scipy and tifffile).
+Same detector settings and spot filters as track_growth_shrink_batch.py:
+
+    python detect_speckles_headless.py movie_growth.tiff --diameter 0.5 --threshold 5 --snr 0.5
+    python detect_speckles_headless.py input_dir --extension tiff --workers 8
+
+writes <name>_spots.csv next to each input with one row per spot (TrackMate feature
+names: FRAME, POSITION_X, POSITION_Y, POSITION_T, RADIUS, QUALITY, MEAN_INTENSITY_CH1,
+STD_INTENSITY_CH1, SNR_CH1), positions in microns and seconds from the calibration of
+the input (or the one given). Spots are detected, not linked into tracks.
+"""
+from __future__ import print_function, division
+
+__author__ = "christoph.sommer@ist.ac.at"
+
+import os
+import sys
+import glob
+import argparse
+import numpy as np
+
+def get_script_patch():
+    import inspect
+    return os.path.dirname(os.path.abspath(inspect.getsourcefile(lambda:0)))
+
+sys.path.append(get_script_patch())
+from src.log_detector import detect_spots, SPOT_FEATURES
+
+
+def require_tifffile():
+    try:
+        import tifffile
+    except ImportError:
+        sys.exit("reading tiff files needs tifffile (pip install tifffile)")
+    return tifffile
+
+
+def input_files(paths, file_ext):
+    """
+    Files given directly or with the extension inside the given folders
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, "*.{}".format(file_ext))))
+        else:
+            files.append(path)
+    return files
+
+
+def read_movie(fn):
+    """
+    Returns the movie as (t, y, x) array, the pixel width and the frame interval (None if unknown)
+    """
+    tifffile = require_tifffile()
+    with tifffile.TiffFile(fn) as tif:
+        img = tif.asarray()
+        metadata = tif.imagej_metadata or {}
+        page = tif.pages[0]
+        pixel_width = None
+        if 'XResolution' in page.tags:
+            numerator, denominator = page.tags['XResolution'].value
+            if numerator > 0:
+                pixel_width = denominator / numerator
+
+    img = img.squeeze()
+    if img.ndim not in (2, 3):
+        raise ValueError("Input data needs to be 2D or 2D + time (got shape {})".format(img.shape))
+    return img, pixel_width, metadata.get('finterval')
+
+
+def save_spots(fn, spots):
+    """
+    Saves the spots (dict of SPOT_FEATURES arrays) as csv
+    """
+    table = np.column_stack([spots[name] for name in SPOT_FEATURES])
+    fmt = ['%d'] + ['%.6g'] * (len(SPOT_FEATURES) - 1)
+    np.savetxt(fn, table, fmt=fmt, delimiter=',', header=','.join(SPOT_FEATURES), comments='')
+
+
+def process_file(fn, params, pixel_width=-1, frame_interval=-1, n_workers=1):
+    img, file_pixel_width, file_frame_interval = read_movie(fn)
+    pixel_width = pixel_width if pixel_width > 0 else (file_pixel_width or 1.)
+    frame_interval = frame_interval if frame_interval > 0 else (file_frame_interval or 1.)
+
+    spots = detect_spots(img, params.radius, params.threshold, params.do_median_filtering,
+                         params.do_subpixel_localization, params.quality, params.snr,
+                         pixel_width, frame_interval, n_workers)
+
+    fn_basename = os.path.splitext(fn)[0]
+    save_spots("{}_spots.csv".format(fn_basename), spots)
+    print("{} processed: {} spots".format(fn_basename, len(spots['FRAME'])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LoG speckle detection as TrackMate's LoG detector (no Fiji needed)")
+    parser.add_argument('inputs', nargs='+', help="growth or shrinkage movies (2D + time tiff) or folders containing several")
+    parser.add_argument('--extension', default='tiff', help="file extension used in folders (default: tiff)")
+    parser.add_argument('--diameter', type=float, default=0.5, help="diameter of speckle in microns (default 0.5)")
+    parser.add_argument('--threshold', type=float, default=5, help="LoG threshold (default 5)")
+    parser.add_argument('--no_subpixel_localization', action='store_true', help="keep spots on the pixel grid")
+    parser.add_argument('--median_filtering', action='store_true', help="3x3 median filter before the LoG")
+    parser.add_argument('--quality', type=float, default=0, help="particles min quality (default 0)")
+    parser.add_argument('--snr', type=float, default=0.5, help="particles min SNR ratio (default 0.5)")
+    parser.add_argument('--pixel_width', type=float, default=-1, help="pixel width in microns (default: from the file)")
+    parser.add_argument('--frame_interval', type=float, default=-1, help="frame interval in seconds (default: from the file)")
+    parser.add_argument('--workers', type=int, default=1, help="threads detecting frames in parallel (0 for all cores, default 1)")
+    args = parser.parse_args(argv)
+    if args.workers < 0:
+        parser.error("--workers must be 0 (all cores) or more")
+
+    params = argparse.Namespace(do_subpixel_localization=not args.no_subpixel_localization, radius=args.diameter / 2.,
+                                threshold=args.threshold, do_median_filtering=args.median_filtering,
+                                quality=args.quality, snr=args.snr)
+
+    files = input_files(args.inputs, args.extension)
+    if len(files) == 0:
+        print("No files found in '{}' with extension '{}'".format(' '.join(args.inputs), args.extension))
+        return 1
+
+    failed = 0
+    for fn in files:
+        try:
+            process_file(fn, params, args.pixel_width, args.frame_interval, args.workers or None)
+        except Exception as error:
+            print("Could not process file '{}' (skipping): {}".format(fn, error))
+            failed += 1
+
+    print("Speckle detection of {} inputs finished.".format(len(files) - failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
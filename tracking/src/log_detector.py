@@ -0,0 +1,227 @@
+"""
+CPython (numpy/scipy) version of the spot detection of trackmate_utils.run_trackmate
+(LogDetectorFactory + the QUALITY and SNR_CH1 spot filters), without Fiji or a JVM.
+Movies are numpy arrays with axes (t, y, x); every frame is detected on its own, as
+TrackMate does for 2D + time:
+
+ * DO_MEDIAN_FILTERING: 3x3 median filter of the frame first
+ * LoG filter with TrackMate's kernel (DetectionUtils.createLoGKernel): sigma = RADIUS / sqrt(2),
+   kernel half size max(2, int(3 * sigma + 0.5) + 1) + 1 pixels, scaled so the quality of a
+   spot of the given radius does not depend on it
+ * local maxima: pixels >= THRESHOLD that no pixel of their 3x3 neighbourhood exceeds
+   (mirrored border, as LocalExtrema on Views.extendMirrorSingle)
+ * DO_SUBPIXEL_LOCALIZATION: quadratic fit of the 3x3 neighbourhood as ImgLib2's
+   SubpixelLocalization (moving to a neighbour while the offset is above half a pixel, at
+   most 10 times); QUALITY is the LoG value at the peak (of the fit if refined)
+ * SNR_CH1 = (mean inside - mean outside) / std inside, on the unfiltered frame: inside is
+   the disk of RADIUS around the spot, outside the ring between RADIUS and 2 RADIUS
+ * spots are kept if QUALITY >= quality and SNR_CH1 >= snr (FeatureFilter(..., True))
+
+The LoG is a direct (separable) convolution instead of TrackMate's FFT, so values at the
+frame border can differ slightly from Fiji.
+"""
+from __future__ import print_function, division
+
+__author__ = "christoph.sommer@ist.ac.at"
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import ndimage
+
+# columns of the detected spots (TrackMate feature names)
+SPOT_FEATURES = ('FRAME', 'POSITION_X', 'POSITION_Y', 'POSITION_T', 'RADIUS', 'QUALITY',
+                 'MEAN_INTENSITY_CH1', 'STD_INTENSITY_CH1', 'SNR_CH1')
+
+# frames per task of the thread pool
+CHUNK_FRAMES = 8
+
+SUBPIXEL_MAX_MOVES = 10
+
+
+def log_kernels(radius, pixel_width=1.):
+    """
+    1D factors of TrackMate's 2D LoG kernel: the kernel is
+    outer(second, gauss) + outer(gauss, second) (y, x), both of length 3 + 2 * half size
+    """
+    sigma = radius / np.sqrt(2)
+    sigma_pixels = sigma / pixel_width
+    half_size = max(2, int(3 * sigma_pixels + 0.5) + 1)
+    x = pixel_width * np.arange(-(half_size + 1), half_size + 2)
+
+    C = 1. / 20. * (1. / sigma / np.sqrt(2 * np.pi)) ** 2
+    gauss = np.exp(-x * x / 2. / sigma / sigma)
+    second = -C * (x * x / sigma / sigma - 1.) * gauss
+    return second, gauss
+
+
+def log_filter(frames, radius, pixel_width=1.):
+    """
+    LoG filtered (t, y, x) frames (float64), with the mirrored border of TrackMate
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    second, gauss = log_kernels(radius, pixel_width)
+
+    def separable(kernel_y, kernel_x):
+        out = ndimage.correlate1d(frames, kernel_x, axis=2, mode='mirror')
+        return ndimage.correlate1d(out, kernel_y, axis=1, mode='mirror')
+
+    return separable(second, gauss) + separable(gauss, second)
+
+
+def find_local_maxima(filtered, threshold):
+    """
+    (frame, y, x) indices of the local maxima of each frame of filtered: values >= threshold
+    not exceeded by any of their 8 neighbours (mirrored border)
+    """
+    neighbourhood_max = ndimage.maximum_filter(filtered, size=(1, 3, 3), mode='mirror')
+    return np.nonzero((filtered >= threshold) & (filtered >= neighbourhood_max))
+
+
+def refine_subpixel(filtered, t, y, x, max_moves=SUBPIXEL_MAX_MOVES):
+    """
+    Quadratic fit around the peaks (t, y, x) of filtered, for all peaks at once: offset
+    = -H^-1 g from the central differences of the 3x3 neighbourhood. A peak whose offset is
+    above 0.5 in a direction moves one pixel that way and is fitted again (at most max_moves
+    times, inside the frame). returns the refined y, x and the value of the fit there
+    (peaks with a singular Hessian or a fit that does not settle keep their pixel and value)
+    """
+    padded = np.pad(filtered, ((0, 0), (1, 1), (1, 1)), mode='reflect')  # mirrored border
+    n_y, n_x = filtered.shape[1:]
+    y, x = y.copy(), x.copy()
+
+    def fit(t, y, x):
+        def value(dy, dx):
+            return padded[t, y + 1 + dy, x + 1 + dx]
+        center = value(0, 0)
+        g = np.stack([(value(1, 0) - value(-1, 0)) / 2, (value(0, 1) - value(0, -1)) / 2], axis=-1)
+        h_yy = value(1, 0) - 2 * center + value(-1, 0)
+        h_xx = value(0, 1) - 2 * center + value(0, -1)
+        h_xy = (value(1, 1) - value(1, -1) - value(-1, 1) + value(-1, -1)) / 4
+        det = h_yy * h_xx - h_xy * h_xy
+        valid = det != 0
+        det = np.where(valid, det, 1.)
+        offset = -np.stack([h_xx * g[:, 0] - h_xy * g[:, 1], h_yy * g[:, 1] - h_xy * g[:, 0]], axis=-1) / det[:, None]
+        offset[~valid] = 0
+        return center, g, offset
+
+    moving = np.arange(len(t))
+    offset = np.zeros((len(t), 2))
+    center, g = np.zeros(len(t)), np.zeros((len(t), 2))
+    for move in range(max_moves + 1):
+        center[moving], g[moving], offset[moving] = fit(t[moving], y[moving], x[moving])
+        if move == max_moves:
+            break
+        step = np.where(np.abs(offset[moving]) > 0.5, np.sign(offset[moving]), 0).astype(np.intp)
+        new_y = np.clip(y[moving] + step[:, 0], 0, n_y - 1)
+        new_x = np.clip(x[moving] + step[:, 1], 0, n_x - 1)
+        moved = (new_y != y[moving]) | (new_x != x[moving])
+        y[moving], x[moving] = new_y, new_x
+        moving = moving[moved]
+        if len(moving) == 0:
+            break
+
+    # fits that did not settle within half a pixel (flat or saddle-like neighbourhoods, or
+    # blocked by the frame border) keep the pixel and its value
+    offset[(np.abs(offset) > 0.5).any(axis=1)] = 0
+    value = center + 0.5 * (g * offset).sum(axis=1)
+    return y + offset[:, 0], x + offset[:, 1], value
+
+
+def disk_offsets(radius_pixels):
+    """
+    (dy, dx) of the pixels within radius_pixels of a pixel, and of the ring up to 2 radius_pixels
+    """
+    r = int(np.ceil(2 * radius_pixels))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    d2 = (dy * dy + dx * dx).ravel()
+    inner = d2 <= radius_pixels ** 2
+    outer = ~inner & (d2 <= 4 * radius_pixels ** 2)
+    return (dy.ravel()[inner], dx.ravel()[inner]), (dy.ravel()[outer], dx.ravel()[outer])
+
+
+def spot_intensities(frames, t, y, x, radius_pixels):
+    """
+    Mean and std inside the disk of radius_pixels around (y, x) (rounded to the nearest pixel)
+    and SNR = (mean inside - mean in the ring up to 2 radius) / std inside, for all spots at
+    once; pixels outside the frame are left out
+    """
+    frames = np.asarray(frames, dtype=np.float64)
+    n_y, n_x = frames.shape[1:]
+    cy, cx = np.floor(y + 0.5).astype(np.intp), np.floor(x + 0.5).astype(np.intp)
+
+    def region_values(offsets):
+        py, px = cy[:, None] + offsets[0], cx[:, None] + offsets[1]
+        inside = (py >= 0) & (py < n_y) & (px >= 0) & (px < n_x)
+        values = frames[t[:, None], np.clip(py, 0, n_y - 1), np.clip(px, 0, n_x - 1)]
+        return np.where(inside, values, 0.), inside
+
+    inner, outer = disk_offsets(radius_pixels)
+    values_in, inside_in = region_values(inner)
+    values_out, inside_out = region_values(outer)
+
+    n_in = inside_in.sum(axis=1)
+    mean_in = values_in.sum(axis=1) / n_in
+    std_in = np.sqrt((np.where(inside_in, values_in - mean_in[:, None], 0.) ** 2).sum(axis=1) / n_in)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_out = values_out.sum(axis=1) / inside_out.sum(axis=1)
+        snr = (mean_in - mean_out) / std_in
+    return mean_in, std_in, snr
+
+
+def detect_frames(frames, first_frame, radius, threshold, do_median_filtering=False, do_subpixel_localization=True,
+                  pixel_width=1.):
+    """
+    Spots of consecutive (t, y, x) frames, frame numbers from first_frame. returns a dict of
+    the SPOT_FEATURES arrays without POSITION_T (positions in calibrated units, unfiltered)
+    """
+    frames = np.asarray(frames)
+    detection = frames
+    if do_median_filtering:
+        detection = ndimage.median_filter(frames, size=(1, 3, 3), mode='mirror')
+
+    filtered = log_filter(detection, radius, pixel_width)
+    t, y, x = find_local_maxima(filtered, threshold)
+    if do_subpixel_localization:
+        y_spot, x_spot, quality = refine_subpixel(filtered, t, y, x)
+    else:
+        y_spot, x_spot, quality = y.astype(np.float64), x.astype(np.float64), filtered[t, y, x]
+
+    mean_in, std_in, snr = spot_intensities(frames, t, y_spot, x_spot, radius / pixel_width)
+    return {'FRAME': first_frame + t, 'POSITION_X': x_spot * pixel_width, 'POSITION_Y': y_spot * pixel_width,
+            'RADIUS': np.full(len(t), float(radius)), 'QUALITY': quality,
+            'MEAN_INTENSITY_CH1': mean_in, 'STD_INTENSITY_CH1': std_in, 'SNR_CH1': snr}
+
+
+def detect_spots(img, radius, threshold, do_median_filtering=False, do_subpixel_localization=True, quality=0.,
+                 snr=0., pixel_width=1., frame_interval=1., n_workers=1, chunk_frames=CHUNK_FRAMES):
+    """
+    LoG detection of run_trackmate on a (t, y, x) movie with the same parameters (radius in
+    calibrated units, as RADIUS) and its QUALITY >= quality and SNR_CH1 >= snr filters.
+    Frames are detected in chunks of chunk_frames on a thread pool of n_workers threads (None:
+    number of cores; scipy.ndimage releases the GIL). returns a dict of SPOT_FEATURES arrays,
+    sorted by frame (same result for any n_workers)
+    """
+    img = np.asarray(img)
+    if img.ndim == 2:
+        img = img[None]
+    assert img.ndim == 3, "Input data needs to be 2D or 2D + time"
+    if len(img) == 0:
+        raise ValueError("Input data has no frames (got shape {})".format(img.shape))
+
+    def detect_chunk(start):
+        return detect_frames(img[start:start + chunk_frames], start, radius, threshold, do_median_filtering,
+                             do_subpixel_localization, pixel_width)
+
+    starts = range(0, len(img), chunk_frames)
+    if n_workers == 1:
+        chunks = [detect_chunk(start) for start in starts]
+    else:
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            chunks = list(pool.map(detect_chunk, starts))
+
+    spots = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+    spots['POSITION_T'] = spots['FRAME'] * frame_interval
+
+    keep = (spots['QUALITY'] >= quality) & (spots['SNR_CH1'] >= snr)
+    return {name: spots[name][keep] for name in SPOT_FEATURES}
@@ -0,0 +1,75 @@
+"""
+LoG spot detection without Fiji: planted spots are found, the separable LoG equals the
+2D kernel and the spots do not depend on the number of threads. Run from the tracking
+folder: python -m pytest tests
+"""
+from __future__ import print_function, division
+
+__author__ = "christoph.sommer@ist.ac.at"
+
+import os
+import sys
+
+import numpy as np
+import pytest
+from scipy import ndimage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src.log_detector import detect_spots, log_filter, log_kernels, SPOT_FEATURES
+
+RADIUS, PIXEL_WIDTH = 0.25, 0.1  # microns, as the default diameter of 0.5
+
+
+@pytest.fixture(scope='module')
+def planted():
+    """
+    Movie (t, y, x) of Gaussian spots of RADIUS on noise and their positions (frame, y, x) in pixels
+    """
+    rng = np.random.default_rng(1)
+    n_frames, shape, n_spots = 12, (64, 80), 10
+    sigma = RADIUS / np.sqrt(2) / PIXEL_WIDTH
+    y, x = np.mgrid[:shape[0], :shape[1]]
+
+    img, positions = np.empty((n_frames,) + shape), []
+    for t in range(n_frames):
+        centers = rng.uniform(6, np.array(shape) - 6, (n_spots, 2))
+        centers = centers[np.all(np.abs(centers[:, None] - centers[None]).max(-1) + np.eye(n_spots) * 99 > 8, axis=1)]
+        img[t] = sum(np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / (2 * sigma ** 2)) for cy, cx in centers) * 200
+        positions += [(t, cy, cx) for cy, cx in centers]
+    img += rng.normal(100, 5, img.shape)
+    return img.astype(np.uint16), np.array(positions)
+
+
+def test_planted_spots(planted):
+    img, positions = planted
+    spots = detect_spots(img, RADIUS, threshold=100., snr=0.5, pixel_width=PIXEL_WIDTH, frame_interval=2.)
+    assert set(spots) == set(SPOT_FEATURES)
+    assert len(spots['FRAME']) == len(positions)
+    np.testing.assert_array_equal(spots['POSITION_T'], spots['FRAME'] * 2.)
+
+    # spots close to a half pixel can keep their pixel (the fit does not settle, see refine_subpixel)
+    found = np.column_stack([spots['FRAME'], spots['POSITION_Y'] / PIXEL_WIDTH, spots['POSITION_X'] / PIXEL_WIDTH])
+    errors = np.array([np.hypot(*(found[found[:, 0] == t][:, 1:] - (y, x)).T).min() for t, y, x in positions])
+    assert errors.max() <= np.sqrt(0.5) and np.mean(errors < 0.2) > 0.9
+
+
+def test_separable_log(planted):
+    img = planted[0][:2].astype(np.float64)
+    second, gauss = log_kernels(RADIUS, PIXEL_WIDTH)
+    kernel = np.outer(second, gauss) + np.outer(gauss, second)
+    direct = np.stack([ndimage.correlate(frame, kernel, mode='mirror') for frame in img])
+    np.testing.assert_allclose(log_filter(img, RADIUS, PIXEL_WIDTH), direct, rtol=1e-10, atol=1e-10 * np.abs(direct).max())
+
+
+@pytest.mark.parametrize('n_workers, chunk_frames', [(3, 1), (2, 5), (None, 8)])
+def test_workers(planted, n_workers, chunk_frames):
+    img = planted[0]
+    reference = detect_spots(img, RADIUS, 10., pixel_width=PIXEL_WIDTH)
+    spots = detect_spots(img, RADIUS, 10., pixel_width=PIXEL_WIDTH, n_workers=n_workers, chunk_frames=chunk_frames)
+    for name in SPOT_FEATURES:
+        np.testing.assert_array_equal(spots[name], reference[name])
+
+
+def test_movie_without_frames():
+    with pytest.raises(ValueError):
+        detect_spots(np.zeros((0, 16, 16)), RADIUS, 1.)
@@ -0,0 +1,212 @@
+# benchmarks of the bkg_func.core stages (time and peak memory) with scaling curves
+# run from the tracking_analysis_v2.0 folder:
+#     python benchmarks/bench_core.py                 # examples + generated inputs
+#     python benchmarks/bench_core.py --quick         # smaller generated inputs, 1 repeat
+#     python benchmarks/bench_core.py --compare old.json new.json
+# results are saved as json (one file per run, named after the git commit) so runs of
+# different commits can be compared; the scaling exponent of each stage is the slope of
+# log(time) vs log(size) over each generated series. generated inputs are synthetic trackmate
+# files (bkg_func.synthetic) so the weighted msd fit is also checked against the ground truth
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bkg_func import core, synthetic, writers
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXAMPLES_DIR = os.path.join(HERE, '..', 'examples')
+
+# generated series: number of tracks at fixed length and track length at fixed number of tracks
+SERIES = {'n_tracks': dict(n_tracks = [2000, 4000, 8000, 16000, 32000], length = 20),
+          'length':   dict(n_tracks = 200, length = [100, 200, 400, 800, 1600])}
+QUICK_SERIES = {'n_tracks': dict(n_tracks = [2000, 4000, 8000], length = 20),
+                'length':   dict(n_tracks = 100, length = [100, 200, 400])}
+
+def table_stages(table, frame_interval):
+    """stages that work on a track table: name -> function without arguments"""
+    return {'velocities_distribution': lambda: core.velocities_distribution(table, frame_interval, plot = False),
+            'msd_velocity_analysis':   lambda: core.msd_velocity_analysis(table, frame_interval, plot = False),
+            'single_track_analysis':   lambda: core.single_track_analysis(table, frame_interval, plot = False),
+            'directional_persistence': lambda: core.directional_persistence(table, frame_interval, plot = False)}
+
+def file_stages(fn, workdir, figures = True):
+    """stages that need the xml file (analyze_tracks writes its outputs into workdir)"""
+    copy = os.path.join(workdir, os.path.basename(fn))
+    if not os.path.exists(copy):
+        shutil.copy(fn, copy)
+
+    def analyze():
+        core.analyze_tracks(copy, cache = False, close_figures = True)
+
+    def analyze_headless():
+        core.analyze_tracks(copy, cache = False, headless = True, output_format = 'npz')
+
+    def analyze_bootstrap():
+        core.analyze_tracks(copy, cache = False, headless = True, output_format = 'npz', n_bootstrap = 20)
+        assert 'msd_bootstrap' in writers.read_tables(writers.output_path(copy, 'npz')) # has a string column
+
+    stages = {'read_xml_tracks': lambda: core.read_xml_tracks(fn, cache = False),
+              'analyze_tracks':  analyze,                    # xlsx + pdf
+              'analyze_tracks_headless': analyze_headless,   # npz, no figures
+              'analyze_tracks_bootstrap': analyze_bootstrap} # npz + bootstrap table
+    if not figures:
+        del stages['analyze_tracks'], stages['analyze_tracks_bootstrap']
+    return stages
+
+@contextlib.contextmanager
+def quiet():
+    """hides the progress prints of core"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def measure(function, repeat):
+    """wall times of `repeat` runs and the peak traced memory of one extra run (bytes)"""
+    times = []
+    with quiet():
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+            plt.close('all')
+
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        plt.close('all')
+
+    return times, peak
+
+def table_size(table):
+    lengths = table.groupby('TRACK_ID').size()
+    return {'n_spots': int(len(table)), 'n_tracks': int(len(lengths)), 'max_length': int(lengths.max())}
+
+def run_stages(stages, record, repeat, results):
+    for stage, function in stages.items():
+        times, peak = measure(function, repeat)
+        results.append(dict(record, stage = stage, times = times, median = float(np.median(times)), peak_bytes = int(peak)))
+        print('{:<28} {:<24} {:>9.4f} s {:>9.1f} MB'.format(record['input'], stage, np.median(times), peak / 1024 ** 2))
+
+def scaling_exponents(results):
+    """slope of log(median time) vs log(n_spots) per generated series and stage"""
+    exponents = {}
+    for series in sorted({r['series'] for r in results if r['series'] is not None}):
+        for stage in sorted({r['stage'] for r in results if r['series'] == series}):
+            points = [(r['n_spots'], r['median']) for r in results if r['series'] == series and r['stage'] == stage]
+            if len(points) > 1:
+                size, median = np.log(np.array(points)).T
+                exponents.setdefault(series, {})[stage] = float(np.polyfit(size, median, 1)[0])
+    return exponents
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = HERE, capture_output = True,
+                                text = True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'platform': platform.platform(),
+            'cpu_count': os.cpu_count()}
+
+def run(quick = False, repeat = 3, examples = True, generated = True, output = None):
+    series = QUICK_SERIES if quick else SERIES
+    results = []
+
+    if examples:
+        with tempfile.TemporaryDirectory() as workdir:
+            for fn in sorted(glob.glob(os.path.join(EXAMPLES_DIR, '*.xml'))):
+                with quiet():
+                    table, frame_interval, _, _ = core.read_xml_tracks(fn, cache = False)
+                record = dict(input = os.path.basename(fn), series = None, **table_size(table))
+                run_stages(file_stages(fn, workdir), record, repeat, results)
+                run_stages(table_stages(table, frame_interval), record, repeat, results)
+
+    accuracy = []
+    if generated:
+        # synthetic trackmate files with known V and D (see synthetic), parsed like real files
+        with tempfile.TemporaryDirectory() as workdir:
+            for name, sizes in series.items():
+                for n_tracks in np.atleast_1d(sizes['n_tracks']):
+                    for length in np.atleast_1d(sizes['length']):
+                        fn = os.path.join(workdir, 'synthetic_{}x{}.xml'.format(n_tracks, length))
+                        truth = synthetic.write_trackmate_xml(fn, n_tracks = int(n_tracks), length = int(length), save_truth = False)
+                        with quiet():
+                            table, frame_interval, _, _ = core.read_xml_tracks(fn, cache = False)
+                            V, D, _ = core.msd_velocity_analysis(table, frame_interval, plot = False)
+
+                        record = dict(input = os.path.basename(fn), series = name, **table_size(table))
+                        run_stages(file_stages(fn, workdir, figures = False), record, repeat, results)
+                        run_stages(table_stages(table, frame_interval), record, repeat, results)
+                        accuracy.append({'input': record['input'], 'V': float(V), 'V_true': truth['V'],
+                                         'D_fit': float(D), 'D_fit_true': truth['msd_fit_D']})
+                        os.remove(fn)
+
+    report = {'environment': environment(), 'repeat': repeat, 'results': results,
+              'scaling_exponents': scaling_exponents(results), 'accuracy': accuracy}
+
+    if accuracy:
+        print('\nweighted msd fit vs ground truth:')
+        for a in accuracy:
+            print('    {:<28} V = {:.4f} ({:.4f})  D_fit = {:.4f} ({:.4f})'.format(a['input'], a['V'], a['V_true'], a['D_fit'], a['D_fit_true']))
+
+    for name, exponents in report['scaling_exponents'].items():
+        print('\nscaling with ' + name + ' (time ~ n_spots^k):')
+        for stage, k in exponents.items():
+            print('    {:<24} k = {:.2f}'.format(stage, k))
+
+    if output is None:
+        os.makedirs(os.path.join(HERE, 'results'), exist_ok = True)
+        output = os.path.join(HERE, 'results', 'bench_{}_{}.json'.format(report['environment']['commit'] or 'nogit',
+                                                                          time.strftime('%Y%m%d_%H%M%S')))
+    with open(output, 'w') as f:
+        json.dump(report, f, indent = 1)
+    print('\nsaved ' + output)
+    return report
+
+def compare(old_fn, new_fn):
+    """prints the time and memory ratio (new / old) of every input and stage present in both runs"""
+    with open(old_fn) as f:
+        old = {(r['input'], r['stage']): r for r in json.load(f)['results']}
+    with open(new_fn) as f:
+        new = json.load(f)['results']
+
+    print('{:<28} {:<24} {:>10} {:>10} {:>8} {:>8}'.format('input', 'stage', 'old (s)', 'new (s)', 'time', 'memory'))
+    for r in new:
+        if (r['input'], r['stage']) in old:
+            o = old[(r['input'], r['stage'])]
+            print('{:<28} {:<24} {:>10.4f} {:>10.4f} {:>7.2f}x {:>7.2f}x'.format(
+                r['input'], r['stage'], o['median'], r['median'], r['median'] / o['median'],
+                r['peak_bytes'] / max(o['peak_bytes'], 1)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'benchmarks of the bkg_func.core stages')
+    parser.add_argument('--quick', action = 'store_true', help = 'smaller generated inputs and a single repeat')
+    parser.add_argument('--repeat', type = int, default = None, help = 'timed runs per stage (default: 3, quick: 1)')
+    parser.add_argument('--no_examples', action = 'store_true', help = 'skip the files in examples/')
+    parser.add_argument('--no_generated', action = 'store_true', help = 'skip the generated scaling series')
+    parser.add_argument('--output', type = str, default = None, help = 'json file (default: benchmarks/results/bench_<commit>_<time>.json)')
+    parser.add_argument('--compare', nargs = 2, metavar = ('OLD', 'NEW'), help = 'compare two saved runs instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run(quick = args.quick, repeat = args.repeat or (1 if args.quick else 3), examples = not args.no_examples,
+            generated = not args.no_generated, output = args.output)
@@ -1,11 +1,15 @@
-# bkg_functions to analyze trajectories in batch 
+# bkg_functions to analyze trajectories in batch
 # author = paulo.caldas@ist.ac.at // christoph.sommer@ist.ac.at
 
 import os
-import glob
 import sys
-from tqdm import tqdm_notebook as tqdm
-from bkg_func import core
+import time
+import inspect
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm.auto import tqdm
+from bkg_func import core, manifest
 
 class HiddenPrints:
     """
@@ -14,41 +18,170 @@ class HiddenPrints:
     """
     def __enter__(self):
         self._original_stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
+        self._devnull = open(os.devnull, 'w')
+        sys.stdout = self._devnull
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         sys.stdout = self._original_stdout
-        
+        self._devnull.close()
+
+def _init_worker():
+    """runs once in every worker process: figures are only saved to pdf, never shown
+    (matplotlib itself is only imported if the worker plots)"""
+    os.environ['MPLBACKEND'] = 'Agg'
+
+def process_file(xml_file, **analysis_kwargs):
+    """runs core.analyze_tracks on a single file and returns a record with the
+    file name, status ('ok' or 'failed'), run time in seconds, the error
+    (traceback) instead of raising, the cost of each stage (see instrument) and the
+    files written"""
+
+    record = {'file': xml_file, 'status': 'ok', 'time': 0., 'error': None, 'stages': [], 'outputs': []}
+    analysis_kwargs = dict(analysis_kwargs, stage_callback = record['stages'].append)
+    start = time.perf_counter()
+
+    try:
+        with HiddenPrints(): # this blocks print statments while running the function
+            results = core.analyze_tracks(xml_file, close_figures = True, **analysis_kwargs) # figures are in the pdf already
+        record['outputs'] = results.outputs
+    except Exception:
+        record['status'] = 'failed'
+        record['error'] = traceback.format_exc()
+        if 'matplotlib.pyplot' in sys.modules: # drop figures of a failed run
+            sys.modules['matplotlib.pyplot'].close('all')
+
+    record['time'] = time.perf_counter() - start
+    return record
+
 def run_batch_processing(files_dir,
                          track_displacement = True,
                          msd_weighted = False,
                          msd_single_track = False,
                          directionality = False,
                          plot_tracks = False,
-                         clip = 0.5, plot_every = 10):
+                         clip = 0.5, plot_every = 10, max_frame_gap = 0,
+                         cache = False, cache_dir = None, refresh_cache = False,
+                         save_statistics = False, headless = False, output_format = 'xlsx', wide_curves = False,
+                         save_timings = False, n_bootstrap = 0, bootstrap_workers = 1, n_workers = 1, incremental = False):
+    """analyzes all xml files in files_dir. with n_workers > 1 (or None for all
+    cores) files are processed in parallel worker processes using a non-interactive
+    plotting backend. headless = True writes only the excel books (no pdf, no
+    matplotlib); output_format selects the table format (see writers) and wide_curves
+    the layout of the single track msd curves (see core.analyze_tracks). with save_timings
+    the cost of each stage is saved as json next to each file's outputs; n_bootstrap > 0 adds
+    bootstrap confidence intervals to the weighted msd fit (computed in bootstrap_workers
+    processes per file). files ending in manifest.EXCLUDED_SUFFIXES
+    (e.g. the _TM.xml trackmate models) are ignored. with incremental = True files that are
+    unchanged and were already analyzed with the same parameters are skipped (see manifest).
+    returns one record per processed file (see process_file), in the order of the input files"""
 
-    data_path = os.path.join(files_dir,'*.xml')
-    files = glob.glob(data_path)
+    files = manifest.track_files(files_dir)
 
     if len(files) == 0:
         print('File directory is empty!')
-    
-    else:
-    	
-        for n_file, xml_file in tqdm(enumerate(files), desc = 'progress ...', total=len(files)):
-            
+        return []
+
+    analysis_kwargs = dict(track_displacement = track_displacement,
+                         msd_weighted = msd_weighted,
+                         msd_single_track = msd_single_track,
+                         directionality = directionality,
+                         plot_tracks = plot_tracks,
+                         clip = clip, plot_every = plot_every, max_frame_gap = max_frame_gap,
+                         cache = cache, cache_dir = cache_dir, refresh_cache = refresh_cache,
+                         save_statistics = save_statistics, headless = headless, output_format = output_format,
+                         wide_curves = wide_curves, save_timings = save_timings, n_bootstrap = n_bootstrap,
+                         bootstrap_workers = bootstrap_workers)
+
+    if incremental == True:
+        return process_incremental(files, files_dir, n_workers = n_workers, **analysis_kwargs)
+    return process_files(files, n_workers = n_workers, **analysis_kwargs)
+
+def process_incremental(files, files_dir, n_workers = 1, retry_failed = True, **analysis_kwargs):
+    """process_files on the files that are not up to date in the manifest of files_dir, which
+    is updated afterwards. failed files are tried again unless retry_failed = False (then only
+    once they change). returns the records of the processed files"""
+
+    path = manifest.manifest_path(files_dir)
+    records_manifest = manifest.load_manifest(path)
+    defaults = {name: parameter.default for name, parameter in inspect.signature(core.analyze_tracks).parameters.items()
+                if parameter.default is not inspect.Parameter.empty}
+    parameters = manifest.analysis_parameters(analysis_kwargs, defaults = defaults)
+
+    pending = [fn for fn in files
+               if not manifest.is_up_to_date(records_manifest, fn, files_dir, parameters, retry_failed = retry_failed)]
+    if len(pending) < len(files):
+        print('{} of {} files up to date ... skipping'.format(len(files) - len(pending), len(files)))
+    if len(pending) == 0:
+        return []
+
+    records = process_files(pending, n_workers = n_workers, **analysis_kwargs)
+    for record in records:
+        manifest.update_manifest(records_manifest, record, files_dir, parameters)
+    manifest.save_manifest(records_manifest, path)
+    return records
+
+def watch_folder(files_dir, interval = 30., settle_time = None, max_polls = None, n_workers = 1, **analysis_kwargs):
+    """incremental batch processing of files_dir every `interval` seconds until interrupted
+    (ctrl-c) or after max_polls polls, for folders that are filled while acquiring. a file is
+    only picked up once it was not modified for settle_time seconds (default: interval), so
+    files that are still being written are left for the next poll; failed files are only tried
+    again once they change. analysis_kwargs as in core.analyze_tracks. returns the records of
+    all processed files"""
+
+    settle_time = interval if settle_time is None else settle_time
+    records, polls = [], 0
+    print('watching {} (every {} s, ctrl-c to stop)'.format(files_dir, interval))
+
+    try:
+        while max_polls is None or polls < max_polls:
+            now = time.time()
+            files = [fn for fn in manifest.track_files(files_dir) if now - os.path.getmtime(fn) >= settle_time]
+            records.extend(process_incremental(files, files_dir, n_workers = n_workers, retry_failed = False,
+                                               **analysis_kwargs))
+            polls += 1
+            if max_polls is None or polls < max_polls:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        print('stopped watching ' + files_dir)
+
+    return records
+
+def process_files(files, n_workers = 1, **analysis_kwargs):
+    """analyzes a list of xml files (see run_batch_processing; analysis_kwargs
+    are passed to core.analyze_tracks) and returns one record per file"""
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    if n_workers <= 1:
+        records = []
+        for xml_file in tqdm(files, desc = 'progress ...'):
             print('processing ' + os.path.basename(xml_file))
-			
-            try:
-                with HiddenPrints(): core.analyze_tracks(xml_file, #this blocks print statments while running the function
-                                					track_displacement = track_displacement,
-					                                msd_weighted = msd_weighted,
-					                                msd_single_track = msd_single_track,
-					                                directionality = directionality,
-					                                plot_tracks = plot_tracks,
-					                                clip = clip, plot_every = plot_every)
-            except:
-                print ("\t something went wrong: file could not be processed ... skipping")
-                continue
-    
-    print('\ncomplete!')
\ No newline at end of file
+            records.append(process_file(xml_file, **analysis_kwargs))
+
+            if records[-1]['status'] != 'ok':
+                print("\t something went wrong: file could not be processed ... skipping")
+
+    else:
+        # 'spawn' gives clean workers (no copy of the notebook kernel state)
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers = n_workers, mp_context = context, initializer = _init_worker) as pool:
+            futures = {pool.submit(process_file, xml_file, **analysis_kwargs): n for n, xml_file in enumerate(files)}
+            records = [None] * len(files)
+
+            for future in tqdm(as_completed(futures), desc = 'progress ...', total = len(files)):
+                n = futures[future]
+                try:
+                    records[n] = future.result()
+                except Exception: # the worker itself died (e.g. out of memory)
+                    records[n] = {'file': files[n], 'status': 'failed', 'time': 0., 'error': traceback.format_exc(),
+                                  'stages': [], 'outputs': []}
+
+    failed = [record for record in records if record['status'] != 'ok']
+    for record in failed:
+        print('\nfailed: ' + os.path.basename(record['file']))
+        print(record['error'])
+
+    print('\ncomplete! {} of {} files processed in {:.1f} s'.format(len(records) - len(failed), len(records),
+                                                                   sum(record['time'] for record in records)))
+    return records
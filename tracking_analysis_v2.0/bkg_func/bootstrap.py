@@ -0,0 +1,154 @@
+# bkg_functions to estimate confidence intervals of the weighted msd fit by bootstrap
+# tracks are resampled with replacement. every track is summarized once by its per-lag
+# count, sum and sum of squares (core.per_track_msd_statistics); a replicate only weights
+# these sums by how often each track was drawn (a sparse matrix product) and refits
+# D and V, so displacements are never recomputed
+
+import os
+import math
+import multiprocessing
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from bkg_func import core
+from bkg_func.lagstats import LagStatistics
+
+BootstrapFit = namedtuple("BootstrapFit", ['D', 'V', 'velocity', 'D_ci', 'V_ci', 'velocity_ci',
+                                           'D_replicates', 'V_replicates', 'confidence', 'n_tracks'])
+
+class TrackLagSums:
+    """
+    Per-lag count, sum and sum of squares of the squared displacements of every
+    track, as three sparse matrices (n_tracks x n_lags, lags in frames).
+    """
+    def __init__(self, row_offsets, counts, sums, sumsqs, frame_interval, track_ids = None):
+        from scipy import sparse
+
+        row_offsets = np.asarray(row_offsets, dtype = np.int64)
+        n_tracks = len(row_offsets) - 1
+        row_lengths = np.diff(row_offsets)
+        lag_index = np.arange(row_offsets[-1]) - np.repeat(row_offsets[:-1], row_lengths)
+        shape = (n_tracks, int(row_lengths.max()) if n_tracks else 0)
+
+        self.counts, self.sums, self.sumsqs = (sparse.csr_matrix((np.asarray(values, dtype = float), lag_index, row_offsets),
+                                                                 shape = shape) for values in (counts, sums, sumsqs))
+        self.frame_interval = float(frame_interval)
+        self.track_ids = track_ids
+
+    @classmethod
+    def from_table(cls, table_tracks, frame_interval, coords = ['POSITION_X', 'POSITION_Y']):
+        track_ids, positions, frames, offsets = core.tracks_to_arrays(table_tracks, coords = coords)
+        return cls(*core.per_track_msd_statistics(positions, frames, offsets), frame_interval, track_ids = track_ids)
+
+    @property
+    def n_tracks(self):
+        return self.counts.shape[0]
+
+    def pooled(self):
+        """statistics of all tracks together (same as core.msd_statistics)"""
+        return LagStatistics(*(np.asarray(m.sum(axis = 0)).ravel() for m in (self.counts, self.sums, self.sumsqs)),
+                             self.frame_interval, kind = 'msd')
+
+    def resampled(self, track_weights):
+        """counts, sums and sums of squares (n_replicates x n_lags) for each row of track
+        weights (n_replicates x n_tracks, e.g. how often each track was drawn)"""
+        track_weights = np.asarray(track_weights, dtype = float)
+        return tuple(np.asarray((m.T @ track_weights.T).T) for m in (self.counts, self.sums, self.sumsqs))
+
+def resample_weights(n_tracks, n_replicates, rng):
+    """how often each track is drawn in each replicate (n tracks drawn with replacement)"""
+    draws = rng.integers(0, n_tracks, size = (n_replicates, n_tracks))
+    draws += np.arange(n_replicates)[:, None] * n_tracks
+    return np.bincount(draws.ravel(), minlength = n_replicates * n_tracks).reshape(n_replicates, n_tracks)
+
+def fit_replicates(counts, sums, sumsqs, lags, weights = 'std'):
+    """weighted_msd_fit of many replicates at once (rows of counts, sums, sumsqs) on the given
+    lags (frames). lags not observed in a replicate or with zero variance get no weight.
+    returns D and V (t^2 coefficient) in frame units"""
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        n = counts[:, lags]
+        means = sums[:, lags] / n
+        sigma = np.sqrt(np.maximum(sumsqs[:, lags] / n - means ** 2, 0))
+
+        if weights == 'sem':
+            sigma = sigma / np.sqrt(n)
+        elif weights == 'none':
+            sigma = np.where(n > 0, 1., np.nan)
+        elif weights != 'std':
+            raise ValueError("weights must be 'std', 'sem' or 'none', got '{}'".format(weights))
+
+        D, V, cov = core.weighted_parabola_fit(lags, means, sigma)
+    return D, V
+
+def _replicate_chunk(track_sums, seed, n_replicates, lags, weights):
+    rng = np.random.default_rng(seed)
+    track_weights = resample_weights(track_sums.n_tracks, n_replicates, rng)
+    return fit_replicates(*track_sums.resampled(track_weights), lags, weights = weights)
+
+_worker_sums = None
+
+def _init_worker(track_sums):
+    global _worker_sums
+    _worker_sums = track_sums # sent once per worker, not once per chunk
+
+def _worker_chunk(seed, n_replicates, lags, weights):
+    return _replicate_chunk(_worker_sums, seed, n_replicates, lags, weights)
+
+def bootstrap_msd_fit(table_tracks, frame_interval, n_replicates = 2000, clip = 0.5, weights = 'std',
+                      confidence = 0.95, seed = 0, n_workers = 1, chunk_size = 250,
+                      coords = ['POSITION_X', 'POSITION_Y']):
+    """bootstrap over tracks of the weighted msd fit (see core.weighted_msd_fit): tracks
+    are resampled with replacement n_replicates times and D and V are refitted on the
+    same lags. table_tracks can also be a TrackLagSums. replicates are generated in chunks
+    of chunk_size, each with its own child of SeedSequence(seed), so the result depends on
+    seed but not on n_workers (> 1 runs the chunks in a process pool, None = all cores).
+    returns a BootstrapFit with the full-data estimates, percentile confidence intervals
+    and the replicates (D in um^2/s, V = velocity^2 in um^2/s^2, velocity in um/s)"""
+
+    track_sums = table_tracks if isinstance(table_tracks, TrackLagSums) else \
+                 TrackLagSums.from_table(table_tracks, frame_interval, coords = coords)
+
+    msd_stats = track_sums.pooled()
+    lags = core.fit_lags(msd_stats, clip = clip)
+    D, V, cov = core.weighted_msd_fit(msd_stats, clip = clip, weights = weights)
+
+    n_chunks = math.ceil(n_replicates / chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    sizes = [min(chunk_size, n_replicates - n * chunk_size) for n in range(n_chunks)]
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    if n_workers <= 1 or n_chunks == 1:
+        chunks = [_replicate_chunk(track_sums, s, size, lags, weights) for s, size in zip(seeds, sizes)]
+    else:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers = min(n_workers, n_chunks), mp_context = context,
+                                 initializer = _init_worker, initargs = (track_sums,)) as pool:
+            chunks = list(pool.map(_worker_chunk, seeds, sizes, [lags] * n_chunks, [weights] * n_chunks))
+
+    # frames to seconds, as weighted_msd_fit
+    frame_interval = track_sums.frame_interval
+    D_replicates = np.concatenate([chunk[0] for chunk in chunks]) / frame_interval
+    V_replicates = np.concatenate([chunk[1] for chunk in chunks]) / frame_interval ** 2
+
+    percentiles = 100 * np.array([(1 - confidence) / 2, (1 + confidence) / 2])
+    D_ci = np.nanpercentile(D_replicates, percentiles)
+    V_ci = np.nanpercentile(V_replicates, percentiles)
+
+    return BootstrapFit(D, V, np.sqrt(V), D_ci, V_ci, np.sqrt(np.maximum(V_ci, 0)),
+                        D_replicates, V_replicates, confidence, track_sums.n_tracks)
+
+def bootstrap_table(fit):
+    """summary table: estimate, confidence interval and bootstrap std of D, V and the velocity (nm/s)"""
+    velocity_replicates = np.sqrt(np.maximum(fit.V_replicates, 0)) * 1000
+    rows = [('D', fit.D, fit.D_ci, np.nanstd(fit.D_replicates)),
+            ('V', fit.V, fit.V_ci, np.nanstd(fit.V_replicates)),
+            ('velocity_nm', fit.velocity * 1000, fit.velocity_ci * 1000, np.nanstd(velocity_replicates))]
+
+    return pd.DataFrame([(name, estimate, ci[0], ci[1], std, fit.confidence, len(fit.D_replicates), fit.n_tracks)
+                         for name, estimate, ci, std in rows],
+                        columns = ['parameter', 'estimate', 'ci_low', 'ci_high', 'bootstrap_std', 'confidence',
+                                   'n_replicates', 'n_tracks'])
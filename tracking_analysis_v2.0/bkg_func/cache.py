@@ -0,0 +1,143 @@
+# bkg_functions to cache parsed trajectories on disk
+# the parsed columns of a trackmate xml file are stored as an uncompressed .npz
+# (one binary array per column) either next to the xml or inside a cache directory,
+# with the cache key and xml header in a small json file next to it (see meta_path)
+
+import os
+import json
+import hashlib
+import numpy as np
+
+CACHE_SUFFIX = '_tracks_cache.npz'
+META_SUFFIX = '_tracks_cache.json'
+MAX_CACHE_SIZE = 2 * 1024 ** 3 # bytes, only enforced for cache directories
+
+def hash_file(fn, chunk_size = 1 << 20):
+    """content hash (blake2b) of a file, read in chunks"""
+    digest = hashlib.blake2b(digest_size = 16)
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_path(fn, cache_dir = None):
+    """location of the cache file of a given xml file: next to it by default or,
+    if cache_dir is given, inside that directory (named after the absolute path)"""
+
+    name = os.path.splitext(os.path.basename(fn))[0]
+    if cache_dir is None:
+        return os.path.join(os.path.dirname(os.path.abspath(fn)), name + CACHE_SUFFIX)
+
+    key = hashlib.blake2b(os.path.abspath(fn).encode('utf-8'), digest_size = 8).hexdigest()
+    return os.path.join(cache_dir, '{}_{}{}'.format(name, key, CACHE_SUFFIX))
+
+def meta_path(path):
+    """json file with the key (size, mtime, hash), column names and xml header of a cache file"""
+    return path[:-len(CACHE_SUFFIX)] + META_SUFFIX
+
+def _replace(path, write):
+    # write to a temporary file first so an interrupted run never leaves a broken cache
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+def _write_meta(path, meta):
+    _replace(meta_path(path), lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+def save_cache(fn, columns, header, cache_dir = None, max_cache_size = MAX_CACHE_SIZE):
+    """stores the parsed columns (dict of numpy arrays) and the xml header of `fn`.
+    the cache key is the size, mtime and content hash of the xml file"""
+
+    stat = os.stat(fn)
+    meta = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': hash_file(fn),
+            'columns': list(columns), 'header': header}
+
+    path = cache_path(fn, cache_dir)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok = True)
+
+    # the columns are only valid once the new metadata is written
+    if os.path.exists(meta_path(path)):
+        os.remove(meta_path(path))
+    _replace(path, lambda f: np.savez(f, **columns))
+    _write_meta(path, meta)
+
+    if cache_dir is not None and max_cache_size is not None:
+        evict_cache(cache_dir, max_cache_size, keep = path)
+
+    return path
+
+def load_cache(fn, cache_dir = None, columns = None):
+    """returns (columns, header) from the cache of `fn` or None if there is no valid
+    cache. a changed size invalidates the cache; a changed mtime only does so if
+    the content hash changed as well (e.g. a copied or touched file is still a hit, and
+    the new mtime is stored in the json metadata so the next load skips the hash).
+    if `columns` is given, all of them must be present in the cache"""
+
+    path = cache_path(fn, cache_dir)
+    if not os.path.exists(path) or not os.path.exists(meta_path(path)):
+        return None # no cache, or from an older layout (metadata inside the npz)
+
+    try:
+        with open(meta_path(path), 'rb') as f:
+            meta = json.loads(f.read().decode('utf-8'))
+        stat = os.stat(fn)
+
+        if meta['size'] != stat.st_size:
+            return None
+        touched = meta['mtime'] != stat.st_mtime_ns
+        if touched and meta['hash'] != hash_file(fn):
+            return None
+        if columns is not None and not set(columns) <= set(meta['columns']):
+            return None
+
+        with np.load(path, allow_pickle = False) as data:
+            cached = {name: data[name] for name in (meta['columns'] if columns is None else columns)}
+
+    except (OSError, ValueError, KeyError):
+        return None # unreadable: treat as a miss
+
+    try:
+        if touched:
+            meta['mtime'] = stat.st_mtime_ns
+            _write_meta(path, meta) # same content, new mtime: only the json is rewritten
+        os.utime(path) # last use, for the eviction policy
+    except OSError:
+        pass # read-only cache: still a hit
+    return cached, meta['header']
+
+def invalidate_cache(fn, cache_dir = None):
+    """removes the cache of a given xml file (if any)"""
+    path = cache_path(fn, cache_dir)
+    for cache_file in (path, meta_path(path)):
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+
+def evict_cache(cache_dir, max_cache_size = MAX_CACHE_SIZE, keep = None):
+    """deletes the least recently used cache files until the directory holds at
+    most max_cache_size bytes (the file `keep` is never deleted)"""
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(CACHE_SUFFIX):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_cache_size:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        os.remove(path)
+        if os.path.exists(meta_path(path)):
+            os.remove(meta_path(path))
+        total -= size
+
+    return total
+
+def clear_cache(cache_dir):
+    """deletes all cache files in a cache directory"""
+    return evict_cache(cache_dir, max_cache_size = 0)
@@ -2,35 +2,134 @@
 # author = paulo.caldas@ist.ac.at // christoph.sommer@ist.ac.at
 
 # import the basics
+import os
 import pandas as pd
 import numpy as np
 import warnings
 from functools import partial
-from collections import defaultdict
-from scipy.optimize import curve_fit
-from matplotlib import pyplot as plt
-from xml.etree import cElementTree as ET
-from matplotlib.backends.backend_pdf import PdfPages
+from collections import defaultdict, namedtuple
+from xml.etree import ElementTree as ET
+from bkg_func import cache as track_cache
+from bkg_func.lagstats import LagStatistics
+from bkg_func.ragged import RaggedCurves
+from bkg_func import writers
+from bkg_func import instrument
 
 # read and plot trajectories from xml files
 
-def read_xml_tracks(fn):
+def _resize_columns(columns, size):
+    """resizes (in place) all numpy columns of a dictionary to the given number of rows"""
+    for column in columns.values():
+        column.resize(size, refcheck = False)
+
+def _new_columns(read_z = False):
+    names = ['FRAME', 'POSITION_X', 'POSITION_Y'] + (['POSITION_Z'] if read_z else [])
+    spots = {name: np.empty(4096, dtype = np.int64 if name == 'FRAME' else float) for name in names}
+    return spots, np.empty(1024, dtype = np.int64)
+
+def _block_columns(spots, track_lengths, n_spots, n_tracks, first_track):
+    """trims the columns of a block (in place) and adds TRACK_ID (numbered from first_track)"""
+    _resize_columns(spots, n_spots)
+    track_lengths.resize(n_tracks, refcheck = False)
+
+    columns = {'TRACK_ID': first_track + np.repeat(np.arange(n_tracks), track_lengths)}
+    columns.update(spots)
+    return columns
+
+def iter_xml_track_blocks(fn, read_z = False, block_spots = None):
+    """Streams a trackmate Tracks xml file with iterparse and fills preallocated numpy
+    columns (FRAME, POSITION_X, POSITION_Y and optionally POSITION_Z), clearing the
+    xml elements as it goes. columns grow by doubling. yields (columns, header) for
+    blocks of whole tracks with at least block_spots spots (the last block may have
+    less) or, with block_spots = None, once for the whole file (the nTracks and nSpots
+    attributes are then used to preallocate when present). TRACK_ID numbers the tracks
+    in file order across blocks; header holds the attributes of the <Tracks> element"""
+
+    spots, track_lengths = _new_columns(read_z)
+
+    header = {}
+    n_spots, n_tracks, particle_start, first_track = 0, 0, 0, 0
+    root = None
+
+    for event, elem in ET.iterparse(fn, events = ('start', 'end')):
+
+        if event == 'start':
+            if elem.tag == 'Tracks':
+                root, header = elem, dict(elem.attrib)
+                if block_spots is None and 'nTracks' in header and int(header['nTracks']) > len(track_lengths):
+                    track_lengths.resize(int(header['nTracks']), refcheck = False)
+
+            elif elem.tag == 'particle':
+                particle_start = n_spots
+
+                # make room for the whole particle at once
+                needed = n_spots + int(elem.attrib.get('nSpots', 0))
+                capacity = len(spots['FRAME'])
+                while capacity < needed:
+                    capacity *= 2
+                if capacity > len(spots['FRAME']):
+                    _resize_columns(spots, capacity)
+            continue
+
+        if elem.tag == 'detection':
+            if n_spots == len(spots['FRAME']):
+                _resize_columns(spots, 2 * n_spots)
+
+            attrib = elem.attrib
+            spots['FRAME'][n_spots] = int(attrib['t'])
+            spots['POSITION_X'][n_spots] = float(attrib['x'])
+            spots['POSITION_Y'][n_spots] = float(attrib['y'])
+            if read_z:
+                spots['POSITION_Z'][n_spots] = float(attrib.get('z', 0))
+            n_spots += 1
+
+        elif elem.tag == 'particle':
+            if n_tracks == len(track_lengths):
+                track_lengths.resize(2 * n_tracks, refcheck = False)
+            track_lengths[n_tracks] = n_spots - particle_start
+            n_tracks += 1
+            root.clear() # drops the finished particle and its detections
+
+            if block_spots is not None and n_spots >= block_spots:
+                yield _block_columns(spots, track_lengths, n_spots, n_tracks, first_track), header
+                first_track += n_tracks
+                spots, track_lengths = _new_columns(read_z)
+                n_spots, n_tracks = 0, 0
+
+        elem.clear()
+
+    if n_tracks > 0 or first_track == 0: # the rest, or an empty block for a file without tracks
+        yield _block_columns(spots, track_lengths, n_spots, n_tracks, first_track), header
+
+def parse_xml_tracks(fn, read_z = False):
+    """parses a whole trackmate Tracks xml file (see iter_xml_track_blocks) and returns
+    the columns (including TRACK_ID) as a dictionary and the attributes of the <Tracks> header"""
+    return next(iter_xml_track_blocks(fn, read_z = read_z))
+
+def read_xml_tracks(fn, read_z = False, cache = False, cache_dir = None, refresh_cache = False,
+                    max_cache_size = track_cache.MAX_CACHE_SIZE):
     """Reads tracks from trackmate xml file and returns frame_interval, time_units,
-	space_units and a table containg spot coordenates"""
-    
-    tracks = ET.parse(fn)
-    frame_interval = float(tracks.getroot().attrib["frameInterval"])
-    time_units = str(tracks.getroot().attrib["timeUnits"])
-    space_units = str(tracks.getroot().attrib["spaceUnits"])
-    
-    attributes = []
-    for ti, track in enumerate(tracks.iterfind('particle')):
-        for spots in track.iterfind('detection'):
-            attributes.append([ti, int(spots.attrib.get('t')),
-                                   float(spots.attrib.get('x')),
-                                   float(spots.attrib.get('y'))])
-
-    track_table = pd.DataFrame(attributes, columns=['TRACK_ID','FRAME','POSITION_X','POSITION_Y'])
+	space_units and a table containg spot coordenates. with cache = True the parsed
+	table is stored in a binary file (next to the xml or in cache_dir) and loaded from
+	there on later calls; refresh_cache = True forces parsing the xml again"""
+    
+    names = ['TRACK_ID', 'FRAME', 'POSITION_X', 'POSITION_Y'] + (['POSITION_Z'] if read_z else [])
+    cached = None
+
+    if cache and not refresh_cache:
+        cached = track_cache.load_cache(fn, cache_dir, columns = names)
+
+    if cached is not None:
+        columns, header = cached
+    else:
+        columns, header = parse_xml_tracks(fn, read_z = read_z)
+        if cache:
+            track_cache.save_cache(fn, columns, header, cache_dir, max_cache_size = max_cache_size)
+    frame_interval = float(header["frameInterval"])
+    time_units = str(header["timeUnits"])
+    space_units = str(header["spaceUnits"])
+
+    track_table = pd.DataFrame(columns)
     track_table['POSITION_T'] = track_table["FRAME"] * frame_interval
     
     print('\nphysical units: {}, {}'.format(space_units, time_units))
@@ -41,16 +140,8 @@ def read_xml_tracks(fn):
 
 def plot_trajectories(table_tracks):
     """ Shows all the tracks """
-    
-    fig, ax = plt.subplots(figsize = (4,4), dpi = 120)
-    plt.xlabel('x (microns)', fontsize=10)
-    plt.ylabel('y (microns)', fontsize=10)
-    #plt.xlim([0,55])
-    #plt.ylim([0,55])
-    
-    for groups, columns in table_tracks.groupby('TRACK_ID'):
-        plt.plot(columns['POSITION_X'],columns['POSITION_Y'], lw = 1)
-    plt.title('Number of Tracks = ' + str(groups), fontsize = 9)
+    from bkg_func import plotting
+    return plotting.plot_trajectories(table_tracks)
 	
 # all velocity functions
 
@@ -61,25 +152,32 @@ def compute_desloc_per_step(trajectory, frame_interval, coords = ['POSITION_X','
     return desloc_per_step
 	
 
-def velocities_distribution(table_tracks, frame_interval, bins = 10):
-    '''plots distribuition of velocities for all tracks directly from the track displacement'''
+def step_velocities(positions, frames, offsets, frame_interval, max_frame_gap = 0):
+    """speed of every step of all tracks at once (spots grouped per track as returned
+    by tracks_to_arrays): a single diff over the whole position array, with the
+    steps across track boundaries masked out. with max_frame_gap > 0 each step is
+    divided by its real duration (frame gap) instead of one frame interval"""
+
+    same_track = np.diff(_track_of_spot(offsets)) == 0
+    step_length = np.sqrt(np.square(np.diff(positions, axis = 0)).sum(axis = 1))[same_track]
+
+    if max_frame_gap > 0:
+        return step_length / (np.diff(frames)[same_track] * frame_interval)
+    return step_length / frame_interval
+
+def velocities_distribution(table_tracks, frame_interval, bins = 10, max_frame_gap = 0, coords = ['POSITION_X', 'POSITION_Y'], plot = True):
+    '''plots distribuition of velocities for all tracks directly from the track displacement.
+    set max_frame_gap as in the tracking to correct steps that skip frames'''
     
     print('... track displacement velocity analysis ... ')
     
-    desloc_all_tracks = table_tracks.groupby("TRACK_ID").apply(compute_desloc_per_step, frame_interval = frame_interval);
-    vel_dist = np.sqrt((desloc_all_tracks[['POSITION_X', 'POSITION_Y']] ** 2).sum(1)) / frame_interval * 1000 # in nm/s
+    track_ids, positions, frames, offsets = tracks_to_arrays(table_tracks, coords = coords)
+    vel_dist = step_velocities(positions, frames, offsets, frame_interval, max_frame_gap = max_frame_gap) * 1000 # in nm/s
     
     # plot histogram of velocitites in nanometers
-    plt.figure(figsize = (4,3), dpi = 120)
-    
-    counts, bins, patches = plt.hist(vel_dist, bins = bins, 
-                                     color = 'seagreen', alpha = 0.8, edgecolor = 'w',
-                                     label = 'n_spots = ' + str(len(vel_dist)))
-    
-    plt.xlabel('velocitities (nm/s)', fontsize = 10)
-    plt.ylabel('counts', fontsize = 10)
-    plt.legend(loc = 0, fontsize = 8, frameon = True)
-    plt.title("track displacement velocities", fontsize = 9)
+    if plot:
+        from bkg_func import plotting
+        plotting.plot_velocities_distribution(vel_dist, bins = bins)
     
     return vel_dist
 
@@ -102,95 +200,188 @@ def msd_per_track(trajectory, coords):
     taus = np.array(range(1,n_shifts))
     return taus, msds
 
+def msd_fft(positions):
+    """MSD of one trajectory (array n_spots x n_dims) for shifts 1..n-1 in O(N log N).
+    uses MSD(m) = S1(m) - 2*S2(m), where S2 is the positional autocorrelation
+    computed with a zero-padded FFT and S1 comes from cumulative sums of |r|^2"""
+
+    positions = positions - positions.mean(axis = 0) # msd is translation invariant, centering avoids round-off
+    n = len(positions)
+    if n < 2:
+        return np.zeros(0)
+
+    n_fft = 1 << (2 * n - 1).bit_length()
+    spectrum = np.fft.rfft(positions, n = n_fft, axis = 0)
+    autocorr = np.fft.irfft((spectrum * spectrum.conj()).real, n = n_fft, axis = 0)[:n].sum(axis = 1)
+
+    sq = np.square(positions).sum(axis = 1)
+    cumsq = np.r_[0, np.cumsum(sq)]
+    m = np.arange(n)
+    s1 = cumsq[n - m] + (cumsq[n] - cumsq[m])
+
+    msds = (s1 - 2 * autocorr) / (n - m)
+    return np.maximum(msds[1:], 0)
+
+def msd_per_track_fft(trajectory, coords):
+    """Compute MSD for one trajectory (FFT version of msd_per_track)"""
+
+    taus = np.arange(1, len(trajectory))
+    return taus, msd_fft(trajectory[coords].to_numpy(dtype = float))
+
 def parabola(t, D, V):                        
     return D*t + V*(t**2)
-    
-def single_track_analysis(table_tracks, frame_interval, clip = 0.5, plot_every = 10, bins = 10, coords = ['POSITION_X', 'POSITION_Y']):
+
+def _curve_positions(offsets):
+    """curve number and position inside the curve of every value of a CSR layout"""
+    lengths = np.diff(offsets)
+    curve = np.repeat(np.arange(len(lengths)), lengths)
+    position = np.arange(offsets[-1] - offsets[0]) - np.repeat(offsets[:-1] - offsets[0], lengths)
+    return curve, position
+
+def fit_parabola_batch(values, offsets, frame_interval, clip = 0.5):
+    """least-squares fit of parabola(t, D, V) to many msd curves at once. the model is
+    linear in D and V, so all fits are solved in closed form from the 2x2 normal
+    equations. curves are given in CSR layout: the msd values of curve i are
+    values[offsets[i]:offsets[i+1]] at delays 1, 2, 3 ... frames, and only the first
+    int(len * clip) points of each curve are fitted.
+    returns D, V, their covariance (n_curves x 2 x 2, scaled by the residual variance
+    as curve_fit does) and a flag for negative V. curves with less than 2 fitted
+    points get nan, curves with exactly 2 get an infinite covariance"""
+
+    values = np.asarray(values, dtype = float)
+    offsets = np.asarray(offsets)
+    n_curves = len(offsets) - 1
+    n_fit = (np.diff(offsets) * clip).astype(int)
+
+    curve, position = _curve_positions(offsets)
+    fitted = position < n_fit[curve]
+    curve, y = curve[fitted], values[offsets[0]:offsets[-1]][fitted]
+    t = position[fitted] + 1. # solve in frames (better conditioned), rescale at the end
+
+    def per_curve(weights):
+        return np.bincount(curve, weights = weights, minlength = n_curves)
+
+    s2, s3, s4 = per_curve(t ** 2), per_curve(t ** 3), per_curve(t ** 4)
+    sty, st2y = per_curve(t * y), per_curve(t ** 2 * y)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        det = s2 * s4 - s3 ** 2
+        D = (s4 * sty - s3 * st2y) / det
+        V = (s2 * st2y - s3 * sty) / det
+
+        residuals = per_curve((y - D[curve] * t - V[curve] * t ** 2) ** 2)
+        dof = n_fit - 2
+        s_sq = np.where(dof > 0, residuals / np.maximum(dof, 1), np.inf)
+
+        cov = np.empty((n_curves, 2, 2))
+        cov[:, 0, 0], cov[:, 1, 1] = s4 / det, s2 / det
+        cov[:, 0, 1] = cov[:, 1, 0] = -s3 / det
+        cov *= s_sq[:, None, None]
+
+    too_short = n_fit < 2
+    D[too_short], V[too_short], cov[too_short] = np.nan, np.nan, np.nan
+
+    # frames -> seconds
+    D, V = D / frame_interval, V / frame_interval ** 2
+    cov[:, 0, 0] /= frame_interval ** 2
+    cov[:, 0, 1] /= frame_interval ** 3
+    cov[:, 1, 0] /= frame_interval ** 3
+    cov[:, 1, 1] /= frame_interval ** 4
+
+    return D, V, cov, V < 0
+
+def fit_parabola_curve_fit(values, offsets, frame_interval, clip = 0.5):
+    """same as fit_parabola_batch, but with one scipy curve_fit call per curve
+    (slow, kept for validation)"""
+    from scipy.optimize import curve_fit
+
+    n_curves = len(offsets) - 1
+    D, V, cov = np.full(n_curves, np.nan), np.full(n_curves, np.nan), np.full((n_curves, 2, 2), np.nan)
+
+    for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        n_fit = int((end - start) * clip)
+        if n_fit < 2:
+            continue
+
+        taus = np.arange(1, n_fit + 1) * frame_interval
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            (D[i], V[i]), cov[i] = curve_fit(parabola, taus, values[start:start + n_fit], p0 = (1,1))
+
+    return D, V, cov, V < 0
+
+def fitted_and_accepted(V, negative):
+    ''' curves with a fit (V is nan for curves with less than 2 fitted points, see
+    fit_parabola_batch) and the accepted ones (fitted and positive V) '''
+    fitted = np.isfinite(V)
+    return fitted, fitted & ~negative # negative velocities are discarded
+    
+SingleTrackFits = namedtuple("SingleTrackFits", ['track_ids', 'values', 'offsets', 'D', 'V', 'cov', 'accepted', 'n_fits'])
+
+def single_track_fits(table_tracks, frame_interval, clip = 0.5, coords = ['POSITION_X', 'POSITION_Y'],
+                      method = 'fft', fit = 'closed_form'):
+    ''' msd curve of each track (values in CSR layout, see fit_parabola_batch) and the fit of
+    parabola(t, D, V) to each of them. `accepted` marks the tracks long enough to be fitted
+    and with positive V; n_fits counts the fitted tracks (including negative V).
+    method 'loop' computes the curves with the original per-shift loop and fit 'curve_fit'
+    runs one scipy fit per track (both slow, kept for validation)'''
+
+    # computes curve (tau,msd pair) for each track
+    if method == 'fft':
+        track_ids, positions, frames, offsets = tracks_to_arrays(table_tracks, coords = coords)
+        all_msds = [msd_fft(positions[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+
+    elif method == 'loop':
+        all_msd_curves = table_tracks.groupby("TRACK_ID").apply(msd_per_track, coords=coords)
+        track_ids = all_msd_curves.index.to_numpy()
+        all_msds = [np.asarray(msd, dtype = float) for taus, msd in all_msd_curves]
+
+    else:
+        raise ValueError("method must be 'fft' or 'loop', got '{}'".format(method))
+
+    # fit quadratic equation to all curves at once (clip defines the % of the length of the track to fit)
+    curve_lengths = np.array([len(msd) for msd in all_msds], dtype = np.int64)
+    curve_offsets = np.r_[0, np.cumsum(curve_lengths)]
+    curve_values = np.concatenate(all_msds + [np.zeros(0)])
+
+    if fit == 'closed_form':
+        D, V, cov, negative = fit_parabola_batch(curve_values, curve_offsets, frame_interval, clip = clip)
+    elif fit == 'curve_fit':
+        D, V, cov, negative = fit_parabola_curve_fit(curve_values, curve_offsets, frame_interval, clip = clip)
+    else:
+        raise ValueError("fit must be 'closed_form' or 'curve_fit', got '{}'".format(fit))
+
+    # msds with enough data points (frames) to make the fitting work
+    fitted, accepted = fitted_and_accepted(V, negative)
+
+    return SingleTrackFits(track_ids, curve_values, curve_offsets, D, V, cov, accepted, int(fitted.sum()))
+
+def single_track_analysis(table_tracks, frame_interval, clip = 0.5, plot_every = 10, bins = 10, coords = ['POSITION_X', 'POSITION_Y'],
+                          method = 'fft', fit = 'closed_form', plot = True, wide = False, return_fits = False):
     ''' fits quadratic velocity to each msd curve individually, with fitting parameters 
     diffusion coefficient (D) and velocity (V). the output is (i) velocity distribution
-    array from all tracks and (ii) a list containing all the tau/msd curves'''
+    array from all tracks and (ii) all the tau/msd curves as RaggedCurves (values,
+    offsets and track ids, see ragged) or, with wide = True, as the nan-padded table,
+    and (iii) the SingleTrackFits if return_fits = True.
+    see single_track_fits for method and fit'''
     
     print('... single track msd analysis ...')
-          
-    all_velocities = [] # will store velocities
-    
-    # computes curve (tau,msd pair) for each track
-    all_msd_curves = table_tracks.groupby("TRACK_ID").apply(msd_per_track, coords=coords)
-      
-    # plot each curve and fit quadratic equation
-    
-    fig, ax = plt.subplots(1, 2, figsize=(8, 3),  dpi = 120)
-    
-    clip = clip             # defines the % of the length of the track to fit the equation below
-    filtered_tracks = 0     # count number of final tracks analyzed
-    
-    for i, (taus, msd) in enumerate(all_msd_curves):                    
-        
-        np.insert(taus,0,0); np.insert(msd,0,0)
-        
-        taus = taus * frame_interval # convert number of frames in seconds
-        
-        # msds with at least 5 data points (frames) to make tHe fitting work
-        
-        if len(taus) > 2:
-            
-            filtered_tracks += 1
-            
-            #define the % of the length of the track to fit the equation
-            clip = int(len(msd) * clip)
-            
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                
-                (D, V), cov = curve_fit(parabola, taus[:clip], msd[:clip], p0 = (1,1))
-
-                if V < 0: 
-                    continue
-                    
-                    print('negative velocity!')
-				
-                V = np.sqrt(V)
-                                
-            #t_values = np.linspace(0,taus[-1],300)
-            
-            if i % plot_every == 0: # plot only every nth curve to save ram memory and time
-                
-                ax[0].plot(taus, msd, '-o', markersize = 2, markeredgecolor = 'black', markeredgewidth = 0.2, 
-										alpha = 0.4, lw = 1., color = plt.cm.Greens(i*0.1 + 100))
-                
-                
-				# in case one wants to show the fits instead
-				#ax[0].plot(t_values, parabola(t_values, D,V), '-', lw = 0.8, color = plt.cm.Greens(i*0.1))
-                ax[0].set_title("single track MSD analysis", fontsize = 9)
-                ax[0].set_xlabel('delay (s)', fontsize = 10)
-                ax[0].set_ylabel('MSD ($\mu$m$^2$)', fontsize = 10)
-            
-            all_velocities.append(V * 1000) #save all velocities in nanometers
-    
-    if filtered_tracks < 10: 
+
+    fits = single_track_fits(table_tracks, frame_interval, clip = clip, coords = coords, method = method, fit = fit)
+    all_velocities = np.sqrt(fits.V[fits.accepted]) * 1000 #save all velocities in nanometers
+
+    if fits.n_fits < 10: 
         print('number of tracks with > 5 frames is too low or non-existent')
-    
-    # plot final histogram
-    # all_velocities = [vel for vel in all_velocities if vel >= 1]
 
-    counts, bins, patches = plt.hist(all_velocities, bins = bins, 
-                                     color= 'seagreen', alpha = 0.8, edgecolor = 'w', 
-                                     label = 'n_fits = ' + str(filtered_tracks))
-    
-    ax[1].set_xlabel('velocitities (nm/s)', fontsize=10)
-    ax[1].set_ylabel('counts', fontsize = 10)
-    ax[1].legend(loc = 0, fontsize = 8, frameon = True)
-    ax[1].set_title("single track MSD velocities distribution", fontsize = 9)
-    plt.subplots_adjust(wspace = 0.2)
-    plt.tight_layout()
+    # plot every nth curve and the histogram of velocities
+    if plot:
+        from bkg_func import plotting
+        plotting.plot_single_track_msd(fits, frame_interval, plot_every = plot_every, bins = bins)
     
-    #to generate a nice formated table
-    all_msd_curves_table = [msds for i,(tau,msds) in enumerate(all_msd_curves)]
-    time = np.arange(2, np.max([(len(i)) for i in all_msd_curves_table]) * frame_interval, frame_interval) # delay vector
-    all_msd_curves_table.insert(0,time)
-    all_msd_curves_table = pd.DataFrame(all_msd_curves_table).T
-    
-    return all_velocities, all_msd_curves_table
+    all_curves = RaggedCurves(fits.values, fits.offsets, fits.track_ids, frame_interval)
+    all_curves = all_curves.to_wide() if wide else all_curves
+
+    return (all_velocities, all_curves, fits) if return_fits else (all_velocities, all_curves)
 
 def msd_track_dictionary(trajectory, msds_values, coords = ['POSITION_X', 'POSITION_Y'], frame = "FRAME"):
     """Computes MSD and integrate results into a msds_values dictionary. Note,
@@ -205,67 +396,242 @@ def msd_track_dictionary(trajectory, msds_values, coords = ['POSITION_X', 'POSIT
 
         for t, m in zip(taus, msd):
             msds_values[t].append(m)
-            
-            
-def msd_velocity_analysis(table_tracks, frame_interval, clip = 0.5, coords=['POSITION_X', 'POSITION_Y']):
+
+def tracks_to_arrays(table_tracks, coords = ['POSITION_X', 'POSITION_Y'], frame = 'FRAME'):
+    """sorts the track table by (TRACK_ID, FRAME) and returns the track ids, the spot
+    coordinates, the frames and the offsets of each track inside those arrays
+    (spots of the i-th track are in [offsets[i], offsets[i+1]) )"""
+
+    ids = table_tracks['TRACK_ID'].to_numpy()
+    frames = table_tracks[frame].to_numpy()
+    order = np.lexsort((frames, ids)) # stable, keeps the file order of each track
+
+    ids = ids[order]
+    positions = table_tracks[coords].to_numpy(dtype = float)[order]
+    frames = frames[order].astype(np.int64)
+
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else np.zeros(0, dtype = np.int64)
+    offsets = np.r_[starts, len(ids)].astype(np.int64)
+
+    return ids[starts], positions, frames, offsets
+
+def _track_of_spot(offsets):
+    """track number of every spot of a CSR layout"""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+def _longest_tracks_first(offsets):
+    """reorders the spots so that tracks are sorted by decreasing length; the tracks
+    still contributing at a given lag are then always a prefix of the spot arrays.
+    returns the spot index, the track number of each (reordered) spot and, for each
+    lag s, the number of spots belonging to tracks longer than s"""
+
+    lengths = np.diff(offsets)
+    order = np.argsort(-lengths, kind = 'stable')
+    sorted_lengths = lengths[order]
+
+    new_starts = np.r_[0, np.cumsum(sorted_lengths)[:-1]]
+    index = np.repeat(offsets[:-1][order] - new_starts, sorted_lengths) + np.arange(sorted_lengths.sum())
+    track_of_spot = np.repeat(order, sorted_lengths)
+
+    max_length = sorted_lengths[0] if len(sorted_lengths) else 0
+    n_longer = np.searchsorted(-sorted_lengths, -np.arange(max_length), side = 'left') # tracks with length > s
+    spots_in_prefix = np.r_[0, np.cumsum(sorted_lengths)][n_longer]
+
+    return index, track_of_spot, spots_in_prefix
+
+def ensemble_msd_statistics(positions, frames, offsets):
+    """accumulates the squared displacements of all tracks per lag (in frames) as
+    running count, sum and sum of squares. all tracks are processed together for
+    each shift, so memory scales with the longest track and not with the number
+    of displacement pairs. returns three arrays indexed by lag"""
+
+    span = frames[offsets[1:] - 1] - frames[offsets[:-1]] if len(offsets) > 1 else np.zeros(1, dtype = np.int64)
+    n_lags = int(span.max()) + 1
+
+    index, track_of_spot, spots_in_prefix = _longest_tracks_first(offsets)
+    positions, frames = positions[index], frames[index]
+
+    counts = np.zeros(n_lags)
+    sums   = np.zeros(n_lags)
+    sumsqs = np.zeros(n_lags)
+
+    for shift in range(1, len(spots_in_prefix)):
+        end = spots_in_prefix[shift]
+        same_track = track_of_spot[shift:end] == track_of_spot[:end - shift]
+
+        sq_disp = np.square(positions[shift:end] - positions[:end - shift]).sum(axis = 1)[same_track]
+        taus = (frames[shift:end] - frames[:end - shift])[same_track] # unit = frame number
+
+        counts += np.bincount(taus, minlength = n_lags)
+        sums   += np.bincount(taus, weights = sq_disp, minlength = n_lags)
+        sumsqs += np.bincount(taus, weights = sq_disp ** 2, minlength = n_lags)
+
+    return counts, sums, sumsqs
+
+def per_track_msd_statistics(positions, frames, offsets):
+    """same as ensemble_msd_statistics but kept separate for every track (e.g. to
+    resample tracks, see bootstrap). the per-lag arrays of all tracks are stored one
+    after the other: track i has lags 0..span_i (in frames) at row_offsets[i]:row_offsets[i+1].
+    returns row_offsets, counts, sums and sums of squares"""
+
+    span = frames[offsets[1:] - 1] - frames[offsets[:-1]] if len(offsets) > 1 else np.zeros(0, dtype = np.int64)
+    row_offsets = np.r_[0, np.cumsum(span + 1)].astype(np.int64)
+
+    index, track_of_spot, spots_in_prefix = _longest_tracks_first(offsets)
+    positions, frames = positions[index], frames[index]
+
+    counts = np.zeros(row_offsets[-1])
+    sums   = np.zeros(row_offsets[-1])
+    sumsqs = np.zeros(row_offsets[-1])
+
+    for shift in range(1, len(spots_in_prefix)):
+        end = spots_in_prefix[shift]
+        same_track = track_of_spot[shift:end] == track_of_spot[:end - shift]
+
+        sq_disp = np.square(positions[shift:end] - positions[:end - shift]).sum(axis = 1)[same_track]
+        taus = (frames[shift:end] - frames[:end - shift])[same_track] # unit = frame number
+        rows = row_offsets[track_of_spot[:end - shift][same_track]] + taus
+
+        np.add.at(counts, rows, 1)
+        np.add.at(sums, rows, sq_disp)
+        np.add.at(sumsqs, rows, sq_disp ** 2)
+
+    return row_offsets, counts, sums, sumsqs
+
+def msd_statistics(table_tracks, frame_interval, coords = ['POSITION_X', 'POSITION_Y'], method = 'vectorized'):
+    ''' per-lag count, sum and sum of squares of the squared displacements of all
+    tracks (mergeable across files, see lagstats). method 'dictionary' runs the
+    original per-point implementation (slow, kept for validation)'''
+
+    print('... weighted msd analysis ...')
+
+    if method == 'dictionary':
+        msds_values = defaultdict(list)
+        table_tracks.groupby("TRACK_ID").apply(msd_track_dictionary, msds_values = msds_values, coords = coords)
+        return LagStatistics.from_values(msds_values, frame_interval, kind = 'msd')
+
+    elif method == 'vectorized':
+        track_ids, positions, frames, offsets = tracks_to_arrays(table_tracks, coords = coords)
+        counts, sums, sumsqs = ensemble_msd_statistics(positions, frames, offsets)
+        return LagStatistics(counts, sums, sumsqs, frame_interval, kind = 'msd')
+
+    raise ValueError("method must be 'vectorized' or 'dictionary', got '{}'".format(method))
+
+def msd_velocity_analysis(table_tracks, frame_interval, clip = 0.5, coords=['POSITION_X', 'POSITION_Y'], method = 'vectorized', plot = True):
     ''' takes the weighted average of all the msd curves for each tau and fits
     a quadratic velocity to estimate velocity (V) and/or diffusion coefficient (D)
     output: V,D and table containing fitting data'''
-    
-    print('... weighted msd analysis ...')
-          
-    msds_values = defaultdict(list)
-    msds_values[0].append(0) # delay 0 has msd of 0
 
-    table_tracks.groupby("TRACK_ID").apply(msd_track_dictionary, msds_values = msds_values, coords = coords)
+    msd_stats = msd_statistics(table_tracks, frame_interval, coords = coords, method = method)
+    return msd_velocity_from_statistics(msd_stats, clip = clip, plot = plot)
 
-    # get mean msd and respective std
-    ntracks    = np.array(list(map(len, msds_values.values())))
-    msds_means = np.array(list(map(np.mean, msds_values.values())))
-    msds_std   = np.array(list(map(np.std, msds_values.values())))
-    
-    msds_std[0] = msds_std[1] # avoid infinity weight
-    #sems   = msds_stds/(np.sqrt(ntracks))
+def weighted_parabola_fit(t, y, sigma, absolute_sigma = False):
+    ''' weighted linear least squares fit of parabola(t, D, V) in closed form, vectorized
+    over leading axes (e.g. one row per bootstrap replicate). points with sigma == 0,
+    inf or nan get zero weight. the covariance is scaled by chi2 / dof as in curve_fit,
+    unless absolute_sigma = True. returns D, V and their covariance (... x 2 x 2)'''
 
-    t_axis = np.arange(len(msds_means)) * frame_interval #frames to seconds
-        
-    fig, ax = plt.subplots(1, figsize=(4,3), dpi = 120)
-    
-    ax.plot(t_axis, msds_means, '--ob', markersize = 4, label= "mean MSD", 
-            color = 'seagreen', markeredgecolor = 'black', markeredgewidth = 0.4)
-    
-    ax.fill_between(t_axis, msds_means - msds_std, msds_means + msds_std, color='seagreen',  alpha=0.1, label="std")
-    
-    # truncate data to avoid statistically irrelevant data
-    clip = int(len(msds_means) * clip)-1
-    
-    T = t_axis[:clip]
-    Y = msds_means[:clip]
-    W = msds_std[:clip]
-    
-    parameters, cov = curve_fit(parabola, T, Y, sigma = W, p0=(1,1))
-    (D,V) = parameters
-    V = np.sqrt(V)
-
-    # estimate standard deviation of the calculated parameters
-    param_stdev = np.sqrt(np.diag(cov))
-    V_std = param_stdev[1]
-    D_std = param_stdev[0]
+    t, y, sigma = np.broadcast_arrays(*(np.asarray(a, dtype = float) for a in (t, y, sigma)))
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        w = np.where((sigma > 0) & np.isfinite(sigma) & np.isfinite(y), 1 / sigma ** 2, 0.)
+        y = np.where(w > 0, y, 0.)
+
+        s2, s3, s4 = (w * t ** 2).sum(-1), (w * t ** 3).sum(-1), (w * t ** 4).sum(-1)
+        sty, st2y = (w * t * y).sum(-1), (w * t ** 2 * y).sum(-1)
+
+        det = s2 * s4 - s3 ** 2
+        D = (s4 * sty - s3 * st2y) / det
+        V = (s2 * st2y - s3 * sty) / det
+
+        cov = np.empty(D.shape + (2, 2))
+        cov[..., 0, 0], cov[..., 1, 1] = s4 / det, s2 / det
+        cov[..., 0, 1] = cov[..., 1, 0] = -s3 / det
+
+        if not absolute_sigma:
+            chi2 = (w * (y - D[..., None] * t - V[..., None] * t ** 2) ** 2).sum(-1)
+            dof = ((w > 0) & (t != 0)).sum(-1) - 2
+            cov *= np.where(dof > 0, chi2 / np.maximum(dof, 1), np.inf)[..., None, None]
+
+    return D, V, cov
+
+def fit_lags(msd_stats, clip = 0.5):
+    ''' lags (in frames) used by weighted_msd_fit: the first int(n_lags * clip) - 1 observed
+    delays, counting delay 0 (which is not fitted) '''
+    lags = msd_stats.lags[msd_stats.lags > 0]
+    n_fit = int((len(lags) + 1) * clip) - 2 # same points as the curve_fit version (which counted delay 0)
+    return lags[:max(n_fit, 0)]
+
+def weighted_msd_fit(msd_stats, clip = 0.5, weights = 'std', zero_variance = 'drop', absolute_sigma = False):
+    ''' fits parabola(t, D, V) to the mean msd per lag of the accumulated statistics,
+    weighted by 'std' (1/std^2, as msd_velocity_analysis always did), 'sem' (1/(std^2/n))
+    or 'none'. lags with zero variance (e.g. observed only once) are left out with
+    zero_variance = 'drop' or get the smallest non-zero sigma with 'floor'. delay 0
+    (msd = 0 by definition) is not a data point. only the first int(n_lags * clip) - 1
+    delays (counting delay 0) are fitted. returns D, V (the t^2 coefficient, i.e.
+    velocity squared) and their covariance'''
+
+    observed = msd_stats.lags > 0
+    lags = fit_lags(msd_stats, clip = clip)
+
+    means = msd_stats.mean()[observed][:len(lags)]
+    sigma = msd_stats.std()[observed][:len(lags)]
+
+    if weights == 'sem':
+        sigma = sigma / np.sqrt(msd_stats.counts[lags])
+    elif weights == 'none':
+        sigma = np.ones_like(sigma)
+    elif weights != 'std':
+        raise ValueError("weights must be 'std', 'sem' or 'none', got '{}'".format(weights))
+
+    if zero_variance == 'floor' and (sigma > 0).any():
+        sigma = np.where(sigma > 0, sigma, sigma[sigma > 0].min())
+    elif zero_variance not in ('drop', 'floor'):
+        raise ValueError("zero_variance must be 'drop' or 'floor', got '{}'".format(zero_variance))
+
+    # solve in frames (better conditioned), rescale to seconds
+    frame_interval = msd_stats.frame_interval
+    D, V, cov = weighted_parabola_fit(lags, means, sigma, absolute_sigma = absolute_sigma)
+    scale = np.array([frame_interval, frame_interval ** 2])
+
+    return D / scale[0], V / scale[1], cov / np.outer(scale, scale)
+
+MSD_FIT_COLUMNS = ['time','msd_mean','msd_std','x_fit','y_fit']
+
+def msd_velocity_from_statistics(msd_stats, clip = 0.5, weights = 'std', plot = True):
+    ''' weighted msd fit (see msd_velocity_analysis) from per-lag statistics, e.g.
+    the pooled statistics of many files: lagstats.pool([...]).
+    output: V,D and table containing fitting data (V, D are nan and the table is
+    empty if no lag > 0 was observed, e.g. no tracks or only tracks of one spot)'''
+
+    frame_interval = msd_stats.frame_interval
+
+    # delay 0 has msd of 0; lags never observed (frame gaps) are left out
+    observed   = msd_stats.lags > 0
+    if not observed.any():
+        return np.nan, np.nan, pd.DataFrame(columns = MSD_FIT_COLUMNS, dtype = float)
+
+    lags       = np.r_[0, msd_stats.lags[observed]]
+    msds_means = np.r_[0, msd_stats.mean()[observed]]
+    msds_std   = np.r_[0, msd_stats.std()[observed]]
+
+    msds_std[0] = msds_std[1] # only for the table/plot: delay 0 is not used in the fit
+
+    t_axis = lags * frame_interval #frames to seconds
     
+    # truncate data to avoid statistically irrelevant data (see weighted_msd_fit)
+    D, V_sq, cov = weighted_msd_fit(msd_stats, clip = clip, weights = weights)
+    V = np.sqrt(V_sq)
+
     t_values = np.linspace(0,t_axis[-1],100)
-    ax.plot(t_values, parabola(t_values, *parameters), color = 'crimson', 
-             label = " v_fit = {:4.2f} nm/s".format(V*1000)) # velocity converted in nm/s
-    
-    ax.set_xlabel('delays (s)', fontsize = 10)
-    ax.set_ylabel('MSD ($\mu$m$^2$)', fontsize = 10)
-    plt.title("weighted MSD analysis", fontsize = 9)
-    #plt.xlim([0,(()])
-    #plt.ylim([0,2.5])
-    plt.legend(frameon = False, fontsize = 8)
-    plt.tight_layout()
+    y_values = parabola(t_values, D, V_sq)
     
-    fit_data = pd.DataFrame([t_axis, msds_means, msds_std, t_values, parabola(t_values, *parameters)]).T
-    fit_data.columns = ['time','msd_mean','msd_std','x_fit','y_fit']
+    fit_data = pd.DataFrame([t_axis, msds_means, msds_std, t_values, y_values]).T
+    fit_data.columns = MSD_FIT_COLUMNS
+
+    if plot:
+        from bkg_func import plotting
+        plotting.plot_weighted_msd(fit_data, V)
     
     return V, D, fit_data
 
@@ -294,93 +660,305 @@ def track_autocorrelation(trajectory, dict_auto_corr_values, coords = ['POSITION
         for t, m in zip(taus, corr):
             dict_auto_corr_values[shift].append(m)
 
-def directional_persistence(track_table, frame_interval):
+def _step_correlation_sums_fft(steps):
+    """for one track (array n_steps x n_dims): per-lag sum and sum of squares of the
+    dot products steps[i] . steps[i+lag], from FFT autocorrelations (the squares
+    expand into autocorrelations of the pairwise coordinate products)"""
+
+    n, n_dims = steps.shape
+    n_fft = 1 << (2 * n - 1).bit_length()
+
+    def autocorr(signals):
+        spectrum = np.fft.rfft(signals, n = n_fft, axis = 0)
+        return np.fft.irfft((spectrum * spectrum.conj()).real, n = n_fft, axis = 0)[:n]
+
+    sums = autocorr(steps).sum(axis = 1)
+
+    products, factors = [], []
+    for a in range(n_dims):
+        for b in range(a, n_dims):
+            products.append(steps[:, a] * steps[:, b])
+            factors.append(1. if a == b else 2.)
+    sumsqs = autocorr(np.stack(products, axis = 1)) @ np.array(factors)
+
+    return sums, sumsqs
+
+def ensemble_correlation_statistics(positions, offsets, fft_min_length = 512):
+    """accumulates the directional correlation of all tracks per lag (in steps) as
+    count, sum and sum of squares. for each track the correlation of steps i and
+    i+lag is (d_i . d_i+lag) / mean(|d|^2). short tracks are processed together with
+    array operations (longest first, as in ensemble_msd_statistics); tracks with at
+    least fft_min_length steps use FFT autocorrelations instead (None disables FFT)"""
+
+    # steps of each track: the first spot of a track has no step
+    steps = np.diff(positions, axis = 0)[np.diff(_track_of_spot(offsets)) == 0]
+    n_steps = np.maximum(np.diff(offsets) - 1, 0)
+    step_offsets = np.r_[0, np.cumsum(n_steps)]
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        corr_0 = np.bincount(np.repeat(np.arange(len(n_steps)), n_steps), weights = np.square(steps).sum(axis = 1),
+                             minlength = len(n_steps)) / n_steps
+
+    n_lags = int(n_steps.max()) if len(n_steps) else 0
+    counts = np.zeros(n_lags)
+    sums   = np.zeros(n_lags)
+    sumsqs = np.zeros(n_lags)
+
+    has_steps = np.flatnonzero(n_steps > 0)
+    use_fft = n_steps[has_steps] >= (fft_min_length if fft_min_length is not None else np.inf)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        # long tracks: one FFT per track
+        for track in has_steps[use_fft]:
+            m = n_steps[track]
+            track_sums, track_sumsqs = _step_correlation_sums_fft(steps[step_offsets[track]:step_offsets[track + 1]])
+            counts[:m] += np.arange(m, 0, -1)
+            sums[:m]   += track_sums / corr_0[track]
+            sumsqs[:m] += track_sumsqs / corr_0[track] ** 2
+
+        # all other tracks together
+        direct = has_steps[~use_fft]
+        if len(direct):
+            lengths = n_steps[direct]
+            sub_offsets = np.r_[0, np.cumsum(lengths)]
+            step_index = np.repeat(step_offsets[direct] - sub_offsets[:-1], lengths) + np.arange(sub_offsets[-1])
+
+            index, track_of_step, steps_in_prefix = _longest_tracks_first(sub_offsets)
+            sub_steps = steps[step_index][index]
+            inv_corr_0 = (1 / corr_0[direct])[track_of_step]
+
+            for shift in range(len(steps_in_prefix)):
+                end = steps_in_prefix[shift]
+                same_track = track_of_step[shift:end] == track_of_step[:end - shift]
+
+                corr = (sub_steps[shift:end] * sub_steps[:end - shift]).sum(axis = 1)[same_track] * inv_corr_0[:end - shift][same_track]
+
+                counts[shift] += len(corr)
+                sums[shift]   += corr.sum()
+                sumsqs[shift] += np.square(corr).sum()
+
+    return counts, sums, sumsqs
+
+def directional_statistics(track_table, frame_interval, coords = ['POSITION_X', 'POSITION_Y'], method = 'vectorized', fft_min_length = 512):
     ''' the directional autocorrelation function is applied to each track individual 
-    and the correlation per step is saved as values of a dictionary with keys = taus.
-    In the end, hundreds of correlation values are average for each delay time (tau)'''
-    
+    and the correlation values are summarized per delay (count, sum and sum of squares,
+    mergeable across files, see lagstats). method 'dictionary' runs the original
+    implementation (slow, kept for validation)'''
+
     print('... directional persistence analysis ...')
+
+    if method == 'vectorized':
+        track_ids, positions, frames, offsets = tracks_to_arrays(track_table, coords = coords)
+        counts, sums, sumsqs = ensemble_correlation_statistics(positions, offsets, fft_min_length = fft_min_length)
+        return LagStatistics(counts, sums, sumsqs, frame_interval, kind = 'directionality')
+
+    elif method != 'dictionary':
+        raise ValueError("method must be 'vectorized' or 'dictionary', got '{}'".format(method))
     
     # compute step displacement for each trajectory
-    distances_per_track = track_table.groupby("TRACK_ID").apply(compute_dist_per_step)
+    distances_per_track = track_table.groupby("TRACK_ID").apply(compute_dist_per_step, coords = coords)
 
     # create an empty dictionary to add taus and correlation values
     auto_corr_values = defaultdict(list)
 
     # compute autocorrelation of each track (tau, corr pair) and add to the dictionary 
-    distances_per_track.groupby("TRACK_ID").apply(partial(track_autocorrelation, dict_auto_corr_values = auto_corr_values))
-
-    ntracks     = np.array(list(map(len, auto_corr_values.values())))      # number of tracks per tau
-    corr_means  = np.array(list(map(np.mean, auto_corr_values.values())))  # mean corr_value per tau 
-    corr_stds   = np.array(list(map(np.std, auto_corr_values.values())))   # stdev corr_value per tau
-    corr_t_axis = np.arange(len(corr_means)) * frame_interval              # number of taus (frames) * time interval (in seconds)
-    corr_sems   = corr_stds/(np.sqrt(ntracks))                             # stdev of the mean
-
-    plt.figure(figsize=(4,3), dpi = 120)
-    plt.plot(corr_t_axis, corr_means, '-g', label = " mean_correlation")
-    plt.fill_between(corr_t_axis, corr_means - corr_sems, corr_means + corr_sems, color='seagreen',  alpha=0.1, label = "std_error")
-
-    plt.hlines(0, xmin=0, xmax=corr_t_axis.max(), linestyles = '--', lw = 0.5)
-    plt.legend(loc = 0, frameon = False, fontsize = 8)
-    plt.xlabel("tau (s)" , fontsize=10)
-    plt.ylabel("directional correlation", fontsize=10)
-    plt.ylim([-1, 1.1])
-    plt.title('directional persistence', fontsize = 9)
-    plt.tight_layout()
+    distances_per_track.groupby("TRACK_ID").apply(partial(track_autocorrelation, dict_auto_corr_values = auto_corr_values, coords = coords))
+
+    return LagStatistics.from_values(auto_corr_values, frame_interval, kind = 'directionality')
+
+def directional_persistence(track_table, frame_interval, method = 'vectorized', plot = True):
+    ''' the directional autocorrelation function is applied to each track individual 
+    and the correlation per step is saved as values of a dictionary with keys = taus.
+    In the end, hundreds of correlation values are average for each delay time (tau)'''
     
+    return directional_persistence_from_statistics(directional_statistics(track_table, frame_interval, method = method), plot = plot)
+
+def directional_persistence_from_statistics(corr_stats, plot = True):
+    ''' mean directional correlation per delay from per-lag statistics, e.g. the
+    pooled statistics of many files: lagstats.pool([...])'''
+
+    corr_means  = corr_stats.mean()        # mean corr_value per tau 
+    corr_sems   = corr_stats.sem()         # stdev of the mean
+    corr_t_axis = corr_stats.time_axis()   # number of taus (frames) * time interval (in seconds)
+
     vcorr_data = pd.DataFrame([corr_t_axis,corr_means,corr_sems]).T
     vcorr_data.columns = ['time_axis','corr_mean','corr_sem']
+
+    if plot:
+        from bkg_func import plotting
+        plotting.plot_directional_persistence(vcorr_data)
     
     return vcorr_data
 
 # main function	// concatenate all fcuntions
 
+class AnalysisResults:
+    """
+    Everything computed by compute_tracks for one file: the track table, the
+    outputs of each analysis (None if it was not run) and the settings needed
+    to draw the figures afterwards (see plotting.render_results)
+    """
+    def __init__(self, filename, frame_interval, time_units, space_units, track_table,
+                 clip = 0.5, plot_every = 10, bins = 10, plot_tracks = True):
+        self.filename = filename
+        self.frame_interval = frame_interval
+        self.time_units = time_units
+        self.space_units = space_units
+        self.track_table = track_table
+        self.clip = clip
+        self.plot_every = plot_every
+        self.bins = bins
+        self.plot_tracks = plot_tracks
+
+        self.vel_dist = None                          # track displacement
+        self.V, self.D, self.msd_fit = None, None, None # weighted msd
+        self.msd_stats = None
+        self.bootstrap = None                         # bootstrap of the weighted msd fit (see bootstrap)
+        self.single_velocities = None                 # single track msd
+        self.single_fits, self.single_curves = None, None
+        self.vcorr_data, self.corr_stats = None, None # directionality
+        self.timer = None                             # cost of each stage (see instrument)
+        self.outputs = []                             # files written by analyze_tracks
+
+    def __repr__(self):
+        done = [name for name in ('vel_dist', 'msd_fit', 'single_fits', 'vcorr_data') if getattr(self, name) is not None]
+        return 'AnalysisResults({!r}, analyses={})'.format(self.filename, done)
+
+    def tables(self, wide_curves = False):
+        """the output tables as {sheet name: table}, in the order of the excel book (see writers).
+        the single track msd curves are one row per point (track_id, delay, msd) or, with
+        wide_curves = True, one nan-padded column per track as in previous versions"""
+        tables = {}
+        if self.vel_dist is not None:
+            tables['vels_disp'] = pd.Series(self.vel_dist, name = 'velocity')
+        if self.msd_fit is not None:
+            tables['msd_weighted'] = self.msd_fit
+        if self.bootstrap is not None:
+            from bkg_func.bootstrap import bootstrap_table
+            tables['msd_bootstrap'] = bootstrap_table(self.bootstrap)
+        if self.single_fits is not None:
+            tables['msd_single_vel_hist'] = pd.Series(self.single_velocities, name = 'velocity')
+            tables['all_single_msd_curves'] = self.single_curves.to_wide() if wide_curves else self.single_curves.to_long()
+        if self.vcorr_data is not None:
+            tables['directionality'] = self.vcorr_data
+        return tables
+
+def compute_tracks(filename,
+                   track_displacement = True,
+                   msd_weighted = True,
+                   msd_single_track = True,
+                   directionality = True,
+                   plot_tracks = True,
+                   clip = 0.5, plot_every = 10, max_frame_gap = 0,
+                   cache = False, cache_dir = None, refresh_cache = False, timer = None,
+                   n_bootstrap = 0, bootstrap_workers = 1):
+    '''runs the analyses of analyze_tracks without plotting (matplotlib is not imported)
+    and without writing any file besides the xml cache (with cache = True). returns an AnalysisResults object.
+    with n_bootstrap > 0 the weighted msd fit also gets bootstrap confidence intervals
+    (tracks resampled n_bootstrap times in bootstrap_workers processes, see bootstrap).
+    the cost of each stage is recorded in results.timer (an instrument.StageTimer, which
+    can be passed in to get a callback after every stage)'''
+
+    timer = instrument.StageTimer() if timer is None else timer
+
+    with timer.stage('parse', file_size = os.path.getsize(filename)) as stage:
+        track_table, frame_interval, time_units, space_units = read_xml_tracks(filename, cache = cache, cache_dir = cache_dir,
+                                                                               refresh_cache = refresh_cache)
+        track_lengths = np.bincount(track_table['TRACK_ID'].to_numpy()) if len(track_table) else np.zeros(1, dtype = int)
+        sizes = {'n_spots': len(track_table), 'n_tracks': int((track_lengths > 0).sum()),
+                 'max_lag': max(int(track_lengths.max()) - 1, 0)}
+        stage.update(sizes)
+
+    results = AnalysisResults(filename, frame_interval, time_units, space_units, track_table,
+                              clip = clip, plot_every = plot_every, plot_tracks = plot_tracks)
+    results.timer = timer
+
+    if track_displacement == True:
+        with timer.stage('displacement', **sizes):
+            results.vel_dist = velocities_distribution(track_table, frame_interval = frame_interval,
+                                                       max_frame_gap = max_frame_gap, plot = False)
+
+    if msd_weighted == True:
+        with timer.stage('weighted_msd', **sizes):
+            results.msd_stats = msd_statistics(track_table, frame_interval = frame_interval)
+            results.V, results.D, results.msd_fit = msd_velocity_from_statistics(results.msd_stats, clip = clip, plot = False)
+
+        if n_bootstrap > 0:
+            with timer.stage('bootstrap', n_replicates = n_bootstrap, **sizes):
+                print('... msd bootstrap analysis ...')
+                from bkg_func import bootstrap
+                results.bootstrap = bootstrap.bootstrap_msd_fit(track_table, frame_interval, n_replicates = n_bootstrap,
+                                                                clip = clip, n_workers = bootstrap_workers)
+
+    if msd_single_track == True:
+        with timer.stage('single_track_msd', **sizes):
+            results.single_velocities, results.single_curves, results.single_fits = \
+                single_track_analysis(track_table, frame_interval, clip = clip, plot = False, return_fits = True)
+
+    if directionality == True:
+        with timer.stage('directionality', **sizes):
+            results.corr_stats = directional_statistics(track_table, frame_interval = frame_interval)
+            results.vcorr_data = directional_persistence_from_statistics(results.corr_stats, plot = False)
+
+    return results
+
 def analyze_tracks(filename, 
                    track_displacement = True,
                    msd_weighted = True,
                    msd_single_track = True,
                    directionality = True,
                    plot_tracks = True,
-                   clip = 0.5, plot_every = 10):
+                   clip = 0.5, plot_every = 10, max_frame_gap = 0,
+                   cache = False, cache_dir = None, refresh_cache = False,
+                   save_statistics = False, headless = False, close_figures = False, output_format = 'xlsx',
+                   wide_curves = False, stage_callback = None, save_timings = False,
+                   n_bootstrap = 0, bootstrap_workers = 1):
     
     '''main function. computes all desire analyses written in the bkg_func folder.
 	runs specific analysis if `True` and saves all the respective figs and tables
-	as a single pdf file or excel book (respectively) using the same file directory'''
-    
-    #plt.close("all")
-    
-    track_table, frame_interval, time_units, space_units = read_xml_tracks(filename)
+	as a single pdf file or excel book (respectively) using the same file directory.
+	with cache = True the parsed xml is cached (see read_xml_tracks). with
+	save_statistics = True the per-lag msd and directionality statistics are saved
+	as npz files that can be pooled over many files (see lagstats).
+	with headless = True only the excel book is written and matplotlib is never
+	imported; the figures can be drawn later with plotting.render_results(results).
+	output_format 'parquet', 'feather', 'csv' (gzip) or 'npz' writes the same tables
+	in a faster format than 'xlsx' (see writers). the single track msd curves are written
+	as one row per point unless wide_curves = True. the wall / cpu time, memory and
+	input sizes of every stage are passed to stage_callback(entry) (if given) and, with
+	save_timings = True, saved as json next to the outputs (see instrument).
+	n_bootstrap > 0 adds percentile confidence intervals of D and V from resampling
+	the tracks (sheet msd_bootstrap, see bootstrap), computed in bootstrap_workers processes.
+	returns the AnalysisResults'''
+    
+    timer = instrument.StageTimer(stage_callback)
+    results = compute_tracks(filename, track_displacement = track_displacement, msd_weighted = msd_weighted,
+                             msd_single_track = msd_single_track, directionality = directionality,
+                             plot_tracks = plot_tracks, clip = clip, plot_every = plot_every,
+                             max_frame_gap = max_frame_gap, cache = cache, cache_dir = cache_dir,
+                             refresh_cache = refresh_cache, timer = timer,
+                             n_bootstrap = n_bootstrap, bootstrap_workers = bootstrap_workers)
 
     # savename = filename.split(sep='/')[-1][:-4]
-    with PdfPages(filename[:-4] + '_analyze_tracks_all_figs.pdf') as pdf:
-        with pd.ExcelWriter(filename[:-4] + '_analyze_tracks_output.xlsx') as excel_sheet:        
-            
-            if track_displacement == True:
-                vel_dist = velocities_distribution(track_table, frame_interval = frame_interval);
-                
-                pd.Series(vel_dist).to_excel(excel_sheet, sheet_name = 'vels_disp', index=False, header = False)
-                pdf.savefig(bbox_inches="tight")
-
-            if msd_weighted == True:
-
-                V, D, table_msd_fit = msd_velocity_analysis(track_table, frame_interval = frame_interval, clip = clip)
-                
-                table_msd_fit.to_excel(excel_sheet, sheet_name = 'msd_weighted', index=False, header = True)
-                pdf.savefig(bbox_inches="tight")
-
-            if msd_single_track == True:
-                all_single_msd_vel, all_curves = single_track_analysis(track_table, frame_interval = frame_interval, clip = clip, plot_every = plot_every)
-                
-                pd.Series(all_single_msd_vel).to_excel(excel_sheet, sheet_name = 'msd_single_vel_hist', index=False, header = False)
-                all_curves.to_excel(excel_sheet, sheet_name = 'all_single_msd_curves', index=False, header = True)
-                pdf.savefig(bbox_inches="tight")
-            
-            if directionality == True:
-                vcorr_data = directional_persistence(track_table, frame_interval = frame_interval)
-                
-                vcorr_data.to_excel(excel_sheet, sheet_name = 'directionality', index=False)
-                pdf.savefig(bbox_inches="tight")
-                
-            if plot_tracks == True:
-                plot_trajectories(track_table)
-                pdf.savefig(bbox_inches="tight")
\ No newline at end of file
+    with timer.stage('writing', output_format = output_format):
+        results.outputs.append(writers.write_tables(results.tables(wide_curves = wide_curves), filename,
+                                                    output_format = output_format))
+
+        if save_statistics == True:
+            if results.msd_stats is not None:
+                results.msd_stats.save(filename[:-4] + '_msd_stats.npz')
+                results.outputs.append(filename[:-4] + '_msd_stats.npz')
+            if results.corr_stats is not None:
+                results.corr_stats.save(filename[:-4] + '_directionality_stats.npz')
+                results.outputs.append(filename[:-4] + '_directionality_stats.npz')
+
+    if headless == False:
+        with timer.stage('plotting'):
+            from bkg_func import plotting
+            plotting.render_results(results, pdf_filename = filename[:-4] + '_analyze_tracks_all_figs.pdf', close = close_figures)
+        results.outputs.append(filename[:-4] + '_analyze_tracks_all_figs.pdf')
+
+    if save_timings == True:
+        results.outputs.append(timer.save(filename[:-4] + '_analyze_tracks_timings.json', file = filename))
+
+    return results
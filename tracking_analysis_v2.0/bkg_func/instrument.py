@@ -0,0 +1,106 @@
+# bkg_functions to record the cost of each analysis stage
+# wall time, cpu time, resident memory (peak during the stage where the os allows it,
+# see peak_rss) and the input sizes of every stage of analyze_tracks, passed to an
+# optional callback and saved as json next to the outputs
+
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource # not available on windows
+except ImportError:
+    resource = None
+
+def _proc_status(key):
+    """value (bytes) of a memory line of /proc/self/status (linux), or None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def current_rss():
+    """resident memory of this process in bytes (None if unknown)"""
+    rss = _proc_status('VmRSS')
+    if rss is None:
+        try:
+            import psutil
+            rss = psutil.Process().memory_info().rss
+        except ImportError:
+            pass
+    return rss
+
+def reset_peak_rss():
+    """restarts the peak memory counter (linux only); returns True if it worked"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss():
+    """peak resident memory in bytes: since the last reset_peak_rss on linux, otherwise of the
+    whole process so far (None if unknown)"""
+    peak = _proc_status('VmHWM')
+    if peak is None and resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if sys.platform == 'darwin' else 1024 # bytes on macos, kB elsewhere
+    return peak
+
+class StageTimer:
+    """
+    Records one entry per stage (name, wall and cpu time in seconds, resident memory
+    before / after and peak, plus any input sizes given) and calls `callback(entry)`
+    after each stage, e.g. to log or to stop a batch that uses too much memory.
+    """
+    def __init__(self, callback = None):
+        self.callback = callback
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, **sizes):
+        """times the code inside the `with` block; sizes can be added to the yielded dict"""
+        entry = {'stage': name}
+        entry.update(sizes)
+        peak_scope = 'stage' if reset_peak_rss() else 'process'
+        rss_before = current_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+
+        try:
+            yield entry
+        finally:
+            entry['wall_time'] = time.perf_counter() - wall
+            entry['cpu_time'] = time.process_time() - cpu
+            entry['rss_before'] = rss_before
+            entry['rss_after'] = current_rss()
+            entry['peak_rss'] = peak_rss()
+            entry['peak_rss_scope'] = peak_scope
+            self.stages.append(entry)
+            if self.callback is not None:
+                self.callback(entry)
+
+    def total(self):
+        return {'wall_time': sum(entry['wall_time'] for entry in self.stages),
+                'cpu_time': sum(entry['cpu_time'] for entry in self.stages)}
+
+    def summary(self):
+        """one line per stage"""
+        lines = []
+        for entry in self.stages:
+            peak = entry['peak_rss']
+            lines.append('{:<18} {:>8.3f} s wall {:>8.3f} s cpu {:>9} MB peak'.format(
+                entry['stage'], entry['wall_time'], entry['cpu_time'], '-' if peak is None else '{:.1f}'.format(peak / 1024 ** 2)))
+        return '\n'.join(lines)
+
+    def save(self, fn, **info):
+        """saves the stages (and any extra info, e.g. the file name) as json"""
+        with open(fn, 'w') as f:
+            json.dump(dict(info, stages = self.stages, total = self.total(), pid = os.getpid()), f, indent = 1)
+        return fn
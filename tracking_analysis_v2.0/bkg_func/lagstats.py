@@ -0,0 +1,101 @@
+# bkg_functions to pool per-lag statistics (msd, directional correlation) of many files
+# each file is summarized by count, sum and sum of squares per lag; summaries of
+# different files (or parts of a file) add up exactly, in any order
+
+import json
+import numpy as np
+
+class LagStatistics:
+    """
+    Running count, sum and sum of squares of a quantity per lag (in frames),
+    e.g. the squared displacements of all tracks ('msd') or the directional
+    correlation values ('directionality'). Summaries are merged with `+` (or
+    sum()) and saved / loaded as small npz files.
+    """
+    def __init__(self, counts, sums, sumsqs, frame_interval, kind = 'msd'):
+        self.counts = np.asarray(counts, dtype = float)
+        self.sums = np.asarray(sums, dtype = float)
+        self.sumsqs = np.asarray(sumsqs, dtype = float)
+        self.frame_interval = float(frame_interval)
+        self.kind = kind
+
+    @classmethod
+    def from_values(cls, values_per_lag, frame_interval, kind = 'msd'):
+        """builds the statistics from a {lag: list of values} dictionary"""
+        n_lags = int(max(values_per_lag)) + 1 if len(values_per_lag) else 0
+        counts, sums, sumsqs = np.zeros(n_lags), np.zeros(n_lags), np.zeros(n_lags)
+        for lag, values in values_per_lag.items():
+            values = np.asarray(values, dtype = float)
+            counts[int(lag)] += len(values)
+            sums[int(lag)] += values.sum()
+            sumsqs[int(lag)] += np.square(values).sum()
+        return cls(counts, sums, sumsqs, frame_interval, kind)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __repr__(self):
+        return 'LagStatistics(kind={!r}, n_lags={}, n_values={:g}, frame_interval={})'.format(
+            self.kind, len(self), self.counts.sum(), self.frame_interval)
+
+    def merge(self, other):
+        """returns the pooled statistics of self and other (associative and commutative)"""
+        if self.kind != other.kind:
+            raise ValueError("cannot merge '{}' with '{}' statistics".format(self.kind, other.kind))
+        if not np.isclose(self.frame_interval, other.frame_interval):
+            raise ValueError('cannot merge statistics with different frame intervals ({} and {})'.format(
+                self.frame_interval, other.frame_interval))
+
+        n_lags = max(len(self), len(other))
+        pooled = [np.zeros(n_lags) for _ in range(3)]
+        for stats in (self, other):
+            pooled[0][:len(stats)] += stats.counts
+            pooled[1][:len(stats)] += stats.sums
+            pooled[2][:len(stats)] += stats.sumsqs
+
+        return LagStatistics(*pooled, frame_interval = self.frame_interval, kind = self.kind)
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    def __radd__(self, other):
+        if other == 0: # allows sum(list_of_statistics)
+            return self
+        return self.merge(other)
+
+    @property
+    def lags(self):
+        """lags (in frames) with at least one value"""
+        return np.flatnonzero(self.counts)
+
+    def mean(self):
+        lags = self.lags
+        return self.sums[lags] / self.counts[lags]
+
+    def std(self):
+        """population standard deviation per lag (as np.std)"""
+        lags = self.lags
+        mean = self.sums[lags] / self.counts[lags]
+        return np.sqrt(np.maximum(self.sumsqs[lags] / self.counts[lags] - mean ** 2, 0))
+
+    def sem(self):
+        return self.std() / np.sqrt(self.counts[self.lags])
+
+    def time_axis(self):
+        return self.lags * self.frame_interval
+
+    def save(self, fn):
+        """saves the statistics as npz file"""
+        meta = json.dumps({'frame_interval': self.frame_interval, 'kind': self.kind})
+        with open(fn, 'wb') as f:
+            np.savez(f, counts = self.counts, sums = self.sums, sumsqs = self.sumsqs, meta = np.array(meta))
+
+    @classmethod
+    def load(cls, fn):
+        with np.load(fn, allow_pickle = False) as data:
+            meta = json.loads(str(data['meta']))
+            return cls(data['counts'], data['sums'], data['sumsqs'], meta['frame_interval'], meta['kind'])
+
+def pool(statistics):
+    """merges a list of LagStatistics objects and/or npz files written by LagStatistics.save"""
+    return sum(stats if isinstance(stats, LagStatistics) else LagStatistics.load(stats) for stats in statistics)
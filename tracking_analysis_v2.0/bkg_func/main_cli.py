@@ -1,41 +1,239 @@
 import os
+import sys
+import glob
 import argparse
-from matplotlib import pyplot as plt
-from . import process
+
+# only the standard library is imported here: numpy, pandas, scipy and matplotlib
+# are imported by the subcommands that need them, so --help, argument errors and
+# the cache commands start fast (see README for the measured startup time)
 
 description = \
 """
-Mean-square-displacement and velocity auto-correlation analyzes of growth and shrinkage tracks 
+Mean-square-displacement and velocity auto-correlation analyzes of growth and shrinkage tracks
 """
 
-def get_args():
-    parser = argparse.ArgumentParser(description=description)
-    
-    parser.add_argument('track_file', type=str, nargs="+", help="Trackmate xml-track file or folder containing several")
-    parser.add_argument('--clip', type=float, default=0.5, help="Use only clip fraction for fitting (default 0.5)")
-    parser.add_argument('--plot_every', type=int, default=20, help="Plot every p th single track in output plot (default: 20)")
+ANALYSES = ['displacement', 'msd', 'single', 'directionality', 'tracks']
+OUTPUT_FORMATS = ['xlsx', 'parquet', 'feather', 'csv', 'npz'] # same as writers.WRITERS (not imported for a fast startup)
+EXCLUDED_SUFFIXES = ('_TM.xml',) # same as manifest.EXCLUDED_SUFFIXES
+
+def positive_float(value):
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError("must be a positive number, got {}".format(value))
+    return number
+
+def clip_fraction(value):
+    clip = float(value)
+    if not 0 < clip <= 1:
+        raise argparse.ArgumentTypeError("clip must be between 0 and 1, got {}".format(value))
+    return clip
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be a positive integer, got {}".format(value))
+    return number
+
+def non_negative_int(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError("must be 0 or a positive integer, got {}".format(value))
+    return number
+
+def existing_path(value):
+    if not os.path.exists(value):
+        raise argparse.ArgumentTypeError("file / folder '{}' does not exist".format(value))
+    return value
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog = 'analyze_tracks_cli', description = description)
+    subparsers = parser.add_subparsers(dest = 'command', metavar = 'command')
+    subparsers.required = True
+
+    analyze = subparsers.add_parser('analyze', help = "analyze trackmate xml-track files (excel book + pdf next to each file)",
+                                    description = "runs core.analyze_tracks on each file; folders are processed like batch.run_batch_processing")
+    analyze.add_argument('track_file', type=existing_path, nargs="+", help="Trackmate xml-track file or folder containing several")
+    analyze.add_argument('--analyses', nargs="+", choices=ANALYSES, default=ANALYSES, metavar='NAME',
+                         help="analyses to run, any of {} (default: all)".format(', '.join(ANALYSES)))
+    analyze.add_argument('--clip', type=clip_fraction, default=0.5, help="Use only clip fraction for fitting (default 0.5)")
+    analyze.add_argument('--plot_every', type=positive_int, default=20, help="Plot every p th single track in output plot (default: 20)")
+    analyze.add_argument('--max_frame_gap', type=non_negative_int, default=0, help="frame gap allowed in tracking, for the displacement velocities (default: 0)")
+    analyze.add_argument('--headless', action='store_true', help="only write the excel books (no figures, matplotlib is not imported)")
+    analyze.add_argument('--show', action='store_true', help="show the figures after processing (single files only)")
+    analyze.add_argument('--output_format', choices=OUTPUT_FORMATS, default='xlsx',
+                         help="format of the output tables: xlsx (default), parquet / feather (need pyarrow), csv (gzip) or npz")
+    analyze.add_argument('--wide_curves', action='store_true',
+                         help="single track msd curves as one nan-padded column per track (default: one row per point)")
+    analyze.add_argument('--save_timings', action='store_true',
+                         help="save the time, cpu and memory of each stage as json next to the outputs")
+    analyze.add_argument('--bootstrap', type=non_negative_int, default=0, metavar='N',
+                         help="bootstrap confidence intervals of the weighted msd fit from N resamplings of the tracks (default: 0, off)")
+    analyze.add_argument('--bootstrap_workers', type=positive_int, default=1,
+                         help="processes for the bootstrap replicates of a single file (default: 1)")
+    analyze.add_argument('--workers', type=positive_int, default=1, help="number of files processed in parallel (default: 1)")
+    analyze.add_argument('--streaming', action='store_true',
+                         help="read the xml in blocks for files larger than memory (no figures, per-track outputs as .npy, see bkg_func.streaming)")
+    analyze.add_argument('--block_spots', type=positive_int, default=200000,
+                         help="spots per block with --streaming (default: 200000)")
+    analyze.add_argument('--incremental', action='store_true',
+                         help="skip files of the given folders that were already analyzed with the same parameters and did not change")
+    analyze.add_argument('--watch', type=positive_float, nargs='?', const=30., default=None, metavar='SECONDS',
+                         help="keep processing new files of the given folders every SECONDS (default: 30) until ctrl-c (implies --incremental)")
+    analyze.add_argument('--save_statistics', action='store_true', help="save the per-lag msd / directionality statistics as npz")
+    analyze.add_argument('--cache', action='store_true', help="read and write a parsed-xml cache next to each xml (default: off)")
+    analyze.add_argument('--cache_dir', type=str, default=None, help="read and write the parsed-xml cache in this folder (implies --cache)")
+    analyze.add_argument('--refresh_cache', action='store_true', help="re-read the xml files and overwrite their cache")
+    analyze.set_defaults(run = run_analyze)
+
+    cache = subparsers.add_parser('cache', help = "inspect or delete the parsed-xml cache",
+                                  description = "reports (status) or removes (clear) the cache of the given xml files and/or of a cache folder")
+    cache.add_argument('action', choices=['status', 'clear'])
+    cache.add_argument('track_file', type=existing_path, nargs="*", help="Trackmate xml-track file or folder containing several")
+    cache.add_argument('--cache_dir', type=str, default=None, help="cache folder (default: next to each xml)")
+    cache.set_defaults(run = run_cache)
+
+    generate = subparsers.add_parser('synthetic', help = "write a synthetic trackmate xml-track file with known V and D",
+                                     description = "directed random walks (see bkg_func.synthetic); the ground truth is saved next to the file as json")
+    generate.add_argument('output', type=str, help="xml file to write")
+    generate.add_argument('--n_tracks', type=positive_int, default=1000, help="number of tracks (default: 1000)")
+    generate.add_argument('--length', type=positive_int, default=20, help="spots per track, or mean with --geometric (default: 20)")
+    generate.add_argument('--geometric', action='store_true', help="geometric distribution of track lengths (minimum 2)")
+    generate.add_argument('--V', type=float, default=0.05, help="directed speed in space units / time unit (default: 0.05)")
+    generate.add_argument('--D', type=float, default=0.01, help="diffusion coefficient in space units^2 / time unit (default: 0.01)")
+    generate.add_argument('--frame_interval', type=float, default=2., help="time between frames (default: 2)")
+    generate.add_argument('--gap_probability', type=float, default=0., help="probability of a missed detection before a spot (default: 0)")
+    generate.add_argument('--max_frame_gap', type=positive_int, default=1, help="largest number of missed frames in a row (default: 1)")
+    generate.add_argument('--n_frames', type=positive_int, default=None, help="movie length: tracks start at a random frame (default: all start at 0)")
+    generate.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    generate.set_defaults(run = run_synthetic)
+
+    return parser
+
+def get_args(argv = None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'cache' and not args.track_file and args.cache_dir is None:
+        parser.error("cache: give xml files / folders and/or --cache_dir")
+    if args.command == 'analyze' and (args.incremental or args.watch) and not all(map(os.path.isdir, args.track_file)):
+        parser.error("analyze: --incremental and --watch work on folders")
+    if args.command == 'analyze' and args.streaming and (args.incremental or args.watch):
+        parser.error("analyze: --streaming cannot be combined with --incremental / --watch")
+    if args.command == 'analyze' and args.watch and len(args.track_file) > 1:
+        parser.error("analyze: --watch takes a single folder")
+    return args
+
+def xml_files(paths):
+    """xml files given directly or inside the given folders (sorted and without the _TM.xml
+    trackmate models, as in batch processing)"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(fn for fn in sorted(glob.glob(os.path.join(path, '*.xml'))) if not fn.endswith(EXCLUDED_SUFFIXES))
+        else:
+            files.append(path)
+    return files
+
+def run_analyze(args):
+    files = xml_files(args.track_file)
+    if len(files) == 0 and not args.watch: # a watched folder can start empty
+        print('File directory is empty!')
+        return 1
+
+    analysis_kwargs = dict(track_displacement = 'displacement' in args.analyses,
+                           msd_weighted = 'msd' in args.analyses,
+                           msd_single_track = 'single' in args.analyses,
+                           directionality = 'directionality' in args.analyses,
+                           plot_tracks = 'tracks' in args.analyses,
+                           clip = args.clip, plot_every = args.plot_every, max_frame_gap = args.max_frame_gap,
+                           cache = args.cache or args.cache_dir is not None, cache_dir = args.cache_dir, refresh_cache = args.refresh_cache,
+                           save_statistics = args.save_statistics, headless = args.headless,
+                           output_format = args.output_format, wide_curves = args.wide_curves,
+                           save_timings = args.save_timings, n_bootstrap = args.bootstrap,
+                           bootstrap_workers = args.bootstrap_workers)
+
+    if args.streaming:
+        from bkg_func import streaming
+        failed = 0
+        for fn in files:
+            try:
+                streaming.analyze_tracks_streaming(fn, track_displacement = 'displacement' in args.analyses,
+                                                   msd_weighted = 'msd' in args.analyses,
+                                                   msd_single_track = 'single' in args.analyses,
+                                                   directionality = 'directionality' in args.analyses,
+                                                   clip = args.clip, plot_every = args.plot_every,
+                                                   max_frame_gap = args.max_frame_gap, block_spots = args.block_spots,
+                                                   output_format = args.output_format,
+                                                   save_statistics = args.save_statistics, save_timings = args.save_timings)
+            except Exception as error:
+                print('failed: {} ({})'.format(os.path.basename(fn), error))
+                failed += 1
+        return 1 if failed else 0
+
+    if args.incremental or args.watch:
+        os.environ.setdefault('MPLBACKEND', 'Agg')
+        from bkg_func import batch
+        if args.watch:
+            records = batch.watch_folder(args.track_file[0], interval = args.watch, n_workers = args.workers, **analysis_kwargs)
+        else:
+            records = []
+            for files_dir in args.track_file:
+                records.extend(batch.process_incremental(xml_files([files_dir]), files_dir, n_workers = args.workers,
+                                                         **analysis_kwargs))
+        return 0 if all(record['status'] == 'ok' for record in records) else 1
+
+    if len(files) == 1:
+        from bkg_func import core
+        if not (args.show or args.headless):
+            os.environ.setdefault('MPLBACKEND', 'Agg') # figures only go to the pdf
+        core.analyze_tracks(files[0], close_figures = not args.show, **analysis_kwargs)
 
-    return parser.parse_args()
+        if args.show and not args.headless:
+            from matplotlib import pyplot as plt
+            plt.show()
+        return 0
 
-def run(track_file, clip, plot_every):
-    if os.path.isdir(track_file):
-        process.analyze_tracks_batch(track_file, clip=clip, plot_every=plot_every)
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    from bkg_func import batch
+    records = batch.process_files(files, n_workers = args.workers, **analysis_kwargs)
+    return 0 if all(record['status'] == 'ok' for record in records) else 1
 
-    elif os.path.isfile(track_file):
-        process.analyze_tracks(track_file, clip=clip, plot_every=plot_every)
+def run_cache(args):
+    from bkg_func import cache
 
-def main():
-    args = get_args()
+    files = xml_files(args.track_file)
+    for fn in files:
+        path = cache.cache_path(fn, args.cache_dir)
+        if args.action == 'clear':
+            cache.invalidate_cache(fn, args.cache_dir)
+            print('removed ' + path)
+        else:
+            state = 'valid' if cache.load_cache(fn, args.cache_dir, columns = []) is not None else \
+                    ('stale' if os.path.exists(path) else 'missing')
+            print('{}: {} ({})'.format(os.path.basename(fn), state, path))
 
-    for tm_xml_fn in args.track_file:
-        # check if file exits
-        assert os.path.exists(tm_xml_fn), "File / folder '{}' does not exists. Skipping...".format(tm_xml_fn)
+    if args.cache_dir is not None and os.path.isdir(args.cache_dir):
+        if args.action == 'clear' and not files:
+            cache.clear_cache(args.cache_dir)
+            print('cleared ' + args.cache_dir)
+        elif args.action == 'status':
+            sizes = [os.path.getsize(os.path.join(args.cache_dir, name)) for name in os.listdir(args.cache_dir)
+                     if name.endswith(cache.CACHE_SUFFIX)]
+            print('{}: {} cache files, {:.1f} MB'.format(args.cache_dir, len(sizes), sum(sizes) / 1024 ** 2))
+    return 0
 
-        # process it
-        run(tm_xml_fn, args.clip, args.plot_every)
+def run_synthetic(args):
+    from bkg_func import synthetic
 
-    plt.show()
+    length = ('geometric', args.length, 2) if args.geometric else args.length
+    truth = synthetic.write_trackmate_xml(args.output, n_tracks = args.n_tracks, length = length, V = args.V, D = args.D,
+                                          frame_interval = args.frame_interval, gap_probability = args.gap_probability,
+                                          max_frame_gap = args.max_frame_gap, n_frames = args.n_frames, seed = args.seed)
+    print('{}: {} tracks, {} spots, {:.1f} MB'.format(args.output, truth['n_tracks'], truth['n_spots'], truth['file_size'] / 1024 ** 2))
+    return 0
 
+def main(argv = None):
+    args = get_args(argv)
+    return args.run(args)
 
-# if __name__ == "__main__":
-#     main()
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# bkg_functions to remember which xml files of a folder were already analyzed
+# the manifest is a json file inside the folder with one entry per xml file: its size,
+# mtime and content hash, the analysis parameters and the output files. an incremental
+# batch run (see batch.run_batch_processing) only processes files that are new, changed,
+# analyzed with other parameters, failed before or lost one of their outputs
+
+import os
+import glob
+import json
+import time
+from bkg_func.cache import hash_file
+
+MANIFEST_NAME = '_analyze_tracks_manifest.json'
+MANIFEST_VERSION = 1
+
+# xml files in the data folders that are not track files (run_trackmate saves the full
+# trackmate model as _TM.xml next to the exported _Tracks.xml)
+EXCLUDED_SUFFIXES = ('_TM.xml',)
+
+# arguments of analyze_tracks that do not change the outputs
+IGNORED_PARAMETERS = ('cache', 'cache_dir', 'refresh_cache', 'stage_callback', 'close_figures', 'bootstrap_workers')
+
+def track_files(files_dir):
+    """xml track files in files_dir (sorted), without the EXCLUDED_SUFFIXES files"""
+    files = sorted(glob.glob(os.path.join(files_dir, '*.xml')))
+    return [fn for fn in files if not fn.endswith(EXCLUDED_SUFFIXES)]
+
+def manifest_path(files_dir):
+    return os.path.join(files_dir, MANIFEST_NAME)
+
+def analysis_parameters(analysis_kwargs, defaults = {}):
+    """the arguments of analyze_tracks that define the outputs (the defaults updated with
+    analysis_kwargs), as a json-compatible dict"""
+    parameters = dict(defaults, **analysis_kwargs)
+    return json.loads(json.dumps({key: value for key, value in sorted(parameters.items())
+                                  if key not in IGNORED_PARAMETERS}))
+
+def load_manifest(path):
+    """the manifest at path, or an empty one if it is missing, unreadable or from another version"""
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'version': MANIFEST_VERSION, 'files': {}}
+
+def save_manifest(manifest, path):
+    # write to a temporary file first so an interrupted run never leaves a broken manifest
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(tmp_path, path)
+    return path
+
+def _key(fn, files_dir):
+    """entries are named relative to the folder, so the folder can be moved"""
+    return os.path.relpath(os.path.abspath(fn), os.path.abspath(files_dir))
+
+def _output_path(output, files_dir):
+    return output if os.path.isabs(output) else os.path.join(files_dir, output)
+
+def is_up_to_date(manifest, fn, files_dir, parameters, retry_failed = True):
+    """True if fn was analyzed successfully with the same parameters, is unchanged and all its
+    outputs still exist (with retry_failed = False an unchanged file that failed also counts as
+    up to date). as for the xml cache, a changed size means changed content and a changed mtime
+    only does if the content hash changed as well (so most checks are one stat)"""
+
+    entry = manifest['files'].get(_key(fn, files_dir))
+    if entry is None or entry['parameters'] != parameters:
+        return False
+    if entry['status'] != 'ok' and retry_failed:
+        return False
+
+    stat = os.stat(fn)
+    if entry['size'] != stat.st_size:
+        return False
+    if entry['mtime'] != stat.st_mtime_ns and entry['hash'] != hash_file(fn):
+        return False
+
+    return all(os.path.exists(_output_path(output, files_dir)) for output in entry['outputs'])
+
+def update_manifest(manifest, record, files_dir, parameters):
+    """adds the result of batch.process_file (record) to the manifest"""
+
+    fn = record['file']
+    stat = os.stat(fn)
+    manifest['files'][_key(fn, files_dir)] = {
+        'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': hash_file(fn),
+        'parameters': parameters, 'status': record['status'], 'time': record['time'],
+        'outputs': [_key(output, files_dir) for output in record.get('outputs', [])],
+        'processed': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    return manifest
@@ -0,0 +1,151 @@
+# bkg_functions to plot the results of the trajectory analysis
+# this is the only module that imports matplotlib; core imports it lazily, only when plotting
+
+import numpy as np
+from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.backends.backend_pdf import PdfPages
+
+def plot_trajectories(table_tracks):
+    """ Shows all the tracks """
+
+    fig, ax = plt.subplots(figsize = (4,4), dpi = 120)
+    plt.xlabel('x (microns)', fontsize=10)
+    plt.ylabel('y (microns)', fontsize=10)
+    #plt.xlim([0,55])
+    #plt.ylim([0,55])
+
+    # one collection for all tracks (colored like separate plot calls)
+    segments = [columns[['POSITION_X', 'POSITION_Y']].to_numpy() for groups, columns in table_tracks.groupby('TRACK_ID')]
+    colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+    ax.add_collection(LineCollection(segments, lw = 1, colors = [colors[i % len(colors)] for i in range(len(segments))]))
+    ax.autoscale()
+    plt.title('Number of Tracks = ' + str(table_tracks.TRACK_ID.nunique()), fontsize = 9)
+    return fig
+
+def plot_velocities_distribution(vel_dist, bins = 10):
+    '''histogram of the track displacement velocities (nm/s)'''
+
+    fig = plt.figure(figsize = (4,3), dpi = 120)
+
+    counts, bins, patches = plt.hist(vel_dist, bins = bins,
+                                     color = 'seagreen', alpha = 0.8, edgecolor = 'w',
+                                     label = 'n_spots = ' + str(len(vel_dist)))
+
+    plt.xlabel('velocitities (nm/s)', fontsize = 10)
+    plt.ylabel('counts', fontsize = 10)
+    plt.legend(loc = 0, fontsize = 8, frameon = True)
+    plt.title("track displacement velocities", fontsize = 9)
+    return fig
+
+def plot_weighted_msd(fit_data, V):
+    '''mean msd (+/- std) and the fitted parabola, from the msd_weighted table'''
+
+    t_axis, msds_means, msds_std = (fit_data[name].dropna().to_numpy() for name in ['time', 'msd_mean', 'msd_std'])
+
+    fig, ax = plt.subplots(1, figsize=(4,3), dpi = 120)
+
+    ax.plot(t_axis, msds_means, '--o', markersize = 4, label= "mean MSD",
+            color = 'seagreen', markeredgecolor = 'black', markeredgewidth = 0.4)
+
+    ax.fill_between(t_axis, msds_means - msds_std, msds_means + msds_std, color='seagreen',  alpha=0.1, label="std")
+
+    ax.plot(fit_data['x_fit'], fit_data['y_fit'], color = 'crimson',
+             label = " v_fit = {:4.2f} nm/s".format(V*1000)) # velocity converted in nm/s
+
+    ax.set_xlabel('delays (s)', fontsize = 10)
+    ax.set_ylabel('MSD ($\\mu$m$^2$)', fontsize = 10)
+    plt.title("weighted MSD analysis", fontsize = 9)
+    plt.legend(frameon = False, fontsize = 8)
+    plt.tight_layout()
+    return fig
+
+def plot_single_track_msd(fits, frame_interval, plot_every = 10, bins = 10):
+    '''msd curves of every nth accepted track and the histogram of the single track velocities.
+    fits is the output of core.single_track_fits; all curves go in one line collection'''
+
+    fig, ax = plt.subplots(1, 2, figsize=(8, 3),  dpi = 120)
+
+    accepted = np.flatnonzero(fits.accepted)
+    shown = accepted[accepted % plot_every == 0] # plot only every nth curve
+    curves = []
+    for i in shown:
+        msd = fits.values[fits.offsets[i]:fits.offsets[i + 1]]
+        taus = np.arange(1, len(msd) + 1) * frame_interval # convert number of frames in seconds
+        curves.append(np.column_stack([taus, msd]))
+
+    if curves:
+        color = plt.cm.Greens(1.)
+        ax[0].add_collection(LineCollection(curves, lw = 1., alpha = 0.4, colors = [color]))
+        points = np.concatenate(curves)
+        ax[0].plot(points[:, 0], points[:, 1], 'o', markersize = 2, markeredgecolor = 'black', markeredgewidth = 0.2,
+                   alpha = 0.4, color = color)
+        ax[0].autoscale()
+
+    ax[0].set_title("single track MSD analysis", fontsize = 9)
+    ax[0].set_xlabel('delay (s)', fontsize = 10)
+    ax[0].set_ylabel('MSD ($\\mu$m$^2$)', fontsize = 10)
+
+    ax[1].hist(np.sqrt(fits.V[fits.accepted]) * 1000, bins = bins,
+               color= 'seagreen', alpha = 0.8, edgecolor = 'w',
+               label = 'n_fits = ' + str(fits.n_fits))
+
+    ax[1].set_xlabel('velocitities (nm/s)', fontsize=10)
+    ax[1].set_ylabel('counts', fontsize = 10)
+    ax[1].legend(loc = 0, fontsize = 8, frameon = True)
+    ax[1].set_title("single track MSD velocities distribution", fontsize = 9)
+    plt.subplots_adjust(wspace = 0.2)
+    plt.tight_layout()
+    return fig
+
+def plot_directional_persistence(vcorr_data):
+    '''mean directional correlation (+/- sem) per delay, from the directionality table'''
+
+    corr_t_axis, corr_means, corr_sems = (vcorr_data[name].to_numpy() for name in ['time_axis', 'corr_mean', 'corr_sem'])
+
+    fig = plt.figure(figsize=(4,3), dpi = 120)
+    plt.plot(corr_t_axis, corr_means, '-g', label = " mean_correlation")
+    plt.fill_between(corr_t_axis, corr_means - corr_sems, corr_means + corr_sems, color='seagreen',  alpha=0.1, label = "std_error")
+
+    plt.hlines(0, xmin=0, xmax=corr_t_axis.max() if len(corr_t_axis) else 0, linestyles = '--', lw = 0.5)
+    plt.legend(loc = 0, frameon = False, fontsize = 8)
+    plt.xlabel("tau (s)" , fontsize=10)
+    plt.ylabel("directional correlation", fontsize=10)
+    plt.ylim([-1, 1.1])
+    plt.title('directional persistence', fontsize = 9)
+    plt.tight_layout()
+    return fig
+
+def render_results(results, pdf_filename = None, close = False):
+    '''draws every analysis contained in a core.AnalysisResults object (same figures
+    as analyze_tracks) and saves them as a single pdf if pdf_filename is given.
+    returns the list of figures (closed already if close = True)'''
+
+    figures = []
+
+    if results.vel_dist is not None:
+        figures.append(plot_velocities_distribution(results.vel_dist, bins = results.bins))
+
+    if results.msd_fit is not None:
+        figures.append(plot_weighted_msd(results.msd_fit, results.V))
+
+    if results.single_fits is not None:
+        figures.append(plot_single_track_msd(results.single_fits, results.frame_interval,
+                                             plot_every = results.plot_every, bins = results.bins))
+
+    if results.vcorr_data is not None:
+        figures.append(plot_directional_persistence(results.vcorr_data))
+
+    if results.plot_tracks and results.track_table is not None:
+        figures.append(plot_trajectories(results.track_table))
+
+    if pdf_filename is not None:
+        with PdfPages(pdf_filename) as pdf:
+            for fig in figures:
+                pdf.savefig(fig, bbox_inches="tight")
+
+    if close:
+        for fig in figures:
+            plt.close(fig)
+
+    return figures
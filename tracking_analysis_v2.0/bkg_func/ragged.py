@@ -0,0 +1,91 @@
+# bkg_functions to store one curve per track (e.g. the single track msd curves)
+# all curves are concatenated in one values array; curve i is values[offsets[i]:offsets[i+1]]
+# and point k of every curve is at delay (k+1) * frame_interval. memory grows with the
+# number of points, not with n_tracks x longest track as a nan-padded table
+
+import json
+import numpy as np
+import pandas as pd
+
+class RaggedCurves:
+    """
+    Curves of different length (one per track) as values + offsets (CSR layout)
+    with the track id of each curve. The nan-padded wide table of previous
+    versions is built only on request (to_wide); to_long gives a compact
+    (track_id, delay, value) table for the output files.
+    """
+    def __init__(self, values, offsets, track_ids, frame_interval, name = 'msd'):
+        self.values = np.asarray(values, dtype = float)
+        self.offsets = np.asarray(offsets, dtype = np.int64)
+        self.track_ids = np.asarray(track_ids)
+        self.frame_interval = float(frame_interval)
+        self.name = name
+
+        if len(self.offsets) != len(self.track_ids) + 1 or self.offsets[-1] != len(self.values):
+            raise ValueError('offsets must have one entry per track plus one and end at len(values)')
+
+    @classmethod
+    def from_curves(cls, curves, track_ids, frame_interval, name = 'msd'):
+        """builds the ragged layout from a list of 1d arrays"""
+        offsets = np.r_[0, np.cumsum([len(curve) for curve in curves])].astype(np.int64)
+        values = np.concatenate([np.asarray(curve, dtype = float) for curve in curves] + [np.zeros(0)])
+        return cls(values, offsets, track_ids, frame_interval, name)
+
+    @classmethod
+    def from_long(cls, table, frame_interval = None, name = 'msd'):
+        """inverse of to_long (e.g. a table read back with writers.read_tables)"""
+        track_of_point = table['track_id'].to_numpy()
+        starts = np.flatnonzero(np.r_[True, track_of_point[1:] != track_of_point[:-1]])
+        if frame_interval is None:
+            frame_interval = table['delay'].iloc[0] if len(table) else 1.
+        return cls(table[name].to_numpy(), np.r_[starts, len(table)], track_of_point[starts], frame_interval, name)
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    def __getitem__(self, i):
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+    def __repr__(self):
+        return 'RaggedCurves(name={!r}, n_curves={}, n_points={}, frame_interval={})'.format(
+            self.name, len(self), len(self.values), self.frame_interval)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def point_index(self):
+        """position k of every value inside its curve"""
+        return np.arange(len(self.values)) - np.repeat(self.offsets[:-1], self.lengths)
+
+    def delays(self, i = None):
+        """delays (s) of all values, or of curve i"""
+        if i is not None:
+            return np.arange(1, len(self[i]) + 1) * self.frame_interval
+        return (self.point_index() + 1) * self.frame_interval
+
+    def to_long(self):
+        """one row per point: track_id, delay (s) and value"""
+        return pd.DataFrame({'track_id': np.repeat(self.track_ids, self.lengths),
+                             'delay': self.delays(), self.name: self.values})
+
+    def to_wide(self):
+        """nan-padded table: delay column (0) followed by one column per curve (1..n),
+        as the all_single_msd_curves sheet of previous versions"""
+        n_rows = int(self.lengths.max()) if len(self) else 0
+        table = np.full((n_rows, len(self) + 1), np.nan)
+        table[:, 0] = np.arange(1, n_rows + 1) * self.frame_interval
+        table[self.point_index(), np.repeat(np.arange(1, len(self) + 1), self.lengths)] = self.values
+        return pd.DataFrame(table)
+
+    def save(self, fn):
+        """saves the curves as npz file"""
+        meta = json.dumps({'frame_interval': self.frame_interval, 'name': self.name})
+        with open(fn, 'wb') as f:
+            np.savez(f, values = self.values, offsets = self.offsets, track_ids = self.track_ids, meta = np.array(meta))
+
+    @classmethod
+    def load(cls, fn):
+        with np.load(fn, allow_pickle = False) as data:
+            meta = json.loads(str(data['meta']))
+            return cls(data['values'], data['offsets'], data['track_ids'], meta['frame_interval'], meta['name'])
@@ -0,0 +1,248 @@
+# bkg_functions to analyze track files larger than memory
+# the xml is read in blocks of whole tracks (core.iter_xml_track_blocks); every block goes
+# through the same vectorized functions as the in-memory analysis and is then dropped.
+# per-lag statistics (msd, directional correlation) are merged as they come (see lagstats);
+# per-step and per-track outputs (step velocities, single track msd curves and fits) are
+# appended to .npy files and read back as memory maps. peak memory depends on the block
+# size and the longest track, not on the size of the file
+
+import os
+import numpy as np
+import pandas as pd
+from bkg_func import core, writers, instrument
+from bkg_func.lagstats import LagStatistics
+from bkg_func.ragged import RaggedCurves
+
+STREAM_SUFFIX = '_analyze_tracks_stream'
+BLOCK_SPOTS = 200000
+
+SINGLE_FIT_DTYPE = np.dtype([('track_id', np.int64), ('D', float), ('V', float), ('accepted', bool)])
+
+class NpyAppender:
+    """
+    Writes a 1d .npy file of unknown length chunk by chunk: the header is written
+    for length 0 and rewritten with the final length on close (numpy reserves room
+    in the header for that, see numpy.lib.format).
+    """
+    def __init__(self, fn, dtype):
+        self.fn = fn
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self._file = open(fn, 'wb')
+        self._write_header()
+        self._data_start = self._file.tell()
+
+    def _write_header(self):
+        header = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': (self.length,)}
+        np.lib.format.write_array_header_1_0(self._file, header)
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype = self.dtype)
+        self._file.write(values.tobytes())
+        self.length += len(values)
+
+    def close(self):
+        self._file.seek(0)
+        self._write_header()
+        if self._file.tell() != self._data_start:
+            raise RuntimeError('the .npy header of {} changed size'.format(self.fn))
+        self._file.close()
+        return self.fn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+def stream_path(filename):
+    """folder of the streamed per-step and per-track outputs of a given xml file"""
+    return filename[:-4] + STREAM_SUFFIX
+
+def _load(folder, name):
+    return np.load(os.path.join(folder, name + '.npy'), mmap_mode = 'r')
+
+def histogram(values, bins = 10, chunk_size = 1 << 22):
+    """np.histogram(values, bins) of a (memory mapped) array, chunk_size values at a time.
+    nan values are left out (as matplotlib's hist does). returns the counts and the bin edges"""
+
+    low, high = np.inf, -np.inf
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        chunk = chunk[np.isfinite(chunk)]
+        if len(chunk):
+            low, high = min(low, chunk.min()), max(high, chunk.max())
+
+    if low > high: # no finite values
+        return np.histogram(np.zeros(0), bins = bins)
+
+    edges = np.histogram_bin_edges(np.array([low, high]), bins = bins) # same edges as np.histogram(values, bins)
+    counts = np.zeros(len(edges) - 1, dtype = np.int64)
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        counts += np.histogram(chunk[np.isfinite(chunk)], bins = edges)[0]
+
+    return counts, edges
+
+def stream_tracks(filename, track_displacement = True, msd_weighted = True, msd_single_track = True,
+                  directionality = True, clip = 0.5, plot_every = 10, bins = 10, max_frame_gap = 0,
+                  block_spots = BLOCK_SPOTS, output_dir = None, timer = None):
+    '''runs the analyses of compute_tracks on an xml file read in blocks of about block_spots
+    spots (whole tracks), without ever holding the whole track table. step velocities and
+    single track msd curves / fits are written as .npy files in output_dir (default: next
+    to the xml, see stream_path) and come back as memory maps. returns an AnalysisResults
+    (track_table = None) whose V, D, histograms, single track fits and curves are the same
+    as compute_tracks; the per-lag statistics are summed block by block, so they (and the
+    msd fit and correlation curve) only differ by the order of floating point additions'''
+
+    timer = instrument.StageTimer() if timer is None else timer
+    output_dir = stream_path(filename) if output_dir is None else output_dir
+    os.makedirs(output_dir, exist_ok = True)
+
+    def output(name, dtype):
+        return NpyAppender(os.path.join(output_dir, name + '.npy'), dtype)
+
+    msd_stats, corr_stats = None, None
+    n_spots, n_tracks, max_lag, curve_end = 0, 0, 0, 0
+    coords = ['POSITION_X', 'POSITION_Y']
+
+    with timer.stage('stream', file_size = os.path.getsize(filename), block_spots = block_spots) as stage:
+        print('... streaming track analysis ...')
+        vel_file = output('vels_disp', float)
+        fits_file = output('single_track_fits', SINGLE_FIT_DTYPE)
+        single_vel_file = output('msd_single_vel_hist', float)
+        curves_file = output('all_single_msd_curves_values', float)
+        curve_offsets_file = output('all_single_msd_curves_offsets', np.int64)
+        curve_offsets_file.append([0])
+
+        with vel_file, fits_file, single_vel_file, curves_file, curve_offsets_file:
+            for columns, header in core.iter_xml_track_blocks(filename, block_spots = block_spots):
+                frame_interval = float(header['frameInterval'])
+                if len(columns['FRAME']) == 0:
+                    continue
+
+                track_ids, positions, frames, offsets = core.tracks_to_arrays(pd.DataFrame(columns), coords = coords)
+                n_spots, n_tracks = n_spots + len(frames), n_tracks + len(track_ids)
+                max_lag = max(max_lag, int(np.diff(offsets).max()) - 1)
+
+                if track_displacement == True:
+                    vel_file.append(core.step_velocities(positions, frames, offsets, frame_interval,
+                                                         max_frame_gap = max_frame_gap) * 1000) # in nm/s
+
+                if msd_weighted == True:
+                    block_stats = LagStatistics(*core.ensemble_msd_statistics(positions, frames, offsets),
+                                                frame_interval, kind = 'msd')
+                    msd_stats = block_stats if msd_stats is None else msd_stats + block_stats
+
+                if msd_single_track == True:
+                    all_msds = [core.msd_fft(positions[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+                    curve_lengths = np.array([len(msd) for msd in all_msds], dtype = np.int64)
+                    curve_offsets = np.r_[0, np.cumsum(curve_lengths)]
+                    curve_values = np.concatenate(all_msds + [np.zeros(0)])
+
+                    D, V, cov, negative = core.fit_parabola_batch(curve_values, curve_offsets, frame_interval, clip = clip)
+                    fits = np.empty(len(track_ids), dtype = SINGLE_FIT_DTYPE)
+                    fits['track_id'], fits['D'], fits['V'] = track_ids, D, V
+                    fits['accepted'] = core.fitted_and_accepted(V, negative)[1]
+
+                    fits_file.append(fits)
+                    single_vel_file.append(np.sqrt(V[fits['accepted']]) * 1000)
+                    curves_file.append(curve_values)
+                    curve_offsets_file.append(curve_end + curve_offsets[1:])
+                    curve_end += len(curve_values)
+
+                if directionality == True:
+                    block_stats = LagStatistics(*core.ensemble_correlation_statistics(positions, offsets),
+                                                frame_interval, kind = 'directionality')
+                    corr_stats = block_stats if corr_stats is None else corr_stats + block_stats
+
+        stage.update(n_spots = n_spots, n_tracks = n_tracks, max_lag = max_lag)
+
+    print('\nphysical units: {}, {}'.format(header['spaceUnits'], header['timeUnits']))
+    print('number of tracks: {}'.format(n_tracks))
+    print('frame interval: {} \n'.format(frame_interval))
+
+    results = core.AnalysisResults(filename, frame_interval, str(header['timeUnits']), str(header['spaceUnits']), None,
+                                   clip = clip, plot_every = plot_every, bins = bins, plot_tracks = False)
+    results.timer = timer
+
+    if track_displacement == True:
+        results.vel_dist = _load(output_dir, 'vels_disp')
+
+    if msd_weighted == True:
+        if msd_stats is None: # no tracks: nothing to fit
+            results.msd_stats = LagStatistics(np.zeros(0), np.zeros(0), np.zeros(0), frame_interval, kind = 'msd')
+            results.V, results.D = np.nan, np.nan
+            results.msd_fit = pd.DataFrame(columns = core.MSD_FIT_COLUMNS, dtype = float)
+        else:
+            results.msd_stats = msd_stats
+            results.V, results.D, results.msd_fit = core.msd_velocity_from_statistics(msd_stats, clip = clip, plot = False)
+
+    if msd_single_track == True:
+        fits = _load(output_dir, 'single_track_fits')
+        values, offsets = _load(output_dir, 'all_single_msd_curves_values'), _load(output_dir, 'all_single_msd_curves_offsets')
+        n_fits = int(core.fitted_and_accepted(fits['V'], fits['V'] < 0)[0].sum()) # as single_track_fits
+        results.single_fits = core.SingleTrackFits(fits['track_id'], values, offsets, fits['D'], fits['V'], None,
+                                                   fits['accepted'], n_fits)
+        results.single_velocities = _load(output_dir, 'msd_single_vel_hist')
+        results.single_curves = RaggedCurves(values, offsets, fits['track_id'], frame_interval)
+
+    if directionality == True:
+        if corr_stats is None:
+            corr_stats = LagStatistics(np.zeros(0), np.zeros(0), np.zeros(0), frame_interval, kind = 'directionality')
+        results.corr_stats = corr_stats
+        results.vcorr_data = core.directional_persistence_from_statistics(corr_stats, plot = False)
+
+    return results
+
+def stream_tables(results):
+    """the small output tables of streamed results: weighted msd fit, directional correlation
+    and the histograms of the step and single track velocities (the per-step and per-track
+    values stay in the .npy files)"""
+
+    tables = {}
+    if results.vel_dist is not None:
+        counts, edges = histogram(results.vel_dist, bins = results.bins)
+        tables['vels_disp_histogram'] = pd.DataFrame({'bin_start': edges[:-1], 'bin_end': edges[1:], 'count': counts})
+    if results.msd_fit is not None:
+        tables['msd_weighted'] = results.msd_fit
+    if results.single_velocities is not None:
+        counts, edges = histogram(results.single_velocities, bins = results.bins)
+        tables['msd_single_vel_histogram'] = pd.DataFrame({'bin_start': edges[:-1], 'bin_end': edges[1:], 'count': counts})
+    if results.vcorr_data is not None:
+        tables['directionality'] = results.vcorr_data
+    return tables
+
+def analyze_tracks_streaming(filename, track_displacement = True, msd_weighted = True, msd_single_track = True,
+                             directionality = True, clip = 0.5, plot_every = 10, bins = 10, max_frame_gap = 0,
+                             block_spots = BLOCK_SPOTS, output_format = 'xlsx', save_statistics = False,
+                             stage_callback = None, save_timings = False):
+    '''analyze_tracks for files larger than memory (headless): runs stream_tracks and writes
+    the small tables (see stream_tables) in output_format next to the xml, as analyze_tracks
+    does. the step velocities, single track fits (track_id, D, V, accepted), velocities and
+    msd curves (values + offsets, see ragged) are the .npy files of stream_path(filename).
+    figures can be drawn afterwards with plotting.render_results(results) (this loads the
+    per-step and per-track values). returns the AnalysisResults'''
+
+    timer = instrument.StageTimer(stage_callback)
+    results = stream_tracks(filename, track_displacement = track_displacement, msd_weighted = msd_weighted,
+                            msd_single_track = msd_single_track, directionality = directionality, clip = clip,
+                            plot_every = plot_every, bins = bins, max_frame_gap = max_frame_gap,
+                            block_spots = block_spots, timer = timer)
+    results.outputs.append(stream_path(filename))
+
+    with timer.stage('writing', output_format = output_format):
+        results.outputs.append(writers.write_tables(stream_tables(results), filename, output_format = output_format))
+
+        if save_statistics == True:
+            if results.msd_stats is not None:
+                results.msd_stats.save(filename[:-4] + '_msd_stats.npz')
+                results.outputs.append(filename[:-4] + '_msd_stats.npz')
+            if results.corr_stats is not None:
+                results.corr_stats.save(filename[:-4] + '_directionality_stats.npz')
+                results.outputs.append(filename[:-4] + '_directionality_stats.npz')
+
+    if save_timings == True:
+        results.outputs.append(timer.save(filename[:-4] + '_analyze_tracks_timings.json', file = filename))
+
+    return results
@@ -0,0 +1,124 @@
+# bkg_functions to generate synthetic trackmate xml files with known ground truth
+# every track is a directed random walk: constant speed V (space units / time unit) in a
+# random direction plus free diffusion D; the expected msd is 4*D*t + V^2*t^2 in 2d, so
+# the weighted msd fit (parabola(t, D, V)) should recover D_fit = 4*D and sqrt(V_fit) = V.
+# the file is written track by track (in chunks), so very large files never sit in memory
+
+import os
+import json
+import numpy as np
+
+def track_lengths(n_tracks, length, rng):
+    """number of spots per track: an int (all equal), ('geometric', mean, min), ('uniform', low, high)
+    (inclusive) or an array of lengths"""
+
+    if np.isscalar(length):
+        return np.full(n_tracks, int(length), dtype = np.int64)
+
+    if isinstance(length, tuple) and length[0] == 'geometric':
+        mean, minimum = length[1], length[2] if len(length) > 2 else 2
+        return minimum + rng.geometric(1 / max(mean - minimum + 1, 1), n_tracks) - 1
+
+    if isinstance(length, tuple) and length[0] == 'uniform':
+        return rng.integers(length[1], length[2] + 1, n_tracks)
+
+    lengths = np.asarray(length, dtype = np.int64)
+    if len(lengths) != n_tracks:
+        raise ValueError('need one length per track ({}), got {}'.format(n_tracks, len(lengths)))
+    return lengths
+
+def simulate_tracks(lengths, V = 0.05, D = 0.01, frame_interval = 2., gap_probability = 0., max_frame_gap = 1,
+                    field_size = 50., n_frames = None, rng = None):
+    """positions (n_spots x 2) and frames of directed random walks with the given lengths
+    (spots per track). with gap_probability > 0 a detection is missed (1 to max_frame_gap
+    frames skipped) before a spot with that probability; the walk continues during the
+    gap. tracks start at a random frame if n_frames is given (so that they end before
+    n_frames, unless they are longer than that), otherwise at frame 0"""
+
+    rng = np.random.default_rng(rng)
+    lengths = np.asarray(lengths, dtype = np.int64)
+    if (lengths < 1).any():
+        raise ValueError('every track needs at least one spot')
+
+    n_tracks, n_spots = len(lengths), int(lengths.sum())
+    starts = np.r_[0, np.cumsum(lengths)[:-1]].astype(np.int64)
+    first = np.zeros(n_spots, dtype = bool)
+    first[starts] = True
+
+    # frames elapsed since the previous spot of the track
+    increments = np.ones(n_spots, dtype = np.int64)
+    if gap_probability > 0:
+        gaps = rng.random(n_spots) < gap_probability
+        increments[gaps] += rng.integers(1, max_frame_gap + 1, int(gaps.sum()))
+
+    angle = np.repeat(rng.uniform(0, 2 * np.pi, n_tracks), lengths)
+    dt = increments * frame_interval
+    steps = V * dt[:, None] * np.stack([np.cos(angle), np.sin(angle)], axis = 1)
+    steps += rng.normal(size = (n_spots, 2)) * np.sqrt(2 * D * dt)[:, None]
+
+    # first spot of each track: random start position and frame
+    steps[first] = rng.uniform(0, field_size, size = (n_tracks, 2))
+    increments[first] = 0
+    if n_frames is not None and n_tracks:
+        duration = np.add.reduceat(increments, starts) # frames from first to last spot
+        increments[first] = rng.integers(0, np.maximum(n_frames - duration, 1))
+
+    # cumulative sums restarted at every track
+    positions = np.cumsum(steps, axis = 0)
+    frames = np.cumsum(increments)
+    positions -= np.repeat(positions[starts] - steps[starts], lengths, axis = 0)
+    frames -= np.repeat(frames[starts] - increments[starts], lengths)
+
+    return positions, frames
+
+def ground_truth(V, D, frame_interval, n_dims = 2):
+    """parameters of the simulation and the values the analyses should recover"""
+    return {'V': V, 'D': D, 'frame_interval': frame_interval,
+            'msd_fit_D': 2 * n_dims * D,            # linear msd coefficient (D of parabola(t, D, V))
+            'msd_fit_V': V ** 2,                    # quadratic msd coefficient
+            'velocity_nm': V * 1000,                # reported velocity (sqrt of the quadratic coefficient, nm)
+            'msd_formula': 'msd(t) = {} * D * t + V^2 * t^2'.format(2 * n_dims)}
+
+def write_trackmate_xml(fn, n_tracks = 1000, length = 20, V = 0.05, D = 0.01, frame_interval = 2.,
+                        gap_probability = 0., max_frame_gap = 1, field_size = 50., n_frames = None,
+                        space_units = 'micron', time_units = 'sec', seed = 0, chunk_size = 2000,
+                        save_truth = True):
+    """writes a trackmate <Tracks> xml file (as read by core.read_xml_tracks) of n_tracks
+    directed random walks, chunk_size tracks at a time. length is the number of spots per
+    track (see track_lengths), V in space units / time unit, D in space units^2 / time unit.
+    returns the ground truth (see ground_truth) with the number of tracks and spots, which
+    is also saved as fn[:-4] + '_truth.json' if save_truth = True"""
+
+    rng = np.random.default_rng(seed)
+    lengths = track_lengths(n_tracks, length, rng)
+
+    with open(fn, 'w', encoding = 'utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<Tracks nTracks="{}" spaceUnits="{}" frameInterval="{}" timeUnits="{}" from="bkg_func.synthetic">\n'.format(
+            n_tracks, space_units, frame_interval, time_units))
+
+        for chunk_start in range(0, n_tracks, chunk_size):
+            chunk = lengths[chunk_start:chunk_start + chunk_size]
+            positions, frames = simulate_tracks(chunk, V = V, D = D, frame_interval = frame_interval,
+                                                gap_probability = gap_probability, max_frame_gap = max_frame_gap,
+                                                field_size = field_size, n_frames = n_frames, rng = rng)
+
+            detections = ['    <detection t="{}" x="{!r}" y="{!r}" z="0.0" />\n'.format(*spot)
+                          for spot in zip(frames.tolist(), positions[:, 0].tolist(), positions[:, 1].tolist())]
+            offsets = np.r_[0, np.cumsum(chunk)]
+            for n, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+                f.write('  <particle nSpots="{}">\n'.format(chunk[n]))
+                f.write(''.join(detections[start:end]))
+                f.write('  </particle>\n')
+
+        f.write('</Tracks>\n')
+
+    truth = ground_truth(V, D, frame_interval)
+    truth.update({'n_tracks': int(n_tracks), 'n_spots': int(lengths.sum()), 'gap_probability': gap_probability,
+                  'max_frame_gap': max_frame_gap, 'seed': seed, 'file_size': os.path.getsize(fn)})
+
+    if save_truth:
+        with open(fn[:-4] + '_truth.json', 'w') as f:
+            json.dump(truth, f, indent = 1)
+
+    return truth
@@ -0,0 +1,125 @@
+# bkg_functions to write (and read back) the output tables of analyze_tracks
+# every format stores the same named tables (vels_disp, msd_weighted, msd_single_vel_hist,
+# all_single_msd_curves, directionality); xlsx is kept for compatibility, the other
+# formats are much faster to write and to reload
+
+import os
+import json
+import importlib.util
+import numpy as np
+import pandas as pd
+
+OUTPUT_SUFFIX = '_analyze_tracks_output'
+HEADERLESS = ['vels_disp', 'msd_single_vel_hist'] # single column tables, written without header in xlsx
+
+def output_path(filename, output_format = 'xlsx'):
+    """output file (xlsx, npz) or folder (one file per table) of a given xml file"""
+    base = filename[:-4] + OUTPUT_SUFFIX
+    return base + ('.' if output_format in ('xlsx', 'npz') else '_') + output_format
+
+def _as_frame(table):
+    """tables with string column names (required by parquet / feather)"""
+    table = table.to_frame() if isinstance(table, pd.Series) else table
+    table = table.reset_index(drop = True)
+    table.columns = [str(column) for column in table.columns]
+    return table
+
+def write_xlsx(tables, path):
+    with pd.ExcelWriter(path) as excel_sheet:
+        for name, table in tables.items():
+            table.to_excel(excel_sheet, sheet_name = name, index=False, header = name not in HEADERLESS)
+
+def write_npz(tables, path):
+    # one 2d array per table with its numeric columns, one string array per other
+    # column (<table>__<column>) and the names of all columns in order
+    arrays = {}
+    for name, table in tables.items():
+        table = _as_frame(table)
+        numeric = [pd.api.types.is_numeric_dtype(table[column]) for column in table.columns]
+        arrays[name] = table.loc[:, numeric].to_numpy(dtype = float)
+        for column in table.columns[[not is_numeric for is_numeric in numeric]]:
+            arrays[name + '__' + column] = table[column].to_numpy(dtype = str)
+        arrays[name + '__columns'] = np.array(json.dumps(list(table.columns)))
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+def _write_per_table(extension, write):
+    def write_tables_to_folder(tables, path):
+        os.makedirs(path, exist_ok = True)
+        for name, table in tables.items():
+            write(_as_frame(table), os.path.join(path, name + extension))
+    return write_tables_to_folder
+
+def _require_pyarrow(output_format):
+    if importlib.util.find_spec('pyarrow') is None:
+        raise ImportError("output_format '{}' needs pyarrow (pip install pyarrow); "
+                          "use 'csv' or 'npz' without it".format(output_format))
+
+def write_parquet(tables, path):
+    _require_pyarrow('parquet')
+    _write_per_table('.parquet', lambda table, fn: table.to_parquet(fn, index = False))(tables, path)
+
+def write_feather(tables, path):
+    _require_pyarrow('feather')
+    _write_per_table('.feather', lambda table, fn: table.to_feather(fn))(tables, path)
+
+write_csv = _write_per_table('.csv.gz', lambda table, fn: table.to_csv(fn, index = False, compression = 'gzip'))
+
+WRITERS = {'xlsx': write_xlsx, 'parquet': write_parquet, 'feather': write_feather, 'csv': write_csv, 'npz': write_npz}
+
+def write_tables(tables, filename, output_format = 'xlsx'):
+    """writes the named tables ({name: DataFrame or Series}) of the xml file `filename`
+    in one of the WRITERS formats and returns the output file / folder"""
+
+    if output_format not in WRITERS:
+        raise ValueError("output_format must be one of {}, got '{}'".format(', '.join(WRITERS), output_format))
+
+    path = output_path(filename, output_format)
+    WRITERS[output_format](tables, path)
+    return path
+
+def read_tables(path):
+    """reads the tables written by write_tables (xlsx or npz file, or folder of parquet,
+    feather or csv.gz files) back as {name: DataFrame}"""
+
+    if path.endswith('.xlsx'):
+        sheets = pd.read_excel(path, sheet_name = None, header = None)
+        return {name: _header_from_first_row(sheet, name) for name, sheet in sheets.items()}
+
+    if path.endswith('.npz'):
+        with np.load(path, allow_pickle = False) as data:
+            return {name: _npz_table(data, name) for name in data.files if '__' not in name}
+
+    readers = {'.parquet': pd.read_parquet, '.feather': pd.read_feather,
+               '.csv.gz': lambda fn: pd.read_csv(fn, compression = 'gzip', float_precision = 'round_trip')}
+    tables = {}
+    for fn in sorted(os.listdir(path)):
+        for extension, read in readers.items():
+            if fn.endswith(extension):
+                tables[fn[:-len(extension)]] = read(os.path.join(path, fn))
+
+    order = ['vels_disp', 'msd_weighted', 'msd_bootstrap', 'msd_single_vel_hist', 'all_single_msd_curves', 'directionality']
+    return dict(sorted(tables.items(), key = lambda item: order.index(item[0]) if item[0] in order else len(order)))
+
+def _header_from_first_row(sheet, name):
+    if name in HEADERLESS:
+        return sheet.astype(float).set_axis(['velocity'], axis = 1)
+
+    # numeric headers (track numbers) come back as floats
+    columns = [str(int(column)) if isinstance(column, float) and column.is_integer() else str(column) for column in sheet.iloc[0]]
+    return sheet.iloc[1:].reset_index(drop = True).set_axis(columns, axis = 1).apply(_float_or_string)
+
+def _float_or_string(column):
+    # numeric columns as float, the others (e.g. the parameter names of msd_bootstrap) as strings
+    try:
+        return pd.to_numeric(column).astype(float)
+    except (ValueError, TypeError):
+        return column.astype(str)
+
+def _npz_table(data, name):
+    columns = json.loads(str(data[name + '__columns']))
+    strings = {column: data[name + '__' + column] for column in columns if name + '__' + column in data.files}
+    table = pd.DataFrame(data[name], columns = [column for column in columns if column not in strings])
+    for column, values in strings.items():
+        table[column] = values
+    return table[columns]
@@ -8,9 +8,9 @@ with open("README.md", "rb") as f:
  
 setup(
     name = "analyze_tracks",
-    packages = ["analyze_tracks"],
+    packages = ["bkg_func"],
     entry_points = {
-        "console_scripts": ['analyze_tracks_cli = analyze_tracks.main_cli:main']
+        "console_scripts": ['analyze_tracks_cli = bkg_func.main_cli:main']
         },
     version = "0.1",
     description = description,
@@ -0,0 +1,20 @@
+# tests of bkg_func, run from the tracking_analysis_v2.0 folder with: python -m pytest tests
+
+import os
+import sys
+
+import pytest
+import matplotlib
+matplotlib.use('Agg')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bkg_func import synthetic
+
+@pytest.fixture
+def write_xml(tmp_path):
+    """writes a synthetic trackmate file (see synthetic.write_trackmate_xml) into tmp_path"""
+    def write(name = 'tracks.xml', **kwargs):
+        fn = str(tmp_path / name)
+        synthetic.write_trackmate_xml(fn, save_truth = False, **kwargs)
+        return fn
+    return write
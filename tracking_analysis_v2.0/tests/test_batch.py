@@ -0,0 +1,14 @@
+# batch processing passes every analysis option on to analyze_tracks
+
+import os
+from types import SimpleNamespace
+
+from bkg_func import batch
+
+def test_options_reach_analyze_tracks(write_xml, monkeypatch):
+    fn = write_xml(n_tracks = 20, length = 5)
+    calls = []
+    monkeypatch.setattr(batch.core, 'analyze_tracks', lambda xml_file, **kwargs: calls.append(kwargs) or SimpleNamespace(outputs = []))
+    records = batch.run_batch_processing(os.path.dirname(fn), n_bootstrap = 10, bootstrap_workers = 3, output_format = 'npz')
+    assert [record['status'] for record in records] == ['ok'] and len(calls) == 1
+    assert calls[0]['n_bootstrap'] == 10 and calls[0]['bootstrap_workers'] == 3 and calls[0]['output_format'] == 'npz'
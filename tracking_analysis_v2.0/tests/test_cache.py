@@ -0,0 +1,43 @@
+# parsed-xml cache: hits, misses and touched files
+
+import os
+
+import numpy as np
+
+from bkg_func import cache, core
+
+def test_round_trip(write_xml):
+    fn = write_xml(n_tracks = 20, length = 5)
+    table = core.read_xml_tracks(fn, cache = True)[0]
+    assert os.path.exists(cache.cache_path(fn)) and os.path.exists(cache.meta_path(cache.cache_path(fn)))
+    assert core.read_xml_tracks(fn, cache = True)[0].equals(table)
+
+def test_changed_file_is_a_miss(write_xml):
+    fn = write_xml(n_tracks = 20, length = 5)
+    core.read_xml_tracks(fn, cache = True)
+    write_xml(n_tracks = 21, length = 5)
+    assert cache.load_cache(fn) is None
+
+def test_touched_file_updates_only_the_metadata(write_xml, monkeypatch):
+    fn = write_xml(n_tracks = 20, length = 5)
+    core.read_xml_tracks(fn, cache = True)
+    path = cache.cache_path(fn)
+    inode = os.stat(path).st_ino
+
+    stat = os.stat(fn)
+    os.utime(fn, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    hashed = []
+    hash_file = cache.hash_file
+    monkeypatch.setattr(cache, 'hash_file', lambda fn: hashed.append(fn) or hash_file(fn))
+    columns, _ = cache.load_cache(fn)
+    assert cache.load_cache(fn) is not None
+    assert len(hashed) == 1                  # the new mtime was stored after the first hit
+    assert os.stat(path).st_ino == inode     # the npz was not rewritten
+    np.testing.assert_array_equal(columns['FRAME'], core.read_xml_tracks(fn)[0]['FRAME'])
+
+def test_invalidate_cache(write_xml):
+    fn = write_xml(n_tracks = 20, length = 5)
+    core.read_xml_tracks(fn, cache = True)
+    cache.invalidate_cache(fn)
+    assert not os.path.exists(cache.cache_path(fn)) and not os.path.exists(cache.meta_path(cache.cache_path(fn)))
@@ -0,0 +1,24 @@
+# files without any displacement: no tracks at all, or tracks of a single spot
+
+import numpy as np
+import pytest
+
+from bkg_func import core, streaming
+
+@pytest.fixture(params = [dict(n_tracks = 0), dict(n_tracks = 5, length = 1)], ids = ['empty', 'single_spot'])
+def degenerate_xml(request, write_xml):
+    return write_xml(**request.param)
+
+def check_no_fit(results):
+    assert np.isnan(results.V) and np.isnan(results.D)
+    assert len(results.msd_fit) == 0
+    assert list(results.msd_fit.columns) == core.MSD_FIT_COLUMNS
+
+def test_compute_tracks(degenerate_xml):
+    check_no_fit(core.compute_tracks(degenerate_xml))
+
+def test_analyze_tracks_streaming(degenerate_xml):
+    check_no_fit(streaming.analyze_tracks_streaming(degenerate_xml, output_format = 'npz'))
+
+def test_analyze_tracks(degenerate_xml):
+    check_no_fit(core.analyze_tracks(degenerate_xml, headless = True, output_format = 'npz'))
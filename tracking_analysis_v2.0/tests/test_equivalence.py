@@ -0,0 +1,64 @@
+# the fast implementations give the same results as the original (validation) ones
+
+import numpy as np
+import pytest
+
+from bkg_func import bootstrap, core, streaming, synthetic
+
+@pytest.fixture(scope = 'module')
+def tracks(tmp_path_factory):
+    """synthetic file with frame gaps and tracks of different lengths: (filename, table, frame_interval)"""
+    fn = str(tmp_path_factory.mktemp('equivalence') / 'tracks.xml')
+    synthetic.write_trackmate_xml(fn, n_tracks = 60, length = ('geometric', 12, 1), gap_probability = 0.1, max_frame_gap = 2,
+                                  save_truth = False)
+    table, frame_interval, _, _ = core.read_xml_tracks(fn)
+    return fn, table, frame_interval
+
+def assert_same_statistics(stats, reference):
+    assert len(stats) == len(reference)
+    for name in ('counts', 'sums', 'sumsqs'):
+        np.testing.assert_allclose(getattr(stats, name), getattr(reference, name), rtol = 1e-10, atol = 1e-12)
+
+def test_msd_statistics(tracks):
+    fn, table, frame_interval = tracks
+    assert_same_statistics(core.msd_statistics(table, frame_interval),
+                           core.msd_statistics(table, frame_interval, method = 'dictionary'))
+
+@pytest.mark.parametrize('fft_min_length', [512, 2], ids = ['direct', 'fft'])
+def test_directional_statistics(tracks, fft_min_length):
+    fn, table, frame_interval = tracks
+    assert_same_statistics(core.directional_statistics(table, frame_interval, fft_min_length = fft_min_length),
+                           core.directional_statistics(table, frame_interval, method = 'dictionary'))
+
+def test_single_track_msd_fft_and_closed_form_fit(tracks):
+    fn, table, frame_interval = tracks
+    fits = core.single_track_fits(table, frame_interval)
+    reference = core.single_track_fits(table, frame_interval, method = 'loop', fit = 'curve_fit')
+
+    np.testing.assert_array_equal(fits.track_ids, reference.track_ids)
+    np.testing.assert_array_equal(fits.offsets, reference.offsets)
+    np.testing.assert_allclose(fits.values, reference.values, rtol = 1e-10, atol = 1e-12)
+    np.testing.assert_array_equal(fits.accepted, reference.accepted)
+    assert fits.n_fits == reference.n_fits
+    np.testing.assert_allclose(fits.D, reference.D, rtol = 1e-6, atol = 1e-9)
+    np.testing.assert_allclose(fits.V, reference.V, rtol = 1e-6, atol = 1e-9)
+
+def test_bootstrap_does_not_depend_on_workers(tracks):
+    fn, table, frame_interval = tracks
+    serial = bootstrap.bootstrap_msd_fit(table, frame_interval, n_replicates = 40, chunk_size = 10, seed = 3)
+    parallel = bootstrap.bootstrap_msd_fit(table, frame_interval, n_replicates = 40, chunk_size = 10, seed = 3, n_workers = 2)
+    np.testing.assert_array_equal(serial.D_replicates, parallel.D_replicates)
+    np.testing.assert_array_equal(serial.V_replicates, parallel.V_replicates)
+
+def test_streaming_matches_in_memory(tracks, tmp_path):
+    fn, table, frame_interval = tracks
+    results = core.compute_tracks(fn)
+    streamed = streaming.stream_tracks(fn, block_spots = 100, output_dir = str(tmp_path))
+
+    assert streamed.V == pytest.approx(results.V, rel = 1e-9) and streamed.D == pytest.approx(results.D, rel = 1e-9)
+    np.testing.assert_allclose(streamed.msd_fit.to_numpy(), results.msd_fit.to_numpy(), rtol = 1e-9)
+    np.testing.assert_allclose(np.sort(streamed.vel_dist), np.sort(np.asarray(results.vel_dist)), rtol = 1e-12)
+    np.testing.assert_allclose(streamed.single_velocities, results.single_velocities, rtol = 1e-12)
+    np.testing.assert_array_equal(streamed.single_fits.accepted, results.single_fits.accepted)
+    assert streamed.single_fits.n_fits == results.single_fits.n_fits
+    np.testing.assert_allclose(streamed.vcorr_data.to_numpy(), results.vcorr_data.to_numpy(), rtol = 1e-9, atol = 1e-12)
@@ -0,0 +1,35 @@
+# every output format reads back the tables of analyze_tracks, including the bootstrap table
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from bkg_func import core, synthetic, writers
+
+@pytest.fixture(scope = 'module')
+def results(tmp_path_factory):
+    fn = str(tmp_path_factory.mktemp('writers') / 'tracks.xml')
+    synthetic.write_trackmate_xml(fn, n_tracks = 50, length = 12, save_truth = False)
+    return core.compute_tracks(fn, n_bootstrap = 20)
+
+@pytest.mark.parametrize('output_format', sorted(writers.WRITERS))
+def test_round_trip(results, output_format, tmp_path):
+    if output_format in ('parquet', 'feather'):
+        pytest.importorskip('pyarrow')
+
+    tables = results.tables()
+    assert 'msd_bootstrap' in tables
+    read = writers.read_tables(writers.write_tables(tables, str(tmp_path / 'tracks.xml'), output_format = output_format))
+    assert list(read) == list(tables)
+
+    for name, table in tables.items():
+        table, table_read = writers._as_frame(table), read[name]
+        assert len(table_read) == len(table)
+        if name not in writers.HEADERLESS:
+            assert list(table_read.columns) == list(table.columns)
+        for column, column_read in zip(table.columns, table_read.columns):
+            if pd.api.types.is_numeric_dtype(table[column]):
+                np.testing.assert_allclose(table_read[column_read].to_numpy(dtype = float),
+                                           table[column].to_numpy(dtype = float))
+            else:
+                assert table_read[column_read].astype(str).tolist() == table[column].astype(str).tolist()